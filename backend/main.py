@@ -1,11 +1,87 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import time
+import base64
 import asyncio
+import json
+import os
+import pickle
+import re
+import math
+import numbers
+import hashlib
+import importlib.util
+import itertools
+import csv
+import io
+import zlib
+import decimal
+import datetime
+import socket
+import tempfile
+import threading
+import uuid
+import sqlite3
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED
 from urllib.parse import quote_plus, unquote_plus
 
+# Connection pool settings (can be overridden with environment variables)
+POOL_MIN_SIZE = int(os.getenv("QP_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("QP_POOL_MAX_SIZE", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("QP_POOL_IDLE_TIMEOUT", "300"))  # seconds
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("QP_POOL_CHECKOUT_TIMEOUT", "30"))  # seconds
+POOL_PING_AFTER = float(os.getenv("QP_POOL_PING_AFTER", "5"))  # ping idle connections older than this
+MONGO_MAX_CLIENTS = int(os.getenv("QP_MONGO_MAX_CLIENTS", "20"))
+MONGO_IDLE_TIMEOUT = float(os.getenv("QP_MONGO_IDLE_TIMEOUT", "600"))  # seconds
+MONGO_FLATTEN_DEPTH = int(os.getenv("QP_MONGO_FLATTEN_DEPTH", "2"))  # levels of sub-documents expanded into dotted columns
+MONGO_RAW_BSON = os.getenv("QP_MONGO_RAW_BSON", "1") != "0"  # read query results as RawBSONDocument, decoded while flattening
+RESULT_CACHE_MAX_BYTES = int(os.getenv("QP_RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("QP_RESULT_CACHE_TTL", "60"))  # base TTL in seconds
+RESULT_CACHE_MAX_TTL = float(os.getenv("QP_RESULT_CACHE_MAX_TTL", "600"))  # seconds
+SCHEMA_CACHE_MAX_ENTRIES = int(os.getenv("QP_SCHEMA_CACHE_MAX_ENTRIES", "64"))
+SCHEMA_FINGERPRINT_TTL = float(os.getenv("QP_SCHEMA_FINGERPRINT_TTL", "10"))  # trust a cached schema this long without re-checking
+EXECUTOR_WORKERS = int(os.getenv("QP_EXECUTOR_WORKERS", "8"))  # blocking driver calls running at once, per backend
+EXECUTOR_QUEUE_SIZE = int(os.getenv("QP_EXECUTOR_QUEUE_SIZE", "32"))  # calls allowed to wait for a worker, per backend
+QUERY_ENGINE = os.getenv("QP_QUERY_ENGINE", "threads").lower()  # 'threads' or 'asyncio'
+ASYNC_POOL_MAX_SIZE = int(os.getenv("QP_ASYNC_POOL_MAX_SIZE", "100"))  # connections per identity with the asyncio engine
+CONNECTION_PROBE_TIMEOUT = float(os.getenv("QP_CONNECTION_PROBE_TIMEOUT", "3"))  # seconds for the DNS/TCP reachability probe
+DIAGNOSTICS_WORKERS = int(os.getenv("QP_DIAGNOSTICS_WORKERS", "16"))  # connection tests running at once
+DISCONNECT_POLL_INTERVAL = float(os.getenv("QP_DISCONNECT_POLL_INTERVAL", "0.5"))  # seconds between client disconnect checks
+STATEMENT_TIMEOUT = float(os.getenv("QP_STATEMENT_TIMEOUT", "30"))  # seconds, enforced by the database; 0 disables
+MAX_RESULT_ROWS = int(os.getenv("QP_MAX_RESULT_ROWS", "100000"))  # rows per result; 0 disables
+MAX_RESULT_BYTES = int(os.getenv("QP_MAX_RESULT_BYTES", str(64 * 1024 * 1024)))  # estimated JSON size per result; 0 disables
+RESULT_STORE_MAX_BYTES = int(os.getenv("QP_RESULT_STORE_MAX_BYTES", str(512 * 1024 * 1024)))  # results kept for /api/results/{id}/view
+RESULT_STORE_TTL = float(os.getenv("QP_RESULT_STORE_TTL", "1800"))  # seconds a kept result stays available
+RESULT_STORE_MIN_ROWS = int(os.getenv("QP_RESULT_STORE_MIN_ROWS", "10000"))  # smaller results are cheap to filter in the browser
+EXPORT_BATCH_SIZE = int(os.getenv("QP_EXPORT_BATCH_SIZE", "10000"))  # rows per cursor fetch (and Parquet row group) when exporting
+EXPORT_STATEMENT_TIMEOUT = float(os.getenv("QP_EXPORT_STATEMENT_TIMEOUT", "3600"))  # seconds; exports outlive QP_STATEMENT_TIMEOUT; 0 disables
+ARROW_BATCH_SIZE = int(os.getenv("QP_ARROW_BATCH_SIZE", "10000"))  # rows per cursor fetch and Arrow record batch
+ARROW_COMPRESSION = os.getenv("QP_ARROW_COMPRESSION", "lz4").lower()  # Arrow IPC buffer codec: 'lz4', 'zstd' or 'none'
+FANOUT_PARALLELISM = int(os.getenv("QP_FANOUT_PARALLELISM", "8"))  # targets of one fan-out query running at once
+FANOUT_MAX_TARGETS = int(os.getenv("QP_FANOUT_MAX_TARGETS", "64"))  # connections one fan-out query may target
+TEMPORAL_FORMAT = os.getenv("QP_TEMPORAL_FORMAT", "iso").lower()  # dates and timestamps in JSON results: 'iso' strings or 'epoch' milliseconds
+PARALLEL_SCAN_PARTITIONS = int(os.getenv("QP_PARALLEL_SCAN_PARTITIONS", "4"))  # key ranges of a parallelScan query (capped below QP_POOL_MAX_SIZE)
+BATCH_MAX_STATEMENTS = int(os.getenv("QP_BATCH_MAX_STATEMENTS", "100"))  # statements per /api/execute-batch request
+BATCH_PARALLELISM = int(os.getenv("QP_BATCH_PARALLELISM", "4"))  # independent statements of one batch running at once
+OLLAMA_URL = os.getenv("QP_OLLAMA_URL", "http://localhost:11434").rstrip("/")  # Ollama API used by /api/query-pilot
+OLLAMA_TIMEOUT = float(os.getenv("QP_OLLAMA_TIMEOUT", "60"))  # seconds to wait for Ollama's next chunk
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("QP_OLLAMA_MAX_CONNECTIONS", "8"))  # keep-alive connections to Ollama
+LLM_CACHE_TTL = float(os.getenv("QP_LLM_CACHE_TTL", str(7 * 24 * 3600)))  # seconds a Query Pilot answer is reused; 0 disables
+LLM_CACHE_MAX_BYTES = int(os.getenv("QP_LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))  # in-memory tier
+LLM_CACHE_MAX_DISK_BYTES = int(os.getenv("QP_LLM_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))  # SQLite tier
+LLM_CACHE_PATH = os.getenv("QP_LLM_CACHE_PATH", os.path.expanduser("~/.cache/querypilot/llm_cache.sqlite3"))  # '' keeps answers in memory only
+PAGE_SIZE = int(os.getenv("QP_PAGE_SIZE", "500"))  # default rows per page for /api/execute-query/page
+PAGE_CURSORS_MAX = int(os.getenv("QP_PAGE_CURSORS_MAX", "16"))  # server-side cursors held open between pages
+PAGE_CURSOR_IDLE_TIMEOUT = float(os.getenv("QP_PAGE_CURSOR_IDLE_TIMEOUT", "120"))  # seconds before an unused cursor is closed
+PAGE_CURSORS_PER_POOL = int(os.getenv("QP_PAGE_CURSORS_PER_POOL", str(max(POOL_MAX_SIZE // 2, 1))))  # held cursors per connection pool
+
 def fix_mongodb_uri(uri: str) -> str:
     """
     Attempts to fix a MongoDB URI by url-encoding the username and password fields.
@@ -99,6 +175,765 @@ def inject_credentials(uri: str, username: str, password: str) -> str:
     except Exception:
         return uri
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available before the checkout timeout."""
+    pass
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections for a single connection identity.
+    Idle connections are reused LIFO so the warmest connection is handed out first,
+    checked for liveness on checkout, and closed after sitting idle too long.
+    """
+
+    def __init__(self, key, connect, is_alive, reset, min_size=POOL_MIN_SIZE,
+                 max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.key = key
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self._connect = connect
+        self._is_alive = is_alive
+        self._reset = reset
+        self._idle = []  # (connection, last_used) - most recently used at the end
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.last_used = time.monotonic()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.evicted = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self, timeout=POOL_CHECKOUT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.0f}s waiting for a free connection "
+                            f"(pool size {self.max_size}). Try again shortly."
+                        )
+                    if not waited:
+                        self.waits += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                self._in_use += 1
+                self.last_used = time.monotonic()
+                entry = self._idle.pop() if self._idle else None
+
+            # Network I/O (connect / ping) happens outside the lock
+            if entry is None:
+                try:
+                    connection = self._connect()
+                except BaseException:
+                    self._free_slot()
+                    raise
+                with self._cond:
+                    self.created += 1
+                return connection
+
+            connection, last_used = entry
+            if self._is_alive(connection, time.monotonic() - last_used):
+                with self._cond:
+                    self.reused += 1
+                return connection
+
+            # Stale connection - drop it and try again
+            self._close(connection)
+            with self._cond:
+                self.discarded += 1
+            self._free_slot()
+
+    def release(self, connection):
+        try:
+            self._reset(connection)
+            healthy = True
+        except Exception:
+            healthy = False
+
+        if not healthy:
+            self._close(connection)
+        with self._cond:
+            self._in_use -= 1
+            self.last_used = time.monotonic()
+            if healthy:
+                self._idle.append((connection, self.last_used))
+            else:
+                self.discarded += 1
+            self._cond.notify()
+
+    def discard(self, connection):
+        """Close a checked-out connection instead of returning it, e.g. because its session state must not be reused."""
+        self._close(connection)
+        with self._cond:
+            self._in_use -= 1
+            self.last_used = time.monotonic()
+            self.discarded += 1
+            self._cond.notify()
+
+    def evict_idle(self):
+        """
+        Close connections idle longer than idle_timeout, keeping at least min_size around while
+        the pool is in use. A pool nobody has used for idle_timeout drains completely, so the
+        registry can drop it.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = self.min_size if now - self.last_used < self.idle_timeout else 0
+            while self._idle and len(self._idle) + self._in_use > keep:
+                connection, last_used = self._idle[0]
+                if now - last_used < self.idle_timeout:
+                    break
+                expired.append(self._idle.pop(0)[0])
+            self.evicted += len(expired)
+        for connection in expired:
+            self._close(connection)
+        return len(expired)
+
+    def close_all(self):
+        with self._cond:
+            idle = [connection for connection, _ in self._idle]
+            self._idle = []
+        for connection in idle:
+            self._close(connection)
+
+    def is_unused(self):
+        with self._cond:
+            return self._in_use == 0 and not self._idle
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "evicted": self.evicted,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+
+    def _free_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+class PoolRegistry:
+    """Process-wide registry of connection pools keyed by connection identity."""
+
+    def __init__(self, sweep_interval=None):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval or max(min(POOL_IDLE_TIMEOUT / 2, 60.0), 1.0)
+        self._last_sweep = time.monotonic()
+
+    def get(self, key, factory):
+        self._maybe_sweep()
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = factory()
+                self._pools[key] = pool
+            return pool
+
+    def sweep(self):
+        """Evict idle connections and forget pools nobody has used for a while."""
+        with self._lock:
+            pools = list(self._pools.items())
+        now = time.monotonic()
+        for key, pool in pools:
+            pool.evict_idle()
+            if pool.is_unused() and now - pool.last_used > pool.idle_timeout:
+                with self._lock:
+                    if self._pools.get(key) is pool:
+                        del self._pools[key]
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.items())
+        result = []
+        for key, pool in pools:
+            db_type, host, port, user, database, credential_hash = key
+            result.append({
+                "db_type": db_type,
+                "host": host,
+                "port": port,
+                "user": user,
+                "database": database,
+                "credential": credential_hash[:8],
+                **pool.stats()
+            })
+        return result
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self._sweep_interval:
+            return
+        self._last_sweep = now
+        self.sweep()
+
+connection_pools = PoolRegistry()
+
+def connection_key(db_type: str, host, port, user, database, password) -> tuple:
+    """Pool identity: the password is hashed so it never shows up in stats or logs."""
+    credential_hash = hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+    return (db_type, host, port, user, database, credential_hash)
+
+def _mysql_pool(key, host, port, user, password, database):
+    import pymysql
+
+    def connect():
+        return pymysql.connect(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+            connect_timeout=10,
+            # Socket backstop only; statements are stopped by the server at QP_STATEMENT_TIMEOUT
+            read_timeout=STATEMENT_TIMEOUT + 30 if STATEMENT_TIMEOUT else None,
+            write_timeout=30
+        )
+
+    def is_alive(connection, idle_for):
+        if not connection.open:
+            return False
+        if idle_for < POOL_PING_AFTER:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def reset(connection):
+        # Ends the implicit transaction so the next checkout sees a fresh snapshot
+        connection.rollback()
+
+    return ConnectionPool(key, connect, is_alive, reset)
+
+def _postgresql_pool(key, host, port, user, password, database):
+    import psycopg2
+
+    def connect():
+        return psycopg2.connect(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            dbname=database,
+            connect_timeout=10
+        )
+
+    def is_alive(connection, idle_for):
+        if connection.closed:
+            return False
+        if idle_for < POOL_PING_AFTER:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def reset(connection):
+        if connection.closed:
+            raise RuntimeError("connection closed")
+        connection.rollback()
+
+    return ConnectionPool(key, connect, is_alive, reset)
+
+def get_connection_pool(db_type: str, host, port, user, password, database) -> ConnectionPool:
+    key = connection_key(db_type, host, port, user, database, password)
+    if db_type == 'mysql':
+        return connection_pools.get(key, lambda: _mysql_pool(key, host, port, user, password, database))
+    elif db_type == 'postgresql':
+        return connection_pools.get(key, lambda: _postgresql_pool(key, host, port, user, password, database))
+    raise ValueError(f"Connection pooling is not supported for database type: {db_type}")
+
+@contextmanager
+def pooled_connection(db_type: str, host, port, user, password, database):
+    """
+    Check a connection out of the pool for the given identity and return it afterwards.
+    The connection is rolled back on return; if that fails it is discarded instead of reused.
+    """
+    pool = get_connection_pool(db_type, host, port, user, password, database)
+    connection = pool.acquire()
+    try:
+        yield connection
+    finally:
+        pool.release(connection)
+
+def checkout_connection(db_type: str, request, session=None):
+    """pooled_connection for the request's identity, or the given session connection (see BatchSession) as is."""
+    if session is not None:
+        return nullcontext(session)
+    return pooled_connection(db_type, request.host, request.port, request.user, request.password, request.database)
+
+class MongoClientLease:
+    """A reference to a cached MongoClient. Call release() once done with the client."""
+
+    def __init__(self, cache, key, client):
+        self._cache = cache
+        self.key = key
+        self.client = client
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._cache._release(self.key, self.client)
+
+    def __enter__(self):
+        return self.client
+
+    def __exit__(self, *exc):
+        self.release()
+
+class MongoClientCache:
+    """
+    Process-wide cache of MongoClient instances keyed by the final connection URI.
+    A MongoClient is itself a connection pool with background monitoring, so sharing one
+    per cluster avoids repeating server discovery and SRV/DNS resolution on every request.
+    Clients are reference counted; idle ones are closed after idle_timeout and the cache
+    never holds more than max_clients (extra clients are closed as soon as they are released).
+    """
+
+    def __init__(self, max_clients=MONGO_MAX_CLIENTS, idle_timeout=MONGO_IDLE_TIMEOUT):
+        self.max_clients = max(max_clients, 1)
+        self.idle_timeout = idle_timeout
+        self._entries = {}  # key -> {"client", "refs", "last_used", "created_at"}
+        self._aliases = {}  # raw URI -> repaired URI (see fix_mongodb_uri)
+        self._transient = set()  # ids of uncached clients created while the cache was full
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def acquire(self, conn_str: str) -> MongoClientLease:
+        self.evict_idle()
+        key = self._aliases.get(conn_str, conn_str)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["refs"] += 1
+                entry["last_used"] = time.monotonic()
+                self.hits += 1
+                return MongoClientLease(self, key, entry["client"])
+
+        # MongoClient does no network I/O in its constructor, only URI parsing
+        key, client = self._create_client(conn_str)
+        to_close = []
+        with self._lock:
+            self.misses += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Another thread created the same client meanwhile - use theirs
+                entry["refs"] += 1
+                entry["last_used"] = time.monotonic()
+                to_close.append(client)
+                client = entry["client"]
+            else:
+                if len(self._entries) >= self.max_clients:
+                    to_close.extend(self._evict_lru_locked())
+                if len(self._entries) < self.max_clients:
+                    now = time.monotonic()
+                    self._entries[key] = {"client": client, "refs": 1, "last_used": now, "created_at": now}
+                else:
+                    self._transient.add(id(client))
+        for stale in to_close:
+            self._close(stale)
+        return MongoClientLease(self, key, client)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry["refs"] == 0 and now - entry["last_used"] > self.idle_timeout:
+                    expired.append(self._entries.pop(key)["client"])
+            self.evicted += len(expired)
+        for client in expired:
+            self._close(client)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            clients = [{
+                "uri": self._redact(key),
+                "refs": entry["refs"],
+                "idle_seconds": round(now - entry["last_used"], 1) if entry["refs"] == 0 else 0,
+                "age_seconds": round(now - entry["created_at"], 1)
+            } for key, entry in self._entries.items()]
+            return {
+                "clients": clients,
+                "max_clients": self.max_clients,
+                "idle_timeout": self.idle_timeout,
+                "transient": len(self._transient),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted
+            }
+
+    def _release(self, key, client):
+        close = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["client"] is client:
+                entry["refs"] -= 1
+                entry["last_used"] = time.monotonic()
+            elif id(client) in self._transient:
+                self._transient.discard(id(client))
+                close = True
+        if close:
+            self._close(client)
+
+    def _create_client(self, conn_str):
+        from pymongo import MongoClient
+
+        try:
+            return conn_str, MongoClient(conn_str, serverSelectionTimeoutMS=10000)
+        except Exception as e:
+            if "RFC 3986" in str(e) or "must be escaped" in str(e).lower():
+                fixed_uri = fix_mongodb_uri(conn_str)
+                client = MongoClient(fixed_uri, serverSelectionTimeoutMS=10000)
+                with self._lock:
+                    self._aliases[conn_str] = fixed_uri
+                return fixed_uri, client
+            raise e
+
+    def _evict_lru_locked(self):
+        idle = [(entry["last_used"], key) for key, entry in self._entries.items() if entry["refs"] == 0]
+        if not idle:
+            return []
+        _, key = min(idle)
+        self.evicted += 1
+        return [self._entries.pop(key)["client"]]
+
+    @staticmethod
+    def _redact(uri):
+        # Never expose credentials in stats
+        if "@" in uri and "://" in uri:
+            prefix, rest = uri.split("://", 1)
+            return f"{prefix}://***@{rest[rest.rfind('@') + 1:]}"
+        return uri
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+mongo_clients = MongoClientCache()
+
+class ResultCache:
+    """
+    In-memory LRU cache of encoded query results with a per-entry TTL and a total byte budget.
+    Sizes are estimates of the serialized JSON payload (see estimate_result_size).
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> {"value", "size", "expires_at", "created_at"}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                self._remove_locked(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value, size, ttl):
+        if ttl <= 0 or size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            while self._entries and self._bytes + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+                self.evicted += 1
+            self._entries[key] = {"value": value, "size": size, "expires_at": now + ttl, "created_at": now}
+            self._bytes += size
+        return True
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            value = self._entries[key]["value"]
+            self._remove_locked(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        return count
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "rejected": self.rejected
+            }
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+result_cache = ResultCache()
+
+class SchemaCache:
+    """
+    Introspected schemas per connection, stored with the catalog fingerprint they were built from.
+    An entry checked less than SCHEMA_FINGERPRINT_TTL seconds ago is served without touching the database.
+    """
+
+    def __init__(self, max_entries=SCHEMA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> {"schema", "fingerprint", "etag", "checked_at"}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry) -> bool:
+        return time.monotonic() - entry["checked_at"] < SCHEMA_FINGERPRINT_TTL
+
+    def revalidate(self, key, entry):
+        """Fingerprint unchanged: keep the schema and restart its freshness window."""
+        with self._lock:
+            entry["checked_at"] = time.monotonic()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.revalidated += 1
+        return entry
+
+    def put(self, key, schema, fingerprint):
+        schema = jsonable_encoder(schema)
+        entry = {
+            "schema": schema,
+            "fingerprint": fingerprint,
+            "etag": schema_etag(schema),
+            "checked_at": time.monotonic()
+        }
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.misses += 1
+        return entry
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "fingerprint_ttl": SCHEMA_FINGERPRINT_TTL
+            }
+
+def schema_etag(schema: Dict[str, Any]) -> str:
+    """Strong ETag derived from the schema payload itself."""
+    payload = json.dumps(schema, sort_keys=True, separators=(',', ':'), default=str)
+    return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+schema_cache = SchemaCache()
+
+class ExecutorSaturatedError(Exception):
+    """Raised instead of queueing when a backend executor's wait queue is full."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Too many {name} requests in progress, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class BackendExecutor:
+    """
+    Bounded thread pool for one backend's blocking driver calls.
+    At most max_workers calls run and at most max_queue wait; beyond that, calls are rejected
+    right away with ExecutorSaturatedError so overload shows up as fast 429s, not rising latency.
+    """
+
+    def __init__(self, name, max_workers=EXECUTOR_WORKERS, max_queue=EXECUTOR_QUEUE_SIZE):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-db")
+        self._lock = threading.Lock()
+        self._pending = 0  # admitted and not finished (running + queued)
+        self._running = 0
+        self._waits = deque(maxlen=256)  # recent queue wait times in seconds
+        self._service_time = 0.0  # moving average of call duration in seconds
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def check_capacity(self):
+        """Reject now if a new call could not even be queued."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._reject_locked()
+
+    async def run(self, fn, *args, force: bool = False):
+        """
+        Run fn(*args) on this executor and await the result.
+        force=True skips admission control; used for follow-up calls of work already admitted
+        (e.g. the next batch of a stream that has started).
+        """
+        with self._lock:
+            if not force and self._pending >= self.max_workers + self.max_queue:
+                self._reject_locked()
+            self._pending += 1
+            self.submitted += 1
+        enqueued_at = time.monotonic()
+
+        def call():
+            started_at = time.monotonic()
+            with self._lock:
+                self._running += 1
+                self._waits.append(started_at - enqueued_at)
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.monotonic() - started_at
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self.completed += 1
+                    self._service_time = elapsed if not self._service_time else 0.8 * self._service_time + 0.2 * elapsed
+
+        future = self._pool.submit(call)
+        # A caller cancelled before its call started never runs call(), so release its slot here
+        future.add_done_callback(lambda f: f.cancelled() and self._release_cancelled())
+        return await asyncio.wrap_future(future)
+
+    def _release_cancelled(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _reject_locked(self):
+        self.rejected += 1
+        # Time for the calls ahead of this one to drain at the observed service rate
+        backlog = self._pending - self.max_workers + 1
+        retry_after = max(1, math.ceil(backlog * (self._service_time or 1.0) / self.max_workers))
+        raise ExecutorSaturatedError(self.name, retry_after)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_service_ms": int(self._service_time * 1000),
+                "wait_ms": {
+                    "avg": int(sum(waits) / len(waits) * 1000) if waits else 0,
+                    "p95": int(waits[int(len(waits) * 0.95)] * 1000) if waits else 0,
+                    "max": int(waits[-1] * 1000) if waits else 0
+                }
+            }
+
+def backend_executor_settings(name: str) -> Dict[str, int]:
+    """Per-backend overrides, e.g. QP_MONGODB_EXECUTOR_WORKERS / QP_MONGODB_EXECUTOR_QUEUE_SIZE."""
+    return {
+        "max_workers": int(os.getenv(f"QP_{name.upper()}_EXECUTOR_WORKERS", str(EXECUTOR_WORKERS))),
+        "max_queue": int(os.getenv(f"QP_{name.upper()}_EXECUTOR_QUEUE_SIZE", str(EXECUTOR_QUEUE_SIZE)))
+    }
+
+# One executor per backend type, so slow MongoDB work can't starve MySQL/PostgreSQL and vice versa
+backend_executors = {
+    name: BackendExecutor(name, **backend_executor_settings(name))
+    for name in ('mysql', 'postgresql', 'mongodb')
+}
+
 app = FastAPI(title="Database LLM Connection Service")
 
 # CORS middleware to allow frontend requests
@@ -115,6 +950,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Disposition", "X-Query-Id", "X-Row-Count", "X-Execution-Time",
+                    "X-Truncated-By", "X-Cache"],
 )
 
 class MySQLConnectionRequest(BaseModel):
@@ -140,6 +977,7 @@ class SchemaRequest(BaseModel):
     db_type: Optional[str] = None  # 'mysql', 'postgresql', or 'mongodb'
     connectionString: Optional[str] = None  # For MongoDB
     username: Optional[str] = None  # For MongoDB
+    refresh: bool = False  # Ignore the cached schema and introspect again
 
 class ConnectionResponse(BaseModel):
     success: bool
@@ -147,6 +985,17 @@ class ConnectionResponse(BaseModel):
     steps: list[dict]
     error: Optional[str] = None
 
+class QueryTarget(BaseModel):
+    """One connection of a fan-out query; unset fields fall back to the QueryRequest's."""
+    name: Optional[str] = None  # Tags the target's rows (default: host/database)
+    host: Optional[str] = None
+    port: Optional[int] = None
+    database: Optional[str] = None
+    user: Optional[str] = None
+    password: Optional[str] = None
+    connectionString: Optional[str] = None
+    username: Optional[str] = None
+
 class QueryRequest(BaseModel):
     query: str
     host: Optional[str] = None
@@ -157,6 +1006,28 @@ class QueryRequest(BaseModel):
     db_type: str  # 'mysql', 'postgresql', or 'mongodb'
     connectionString: Optional[str] = None  # For MongoDB
     username: Optional[str] = None  # For MongoDB (alternative to 'user')
+    batchSize: Optional[int] = None  # Rows per chunk for /api/execute-query/stream
+    format: Optional[str] = None  # 'rows' (default), 'arrays' or 'columnar' - see encode_result; 'arrow' on /api/execute-query
+    bypassCache: bool = False  # Neither read nor write the result cache
+    refreshCache: bool = False  # Skip the cached result but store the fresh one
+    cacheTtl: Optional[float] = None  # Seconds to keep this result cached (default: adaptive)
+    queryId: Optional[str] = None  # Client-chosen ID for /api/queries/{id}/cancel (generated if omitted)
+    timeoutMs: Optional[int] = None  # Statement timeout; can only tighten QP_STATEMENT_TIMEOUT
+    maxRows: Optional[int] = None  # Row cap; can only tighten QP_MAX_RESULT_ROWS
+    maxBytes: Optional[int] = None  # Result size cap; can only tighten QP_MAX_RESULT_BYTES
+    rowLimit: Optional[int] = None  # "Run Top N": pushed down into the query as LIMIT / $limit
+    pageSize: Optional[int] = None  # Rows per page for /api/execute-query/page (default QP_PAGE_SIZE)
+    pageToken: Optional[str] = None  # nextPageToken from the previous page; omit for the first page
+    orderKey: Optional[List[str]] = None  # Columns that uniquely order the result, enabling keyset pagination
+    keepResult: bool = False  # Keep large results server-side for /api/results/{id}/view (needs numpy)
+    flattenDepth: Optional[int] = None  # MongoDB: sub-document levels shown as dotted columns (default QP_MONGO_FLATTEN_DEPTH)
+    targets: Optional[List[QueryTarget]] = None  # Fan-out: run the query on each of these connections
+    merge: Optional[str] = None  # Fan-out merge: 'concatenate' (default), 'union' or 'aggregate'
+    groupBy: Optional[List[str]] = None  # 'aggregate' merge: the key columns
+    aggregates: Optional[Dict[str, str]] = None  # 'aggregate' merge: column -> 'sum', 'count', 'min' or 'max'
+    parallelScan: bool = False  # Split a single-table SELECT into key ranges run on several connections
+    partitionColumn: Optional[str] = None  # parallelScan: numeric/date column to split on (default: the primary key)
+    partitions: Optional[int] = None  # parallelScan: number of key ranges (default QP_PARALLEL_SCAN_PARTITIONS)
 
 class QueryResponse(BaseModel):
     success: bool
@@ -165,118 +1036,2784 @@ class QueryResponse(BaseModel):
     rowCount: Optional[int] = None
     executionTime: Optional[int] = None  # in milliseconds
     error: Optional[str] = None
+    format: Optional[str] = None  # Set for the compact 'arrays' / 'columnar' formats
+    data: Optional[List[List[Any]]] = None  # Row arrays ('arrays') or column arrays ('columnar')
+    dictionaries: Optional[Dict[str, List[Any]]] = None  # Dictionary-encoded columns ('columnar')
+    cached: Optional[bool] = None  # True when served from the result cache
+    queryId: Optional[str] = None  # ID the query ran under
+    cancelled: Optional[bool] = None  # True when the query was cancelled before it finished
+    truncated: Optional[bool] = None  # True when a row or byte cap stopped the fetch early
+    truncatedBy: Optional[str] = None  # 'maxRows' or 'maxBytes'
+    resultId: Optional[str] = None  # Paginated or kept result, for the /api/results/{id} endpoints
+    nextPageToken: Optional[str] = None  # Pass as pageToken to get the next page; None on the last page
+    totalCount: Optional[int] = None  # Total rows, once the background count has finished
+    targetResults: Optional[List[Dict[str, Any]]] = None  # Fan-out: per-target outcome, in target order
+    partitioning: Optional[Dict[str, Any]] = None  # parallelScan: column/partitions/snapshot, or the fallback reason
+    columnTypes: Optional[List[Optional[str]]] = None  # Per column: 'integer', 'decimal', 'datetime', 'json', ...; None if unknown
 
-@app.get("/")
-def read_root():
-    return {"message": "Database LLM Connection Service", "status": "running"}
+RESULT_FORMATS = ('rows', 'arrays', 'columnar')
+DICTIONARY_MIN_ROWS = 32  # Don't bother dictionary-encoding tiny results
+DICTIONARY_MAX_RATIO = 0.5  # Encode a string column when distinct values <= 50% of rows
 
-@app.post("/api/test-connection/mysql", response_model=ConnectionResponse)
-async def test_mysql_connection(request: MySQLConnectionRequest):
+def negotiate_result_format(requested: Optional[str], accept: Optional[str]) -> str:
     """
-    Test MySQL database connection with provided credentials.
-    Returns success status and detailed steps of the connection process.
+    Pick the response encoding from the request's 'format' field, falling back to the Accept
+    header (application/vnd.querypilot.arrays+json or application/vnd.querypilot.columnar+json).
     """
-    steps = []
-    
-    try:
-        # Step 1: Validate credentials format
-        steps.append({
-            "id": 1,
-            "label": "Validating credentials format",
-            "status": "in_progress",
-            "timestamp": time.time()
-        })
-        
-        # Basic validation
-        if not request.host or not request.user or not request.database:
-            steps[-1]["status"] = "failed"
-            steps[-1]["error"] = "Missing required credentials"
-            return ConnectionResponse(
-                success=False,
-                message="Invalid credentials format",
-                steps=steps,
-                error="Missing required credentials"
-            )
-        
-        time.sleep(0.3)  # Simulate processing
-        steps[-1]["status"] = "completed"
-        
-        # Step 2: Establishing connection
-        steps.append({
-            "id": 2,
-            "label": "Establishing connection",
-            "status": "in_progress",
-            "timestamp": time.time()
-        })
-        
+    if requested:
+        if requested not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format '{requested}'. Use one of: {', '.join(RESULT_FORMATS)}")
+        return requested
+    if accept:
+        for result_format in ('columnar', 'arrays'):
+            if f"application/vnd.querypilot.{result_format}+json" in accept:
+                return result_format
+    return 'rows'
+
+# Driver type codes (cursor.description[i][1]) -> column type. Codes missing here are ambiguous
+# (MySQL BLOB/CHAR hold both text and bytes, arrays, extensions), so their type is inferred from the values.
+MYSQL_COLUMN_TYPES = {
+    0: 'decimal', 246: 'decimal',
+    1: 'integer', 2: 'integer', 3: 'integer', 8: 'integer', 9: 'integer', 13: 'integer',
+    4: 'float', 5: 'float',
+    7: 'datetime', 12: 'datetime', 10: 'date', 14: 'date', 11: 'time',
+    245: 'json',
+    15: 'string', 247: 'string', 248: 'string'
+}
+POSTGRESQL_COLUMN_TYPES = {
+    16: 'boolean',
+    20: 'integer', 21: 'integer', 23: 'integer', 26: 'integer',
+    700: 'float', 701: 'float', 1700: 'decimal',
+    18: 'string', 19: 'string', 25: 'string', 1042: 'string', 1043: 'string',
+    1082: 'date', 1114: 'datetime', 1184: 'datetime', 1083: 'time', 1266: 'time', 1186: 'interval',
+    114: 'json', 3802: 'json', 17: 'binary', 2950: 'uuid'
+}
+DESCRIPTION_COLUMN_TYPES = {'mysql': MYSQL_COLUMN_TYPES, 'postgresql': POSTGRESQL_COLUMN_TYPES}
+
+class ResultColumns(list):
+    """
+    Column names of a fetched result, with the type of each from the cursor description in
+    `types` (None where the type code is ambiguous). Otherwise a plain list, so column lists
+    derived from it (merges, projections) just fall back to inferring types from the values.
+    """
+
+    def __init__(self, names, types=None):
+        super().__init__(names)
+        self.types = list(types) if types is not None else [None] * len(self)
+
+def result_columns(description, dialect: Optional[str] = None) -> List[str]:
+    """
+    Column names from a DB-API cursor description, with duplicates made unique (id, id_2, ...),
+    as ResultColumns typed from the dialect's type codes.
+    """
+    type_codes = DESCRIPTION_COLUMN_TYPES.get(dialect, {})
+    columns = []
+    types = []
+    seen = set()
+    for desc in description or []:
+        name = desc[0]
+        unique = name
+        suffix = 2
+        while unique in seen:
+            unique = f"{name}_{suffix}"
+            suffix += 1
+        seen.add(unique)
+        columns.append(unique)
+        types.append(type_codes.get(desc[1]))
+    return ResultColumns(columns, types)
+
+def json_safe_value(value):
+    """Pass JSON-native values through and convert anything else (Decimal, datetime, ObjectId...) to a string."""
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def convert_decimal(value):
+    """Decimals as strings, so no digit is lost to a float."""
+    return str(value) if isinstance(value, decimal.Decimal) else json_safe_value(value)
+
+def convert_temporal(value):
+    """
+    Dates and timestamps as ISO 8601 or epoch milliseconds (QP_TEMPORAL_FORMAT; naive timestamps
+    count as UTC), times of day as ISO 8601, and durations (MySQL TIME, PostgreSQL interval) as
+    [-]HH:MM:SS[.ffffff] or milliseconds.
+    """
+    if isinstance(value, datetime.datetime):
+        if TEMPORAL_FORMAT == 'epoch':
+            aware = value if value.tzinfo is not None else value.replace(tzinfo=datetime.timezone.utc)
+            return (aware - EPOCH) // datetime.timedelta(milliseconds=1)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        if TEMPORAL_FORMAT == 'epoch':
+            return (value - EPOCH.date()).days * 86400000
+        return value.isoformat()
+    if isinstance(value, datetime.time):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        if TEMPORAL_FORMAT == 'epoch':
+            return value // datetime.timedelta(milliseconds=1)
+        sign = "-" if value < datetime.timedelta(0) else ""
+        seconds, micros = divmod(abs(value) // datetime.timedelta(microseconds=1), 1000000)
+        text = f"{sign}{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+        return f"{text}.{micros:06d}" if micros else text
+    # MySQL returns invalid dates (0000-00-00) as strings
+    return json_safe_value(value)
+
+def convert_binary(value):
+    """Bytes (and psycopg2's memoryviews) as base64."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode("ascii")
+    return json_safe_value(value)
+
+def convert_json(value):
+    """JSON columns as JSON: MySQL returns the document text, psycopg2 the parsed value."""
+    if isinstance(value, str):
         try:
-            import pymysql
-            
-            # Attempt to connect to MySQL (without selecting database first)
-            connection = pymysql.connect(
-                host=request.host,
-                port=request.port,
-                user=request.user,
-                password=request.password,
-                connect_timeout=10,
-                read_timeout=10,
-                write_timeout=10
-            )
-            
-            steps[-1]["status"] = "completed"
-            
-        except ImportError:
-            steps[-1]["status"] = "failed"
-            steps[-1]["error"] = "PyMySQL not installed"
-            return ConnectionResponse(
-                success=False,
-                message="PyMySQL driver not found. Please install: pip install pymysql",
-                steps=steps,
-                error="PyMySQL not installed"
-            )
-        except pymysql.err.OperationalError as e:
-            steps[-1]["status"] = "failed"
-            error_msg = str(e)
-            steps[-1]["error"] = "Connection failed"
-            
-            # Provide detailed, user-friendly error messages
-            if "Can't connect" in error_msg or "Unknown MySQL server host" in error_msg:
-                message = f"❌ Cannot reach MySQL server at '{request.host}:{request.port}'.\n\n💡 Possible fixes:\n• Check if MySQL server is running\n• Verify the host address and port number\n• Check your firewall settings\n• Ensure network connectivity"
-            elif "Access denied" in error_msg:
-                message = f"❌ Authentication failed for user '{request.user}'.\n\n💡 Possible fixes:\n• Verify your username is correct\n• Check your password\n• Ensure the user has access from your IP\n• Try: GRANT ALL ON {request.database}.* TO '{request.user}'@'%';"
-            elif "cryptography" in error_msg.lower() or "caching_sha2_password" in error_msg.lower() or "sha256_password" in error_msg.lower():
-                # MySQL 8.0+ uses caching_sha2_password by default which requires cryptography package
-                message = f"❌ MySQL Authentication Error (caching_sha2_password).\n\n💡 This is likely due to:\n• Incorrect password for user '{request.user}'\n• MySQL 8.0+ authentication method issue\n\n🔧 Solutions:\n1. Verify your password is correct\n2. Install cryptography: pip install cryptography\n3. Or change MySQL auth method:\n   ALTER USER '{request.user}'@'%' IDENTIFIED WITH mysql_native_password BY 'your_password';"
-                steps[-1]["error"] = "Authentication failed - MySQL 8.0+ requires correct password or cryptography package"
+            return json.loads(value)
+        except ValueError:
+            return value
+    return json_value(value)
+
+def json_value(value):
+    """Any driver value as JSON, with the typed encodings above, recursing into documents and arrays."""
+    if value is None or type(value) in (str, int, float, bool):
+        return value
+    if isinstance(value, dict):
+        return {str(key): json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    if isinstance(value, decimal.Decimal):
+        return convert_decimal(value)
+    if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+        return convert_temporal(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return convert_binary(value)
+    return json_safe_value(value)
+
+# Column type -> converter; None passes the driver's values through untouched
+COLUMN_CONVERTERS = {
+    'integer': None, 'float': None, 'boolean': None, 'string': None,
+    'decimal': convert_decimal,
+    'date': convert_temporal, 'datetime': convert_temporal, 'time': convert_temporal, 'interval': convert_temporal,
+    'json': convert_json, 'binary': convert_binary, 'uuid': json_safe_value
+}
+# Python type -> column type, for columns the cursor didn't type (MongoDB, merged results, ambiguous codes)
+VALUE_COLUMN_TYPES = (
+    (bool, 'boolean'), (int, 'integer'), (float, 'float'), (str, 'string'), (decimal.Decimal, 'decimal'),
+    (datetime.datetime, 'datetime'), (datetime.date, 'date'), (datetime.time, 'time'),
+    (datetime.timedelta, 'interval'), ((bytes, bytearray, memoryview), 'binary'), (uuid.UUID, 'uuid'),
+    (dict, 'json'), ((list, tuple), 'array')
+)
+
+def column_converters(columns: List[str], rows) -> tuple:
+    """
+    (column types, converters) for a result, built once per result rather than per cell.
+    Typed columns (see ResultColumns) get their type's converter; the others are named after
+    their first non-NULL value and converted with json_value, which copes with mixed values.
+    """
+    types = list(getattr(columns, 'types', None) or [None] * len(columns))
+    converters = []
+    for index, column_type in enumerate(types):
+        if column_type is not None:
+            converters.append(COLUMN_CONVERTERS[column_type])
+            continue
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        types[index] = next((name for kinds, name in VALUE_COLUMN_TYPES if isinstance(sample, kinds)),
+                            'string' if sample is not None else None)
+        converters.append(json_value)
+    return types, converters
+
+def encode_result(columns: List[str], rows, result_format: str = 'rows') -> Dict[str, Any]:
+    """
+    Encode tuple rows as QueryResponse fields.
+    - 'rows': a dict per row (the original format)
+    - 'arrays': column names once, then one array per row in 'data'
+    - 'columnar': one array per column in 'data'; low-cardinality string columns are
+      dictionary-encoded, i.e. 'data' holds integer codes into 'dictionaries'[column]
+    Values are converted column by column (see column_converters); 'columnTypes' names the types.
+    """
+    types, converters = column_converters(columns, rows)
+    row_count = len(rows)
+    column_values = [list(values) if convert is None else list(map(convert, values))
+                     for convert, values in zip(converters, zip(*rows))] if row_count and any(converters) else None
+
+    if result_format in ('rows', 'arrays'):
+        # Columns that all pass through leave the rows as they are; otherwise they are rebuilt from the columns
+        converted = zip(*column_values) if column_values is not None else rows
+        if result_format == 'rows':
+            return {"columns": columns, "columnTypes": types, "rows": [dict(zip(columns, row)) for row in converted]}
+        return {"format": "arrays", "columns": columns, "columnTypes": types, "data": [list(row) for row in converted]}
+
+    data = []
+    dictionaries = {}
+    if column_values is None:
+        column_values = [list(values) for values in zip(*rows)] if row_count else [[] for _ in columns]
+    for name, values in zip(columns, column_values):
+        if row_count >= DICTIONARY_MIN_ROWS and all(v is None or isinstance(v, str) for v in values):
+            codes = {}
+            for value in values:
+                if value not in codes:
+                    codes[value] = len(codes)
+                    if len(codes) > row_count * DICTIONARY_MAX_RATIO:
+                        break
             else:
-                message = f"❌ Connection failed: {error_msg}\n\n💡 Check your connection details and try again."
-            
-            return ConnectionResponse(
-                success=False,
-                message=message,
-                steps=steps,
-                error=steps[-1]["error"]
-            )
-        except Exception as e:
-            steps[-1]["status"] = "failed"
-            error_msg = str(e)
-            
-            # Check if it's a cryptography-related error
-            if "cryptography" in error_msg.lower() or "sha256_password" in error_msg.lower() or "caching_sha2_password" in error_msg.lower():
-                steps[-1]["error"] = "Authentication error - cryptography package needed"
-                return ConnectionResponse(
-                    success=False,
-                    message=f"❌ MySQL Authentication Error.\n\n💡 MySQL 8.0+ uses advanced authentication which requires:\n1. Correct password for user '{request.user}'\n2. Python cryptography package: pip install cryptography\n\n🔧 Alternative solution:\nChange user authentication method:\nALTER USER '{request.user}'@'%' IDENTIFIED WITH mysql_native_password BY 'your_password';",
-                    steps=steps,
-                    error="Authentication failed"
-                )
-            
-            steps[-1]["error"] = error_msg
-            return ConnectionResponse(
-                success=False,
-                message=f"❌ Unexpected error: {error_msg}",
-                steps=steps,
-                error=error_msg
+                dictionaries[name] = list(codes)
+                values = [codes[value] for value in values]
+        data.append(values)
+    encoded = {"format": "columnar", "columns": columns, "columnTypes": types, "data": data}
+    if dictionaries:
+        encoded["dictionaries"] = dictionaries
+    return encoded
+
+_DOLLAR_QUOTE_PATTERN = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+
+def tokenize_sql(query: str, dialect: str = 'mysql') -> List[tuple]:
+    """
+    Split a SQL statement into (kind, text) tokens, where kind is one of 'space', 'comment',
+    'hint', 'string', 'quoted' (quoted identifier), 'word', 'number' or 'symbol'.
+    Joining the texts gives back the original query. Follows the lexical rules of MySQL
+    ('mysql') or PostgreSQL ('postgresql') for quoting, escapes and comments.
+    """
+    mysql = dialect == 'mysql'
+    tokens = []
+    i = 0
+    n = len(query)
+    while i < n:
+        c = query[i]
+        j = i + 1
+
+        if c.isspace():
+            while j < n and query[j].isspace():
+                j += 1
+            kind = 'space'
+        elif c == '-' and query.startswith('--', i) and (not mysql or i + 2 >= n or query[i + 2].isspace()):
+            # MySQL only treats "--" as a comment when followed by whitespace
+            j = query.find('\n', i)
+            j = n if j < 0 else j
+            kind = 'comment'
+        elif c == '#' and mysql:
+            j = query.find('\n', i)
+            j = n if j < 0 else j
+            kind = 'comment'
+        elif c == '/' and query.startswith('/*', i):
+            j = query.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            # MySQL version comments (/*! ... */) and optimizer hints (/*+ ... */) are significant
+            kind = 'hint' if query.startswith(('/*!', '/*+'), i) else 'comment'
+        elif c in "'\"`":
+            # MySQL honours backslash escapes in strings; PostgreSQL only in E'...' strings
+            backslash = (mysql and c != '`') or (
+                c == "'" and tokens and tokens[-1][0] == 'word' and tokens[-1][1] in ('E', 'e'))
+            while j < n:
+                ch = query[j]
+                if backslash and ch == '\\':
+                    j += 2
+                elif ch == c:
+                    if j + 1 < n and query[j + 1] == c:
+                        j += 2  # doubled quote
+                    else:
+                        j += 1
+                        break
+                else:
+                    j += 1
+            j = min(j, n)
+            kind = 'string' if c == "'" or (mysql and c == '"') else 'quoted'
+        elif c == '$' and not mysql and _DOLLAR_QUOTE_PATTERN.match(query, i):
+            tag = _DOLLAR_QUOTE_PATTERN.match(query, i).group(0)
+            j = query.find(tag, i + len(tag))
+            j = n if j < 0 else j + len(tag)
+            kind = 'string'
+        elif c.isalpha() or c == '_' or ord(c) > 127:
+            while j < n and (query[j].isalnum() or query[j] in '_$' or ord(query[j]) > 127):
+                j += 1
+            kind = 'word'
+        elif c.isdigit() or (c == '.' and j < n and query[j].isdigit()):
+            while j < n and (query[j].isalnum() or query[j] == '.'):
+                j += 1
+            kind = 'number'
+        else:
+            kind = 'symbol'
+
+        tokens.append((kind, query[i:j]))
+        i = j
+    return tokens
+
+def normalize_sql(query: str, dialect: str = 'mysql') -> str:
+    """
+    Canonical form of a SQL statement for cache keys: comments dropped, whitespace
+    collapsed and trailing semicolons removed. Strings and quoted identifiers are untouched.
+    """
+    parts = []
+    for kind, text in tokenize_sql(query, dialect):
+        if kind in ('space', 'comment'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(text)
+    while parts and parts[-1] in (' ', ';'):
+        parts.pop()
+    while parts and parts[0] == ' ':
+        parts.pop(0)
+    return ''.join(parts)
+
+CACHEABLE_SQL_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'TABLE')
+
+def push_down_sql_limit(query: str, dialect: str, row_limit: int) -> str:
+    """
+    Cap the outermost statement of a SQL query at row_limit rows, so the limit reaches the planner.
+    Works on tokens rather than text, so CTEs, subqueries, strings, comments and column names
+    such as credit_limit are left alone:
+    - an existing top-level LIMIT n (MySQL LIMIT offset, n) or FETCH FIRST n is lowered to row_limit
+    - LIMIT ALL is replaced
+    - otherwise LIMIT row_limit is added at the end, before any FOR UPDATE / LOCK IN SHARE MODE
+    Queries that aren't row-returning, contain several statements or use a non-literal limit
+    are returned unchanged (the row cap in ResultLimits still applies to them).
+    """
+    tokens = tokenize_sql(query, dialect)
+    significant = []  # (token index, depth, upper-cased text) of everything but whitespace/comments
+    depth = 0
+    for index, (kind, text) in enumerate(tokens):
+        if kind in ('space', 'comment'):
+            continue
+        if kind == 'symbol' and text == ')':
+            depth -= 1
+        significant.append((index, depth, text.upper() if kind == 'word' else text))
+        if kind == 'symbol' and text == '(':
+            depth += 1
+
+    # Drop trailing semicolons; anything else after a top-level ';' is a second statement
+    while significant and significant[-1][2] == ';':
+        significant.pop()
+    if not significant or any(depth == 0 and text == ';' for _, depth, text in significant):
+        return query
+    first_word = next((text for index, _, text in significant if tokens[index][0] == 'word'), None)
+    if first_word not in CACHEABLE_SQL_KEYWORDS:
+        return query
+
+    top_level = [(position, text) for position, (_, depth, text) in enumerate(significant) if depth == 0]
+
+    def lower_count(position):
+        # Replace the literal at significant[position] with min(literal, row_limit)
+        if position >= len(significant):
+            return query
+        index, _, text = significant[position]
+        if text == 'ALL':
+            count = row_limit
+        elif tokens[index][0] == 'number' and text.isdigit():
+            count = min(int(text), row_limit)
+        else:
+            return query
+        tokens[index] = ('number', str(count))
+        return ''.join(text for _, text in tokens)
+
+    for position, text in top_level:
+        if text == 'LIMIT':
+            # MySQL "LIMIT offset, count": the count is the token after the comma
+            after = significant[position + 2:position + 3]
+            if dialect == 'mysql' and after and after[0][2] == ',':
+                return lower_count(position + 3)
+            return lower_count(position + 1)
+        if text == 'FETCH':
+            # FETCH FIRST|NEXT [n] ROW|ROWS ...; without n a single row is fetched
+            following = significant[position + 2:position + 3]
+            if following and following[0][2] in ('ROW', 'ROWS'):
+                return query
+            return lower_count(position + 2)
+
+    # Append after the last significant token (trailing comments and ';' stay where they are),
+    # but before a locking clause, which must come after LIMIT
+    for position, text in top_level:
+        if text == 'FOR' or (dialect == 'mysql' and text == 'LOCK'):
+            index = significant[position][0]
+            head = ''.join(text for _, text in tokens[:index]).rstrip()
+            tail = ''.join(text for _, text in tokens[index:])
+            return f"{head} LIMIT {row_limit} {tail}"
+    index = significant[-1][0] + 1
+    head = ''.join(text for _, text in tokens[:index])
+    tail = ''.join(text for _, text in tokens[index:])
+    return f"{head} LIMIT {row_limit}{tail}"
+
+def push_down_mongodb_limit(query: str, row_limit: int) -> str:
+    """
+    Cap a JSON MongoDB query at row_limit documents: find queries get a lower 'limit',
+    aggregation pipelines get a trailing $limit stage (pipelines ending in $out/$merge are left alone).
+    """
+    try:
+        query_obj = json.loads(query)
+    except ValueError:
+        return query
+    if not isinstance(query_obj, dict):
+        return query
+    pipeline = query_obj.get('aggregate')
+    if isinstance(pipeline, list):
+        last_stage = pipeline[-1] if pipeline and isinstance(pipeline[-1], dict) else {}
+        if '$out' in last_stage or '$merge' in last_stage:
+            return query
+        if isinstance(last_stage.get('$limit'), int) and last_stage['$limit'] <= row_limit:
+            return query
+        query_obj['aggregate'] = pipeline + [{"$limit": row_limit}]
+    elif 'aggregate' not in query_obj:
+        limit = query_obj.get('limit', 1000)
+        if isinstance(limit, int) and 0 < limit <= row_limit:
+            return query
+        query_obj['limit'] = row_limit
+    else:
+        return query
+    return json.dumps(query_obj)
+
+def apply_row_limit(request: QueryRequest) -> QueryRequest:
+    """Return the request with its rowLimit pushed down into the query text."""
+    if not request.rowLimit or request.rowLimit <= 0:
+        return request
+    if request.db_type == 'mongodb':
+        query = push_down_mongodb_limit(request.query, request.rowLimit)
+    elif request.db_type in ('mysql', 'postgresql'):
+        query = push_down_sql_limit(request.query, request.db_type, request.rowLimit)
+    else:
+        return request
+    return request.model_copy(update={"query": query})
+
+SESSION_STATEMENT_KEYWORDS = ('SET', 'USE', 'DECLARE', 'PREPARE', 'EXECUTE', 'DEALLOCATE', 'BEGIN', 'START',
+                              'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'RESET', 'DISCARD', 'LOCK', 'UNLOCK',
+                              'FETCH', 'MOVE', 'CLOSE', 'LISTEN', 'UNLISTEN', 'DO')
+SESSION_FUNCTIONS = ('LAST_INSERT_ID', 'FOUND_ROWS', 'ROW_COUNT', 'CONNECTION_ID', 'GET_LOCK', 'RELEASE_LOCK',
+                     'CURRVAL', 'LASTVAL', 'CURRENT_SETTING', 'SET_CONFIG', 'PG_BACKEND_PID', 'PG_ADVISORY_LOCK',
+                     'PG_ADVISORY_UNLOCK')
+
+def sql_identifier(kind: str, text: str, dialect: str) -> str:
+    """Compare-ready form of an identifier token: quotes removed, unquoted names case-folded."""
+    if kind == 'quoted':
+        quote = text[0]
+        return text[1:-1].replace(quote * 2, quote)
+    return text.lower()
+
+def sql_session_state(query: str, dialect: str, session_tables=frozenset()) -> tuple:
+    """
+    How a statement depends on its session, for /api/execute-batch. Returns (stateful, created):
+    stateful when it reads or changes session state - SET, USE, transaction control, MySQL user
+    variables, SELECT ... INTO, LAST_INSERT_ID() and the like, or one of session_tables - and
+    created lists the tables it creates (SELECT ... INTO TEMP t).
+    """
+    tokens = [(kind, text) for kind, text in tokenize_sql(query, dialect) if kind not in ('space', 'comment')]
+    if not tokens:
+        return False, []
+    stateful = tokens[0][0] == 'word' and tokens[0][1].upper() in SESSION_STATEMENT_KEYWORDS
+    created = []
+    for i, (kind, text) in enumerate(tokens):
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if kind == 'symbol' and text == '@' and dialect == 'mysql':
+            stateful = True
+        elif kind in ('word', 'quoted') and sql_identifier(kind, text, dialect) in session_tables:
+            stateful = True
+        elif kind == 'word' and text.upper() in SESSION_FUNCTIONS and following == '(':
+            stateful = True
+        elif kind == 'word' and text.upper() == 'INTO':
+            stateful = True
+            # SELECT ... INTO [TEMP | TEMPORARY | UNLOGGED] [TABLE] name
+            j = i + 1
+            while j < len(tokens) and tokens[j][1].upper() in ('TEMP', 'TEMPORARY', 'UNLOGGED', 'TABLE'):
+                j += 1
+            if dialect == 'postgresql' and j < len(tokens) and tokens[j][0] in ('word', 'quoted'):
+                created.append(sql_identifier(tokens[j][0], tokens[j][1], dialect))
+    return stateful, created
+
+# Functions whose result changes from one run to the next (called with or without parentheses)
+VOLATILE_SQL_FUNCTIONS = ('NOW', 'SYSDATE', 'CURDATE', 'CURTIME', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP',
+                          'LOCALTIME', 'LOCALTIMESTAMP', 'UTC_DATE', 'UTC_TIME', 'UTC_TIMESTAMP', 'UNIX_TIMESTAMP',
+                          'CLOCK_TIMESTAMP', 'STATEMENT_TIMESTAMP', 'TRANSACTION_TIMESTAMP', 'TIMEOFDAY',
+                          'RAND', 'RANDOM', 'SETSEED', 'UUID', 'UUID_SHORT', 'GEN_RANDOM_UUID', 'UUID_GENERATE_V4',
+                          'NEXTVAL', 'SETVAL', 'SLEEP', 'PG_SLEEP', 'BENCHMARK', 'TXID_CURRENT')
+# Words that make a row-returning statement write or lock (data-modifying CTEs, FOR UPDATE)
+WRITING_SQL_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'MERGE')
+
+def sql_is_cacheable(query: str, dialect: str) -> bool:
+    """
+    Whether a statement's result can be served from the result cache: it has to be a plain
+    read (SELECT, WITH, VALUES, TABLE) that doesn't write, lock rows, depend on its session
+    (SELECT ... INTO, LAST_INSERT_ID(), user variables - see sql_session_state) or call a
+    volatile function such as NOW(), RAND() or nextval().
+    """
+    tokens = [(kind, text) for kind, text in tokenize_sql(query, dialect) if kind not in ('space', 'comment')]
+    if not tokens or tokens[0][0] != 'word' or tokens[0][1].upper() not in CACHEABLE_SQL_KEYWORDS:
+        return False
+    if sql_session_state(query, dialect)[0]:
+        return False
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'hint' and text.startswith('/*!'):
+            # MySQL version comments can hold any SQL
+            return False
+        if kind != 'word':
+            continue
+        word = text.upper()
+        following = tokens[i + 1][1].upper() if i + 1 < len(tokens) else None
+        if word in VOLATILE_SQL_FUNCTIONS or word in WRITING_SQL_KEYWORDS:
+            return False
+        # FOR SHARE, FOR NO KEY UPDATE, FOR KEY SHARE, LOCK IN SHARE MODE
+        if (word == 'FOR' and following in ('SHARE', 'NO', 'KEY')) or (word == 'LOCK' and following == 'IN'):
+            return False
+    return True
+
+def result_cache_key(request: QueryRequest, result_format: str) -> Optional[tuple]:
+    """
+    Cache key for a query result: (connection identity, normalized query, limits, format).
+    Returns None for statements that should never be served from the cache.
+    """
+    if request.db_type == 'mongodb':
+        try:
+            query_text = json.dumps(json.loads(request.query), separators=(',', ':'))
+        except ValueError:
+            return None
+        conn_str = mongodb_connection_string(request) or ""
+        identity = ('mongodb', hashlib.sha256(conn_str.encode("utf-8")).hexdigest(), request.database)
+        # The flattening depth decides the columns
+        query_text = (query_text, mongodb_flatten_depth(request))
+    elif request.db_type in ('mysql', 'postgresql'):
+        if not sql_is_cacheable(request.query, request.db_type):
+            return None
+        query_text = normalize_sql(request.query, request.db_type)
+        identity = connection_key(request.db_type, request.host, request.port, request.user,
+                                  request.database, request.password)
+    else:
+        return None
+    # Caps change what a result contains, so they are part of its identity
+    limits = ResultLimits.for_request(request)
+    return (identity, query_text, (limits.max_rows, limits.max_bytes), result_format)
+
+def result_cache_ttl(request: QueryRequest, execution_ms: int) -> float:
+    """Per-entry TTL: explicit cacheTtl, otherwise longer for queries that were expensive to run."""
+    if request.cacheTtl is not None:
+        return min(max(request.cacheTtl, 0.0), RESULT_CACHE_MAX_TTL)
+    return min(RESULT_CACHE_TTL * (1 + execution_ms / 1000.0), RESULT_CACHE_MAX_TTL)
+
+def estimate_result_size(encoded: Dict[str, Any], sample_size: int = 50) -> int:
+    """Approximate the JSON size of an encoded result by serializing a sample of it."""
+    def estimate(items):
+        if not items:
+            return 2
+        sample = items[:sample_size]
+        return int(len(json.dumps(sample, default=str)) * len(items) / len(sample))
+
+    size = len(json.dumps(encoded.get("columns") or []))
+    if encoded.get("format") == "columnar":
+        size += sum(estimate(column) for column in encoded.get("data") or [])
+        size += len(json.dumps(encoded.get("dictionaries") or {}, default=str))
+    else:
+        size += estimate(encoded.get("rows") or encoded.get("data") or [])
+    return size
+
+def validate_query_request(request: QueryRequest) -> Optional[str]:
+    """Return an error message if the query must not be executed, otherwise None."""
+    if not request.query or not request.query.strip():
+        return "Query cannot be empty"
+
+    # Check for dangerous operations
+    query_upper = request.query.strip().upper()
+    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE']
+    if any(keyword in query_upper.split()[0] for keyword in dangerous_keywords):
+        return "Only SELECT queries are allowed for safety"
+
+    if request.db_type == 'mongodb' and not request.connectionString and not request.targets:
+        return "Connection string is required for MongoDB"
+
+    return None
+
+def describe_query_error(e: Exception) -> str:
+    """Format a driver exception the same way /api/execute-query reports it."""
+    if isinstance(e, ImportError):
+        driver_names = {'pymysql': 'PyMySQL', 'psycopg2': 'psycopg2', 'pymongo': 'pymongo',
+                        'aiomysql': 'aiomysql', 'asyncpg': 'asyncpg', 'motor': 'motor'}
+        return f"{driver_names.get(e.name, e.name or 'Database driver')} not installed"
+    module = type(e).__module__ or ""
+    if module.startswith("pymysql"):
+        return f"MySQL Error: {str(e)}"
+    if module.startswith("psycopg2") or module.startswith("asyncpg"):
+        return f"PostgreSQL Error: {str(e)}"
+    if module.startswith("pymongo"):
+        return f"MongoDB Error: {str(e)}"
+    if isinstance(e, (ValueError, PoolTimeoutError, QueryCancelledError)):
+        return str(e)
+    return f"Error: {str(e)}"
+
+def mongodb_connection_string(request) -> str:
+    conn_str = request.connectionString
+
+    # Override credentials if provided
+    if request.username and request.password:
+        conn_str = inject_credentials(conn_str, request.username, request.password)
+    return conn_str
+
+def parse_mongodb_query(client, request: QueryRequest):
+    """Parse a JSON MongoDB query and return (query object, target collection)."""
+    import json
+
+    try:
+        query_obj = json.loads(request.query)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON query format. Expected: {\"collection\": \"name\", \"query\": {...}} or {\"collection\": \"name\", \"aggregate\": [...]}")
+
+    # Parse collection name to handle "database.collection" format
+    collection_name = query_obj.get('collection') if isinstance(query_obj, dict) else None
+    if not collection_name:
+        raise ValueError("Query must specify 'collection' field")
+
+    if '.' in collection_name:
+        target_db_name, target_coll_name = collection_name.split('.', 1)
+        return query_obj, client[target_db_name][target_coll_name]
+    # Fallback to requested database if no prefix
+    return query_obj, client[request.database][collection_name]
+
+def open_mongodb_cursor(client, request: QueryRequest, batch_size: Optional[int] = None,
+                        comment: Optional[str] = None, max_time_ms: Optional[int] = None, raw: bool = False):
+    """
+    Parse a JSON MongoDB query and open a cursor for it.
+    Format: {"collection": "users", "query": {...}, "limit": 1000}
+    or {"collection": "users", "aggregate": [...]}
+    With raw the cursor returns RawBSONDocuments, which are only decoded when read (see DocumentFlattener).
+    """
+    query_obj, target_coll = parse_mongodb_query(client, request)
+    if raw:
+        from bson.codec_options import CodecOptions
+        from bson.raw_bson import RawBSONDocument
+
+        target_coll = target_coll.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+
+    if 'aggregate' in query_obj:
+        # Aggregation pipeline
+        options = {"batchSize": batch_size} if batch_size else {}
+        if comment:
+            options["comment"] = comment
+        if max_time_ms:
+            options["maxTimeMS"] = max_time_ms
+        return target_coll.aggregate(query_obj['aggregate'], **options)
+
+    # Regular find query (the comment tags the operation so it can be found for killOp)
+    cursor = target_coll.find(query_obj.get('query', {}), query_obj.get('projection', None),
+                              comment=comment)
+    sort = query_obj.get('sort', None)
+    if sort:
+        cursor = cursor.sort(sort)
+    cursor = cursor.limit(query_obj.get('limit', 1000))
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    if max_time_ms:
+        cursor = cursor.max_time_ms(max_time_ms)
+    return cursor
+
+def tighter_limit(requested: Optional[int], configured: Optional[int]) -> Optional[int]:
+    """Per-request limits may only tighten the configured ones. None or <= 0 means no limit."""
+    configured = configured if configured and configured > 0 else None
+    if requested is None or requested <= 0:
+        return configured
+    return min(requested, configured) if configured else requested
+
+class ResultLimits:
+    """Resource limits for one query: server-side statement timeout, row cap and byte cap."""
+
+    def __init__(self, timeout_ms: Optional[int], max_rows: Optional[int], max_bytes: Optional[int]):
+        self.timeout_ms = timeout_ms
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def for_request(cls, request: QueryRequest) -> "ResultLimits":
+        return cls(
+            timeout_ms=tighter_limit(request.timeoutMs, int(STATEMENT_TIMEOUT * 1000)),
+            max_rows=tighter_limit(request.rowLimit, tighter_limit(request.maxRows, MAX_RESULT_ROWS)),
+            max_bytes=tighter_limit(request.maxBytes, MAX_RESULT_BYTES)
+        )
+
+LIMITED_FETCH_BATCH = 1000  # rows per fetchmany() while enforcing ResultLimits
+
+def estimate_rows_size(rows, sample_size: int = 20) -> int:
+    """Approximate JSON size of a batch of rows, from an evenly spaced sample."""
+    if not rows:
+        return 0
+    step = max(len(rows) // sample_size, 1)
+    sample = rows[::step][:sample_size]
+    return int(len(json.dumps(sample, default=str)) * len(rows) / len(sample))
+
+class RowCollector:
+    """
+    Accumulates fetched batches and stops as soon as a row or byte cap is reached,
+    so an oversized result is never fully read from the database.
+    Usage: while collector.add(cursor.fetchmany(collector.batch_size())): pass
+    """
+
+    def __init__(self, limits: ResultLimits):
+        self.limits = limits
+        self.rows = []
+        self.bytes = 0
+        self.truncated_by = None
+
+    def batch_size(self) -> int:
+        if self.limits.max_rows is None:
+            return LIMITED_FETCH_BATCH
+        # One row past the cap tells a truncated result apart from one that fits exactly
+        return max(min(LIMITED_FETCH_BATCH, self.limits.max_rows - len(self.rows) + 1), 1)
+
+    def add(self, batch) -> bool:
+        """Add a batch; returns False once there is nothing more to fetch."""
+        if not batch:
+            return False
+        self.rows.extend(batch)
+        if self.limits.max_rows is not None and len(self.rows) > self.limits.max_rows:
+            del self.rows[self.limits.max_rows:]
+            self.truncated_by = 'maxRows'
+            return False
+        if self.limits.max_bytes is not None:
+            self.bytes += estimate_rows_size(batch)
+            if self.bytes > self.limits.max_bytes:
+                self.truncated_by = 'maxBytes'
+                return False
+        return True
+
+def mysql_timed_sql(server_info: str, query: str, timeout_ms: int) -> str:
+    """
+    The query with a server-side timeout that applies to this statement only, so nothing is
+    left behind on the pooled session: MariaDB's SET STATEMENT max_statement_time (in seconds)
+    ... FOR, or MySQL's MAX_EXECUTION_TIME hint on the top-level SELECT. MySQL only times out
+    SELECTs, so other statements are returned unchanged.
+    """
+    if "mariadb" in (server_info or "").lower():
+        return f"SET STATEMENT max_statement_time = {timeout_ms / 1000.0:.3f} FOR {query}"
+    tokens = tokenize_sql(query, 'mysql')
+    depth = 0
+    for index, (kind, text) in enumerate(tokens):
+        if kind == 'symbol' and text in '()':
+            depth += 1 if text == '(' else -1
+        elif kind == 'word' and depth == 0 and text.upper() == 'SELECT':
+            hint = f"MAX_EXECUTION_TIME({int(timeout_ms)})"
+            following = next((token for token in tokens[index + 1:] if token[0] != 'space'), None)
+            if following is not None and following[0] == 'hint' and following[1].startswith('/*+'):
+                # A query block takes a single hint comment; join the existing one
+                position = tokens.index(following, index + 1)
+                tokens[position] = ('hint', f"/*+ {hint}{following[1][3:]}")
+            else:
+                tokens.insert(index + 1, ('hint', f" /*+ {hint} */"))
+            return ''.join(text for _, text in tokens)
+    return query
+
+class QueryCancelledError(Exception):
+    """The query was cancelled through /api/queries/{id}/cancel or because its client went away."""
+
+    def __init__(self, message="Query was cancelled"):
+        super().__init__(message)
+
+class QueryExecution:
+    """
+    One running query. While the fetcher holds a database session it registers a canceller
+    (see cancellable) that stops the statement server-side; cancel() calls it.
+    The canceller is unregistered before the session goes back to its pool, and cancel()
+    holds the same lock, so a cancel can never hit the next query on a reused connection.
+    """
+
+    def __init__(self, query_id: str, db_type: str, query: str):
+        self.query_id = query_id
+        self.db_type = db_type
+        self.query = query
+        self.started_at = time.time()
+        self.cancelled = False
+        self._canceller = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def cancellable(self, canceller):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError()
+            self._canceller = canceller
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._canceller = None
+
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelledError()
+
+    def cancel(self) -> bool:
+        """Mark the query cancelled and stop its server-side work. Blocking; returns False if already cancelled."""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            if self._canceller is not None:
+                try:
+                    self._canceller()
+                except Exception:
+                    # The statement may have just finished; the flag still stops any further batches
+                    pass
+        return True
+
+    def info(self):
+        return {
+            "queryId": self.query_id,
+            "db_type": self.db_type,
+            "query": self.query[:200],
+            "startedAt": self.started_at,
+            "elapsedMs": int((time.time() - self.started_at) * 1000),
+            "cancelled": self.cancelled
+        }
+
+class QueryRegistry:
+    """Queries currently executing, by query ID."""
+
+    def __init__(self):
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def start(self, request: QueryRequest) -> QueryExecution:
+        query_id = request.queryId or uuid.uuid4().hex
+        with self._lock:
+            if query_id in self._running:
+                raise ValueError(f"A query with ID '{query_id}' is already running")
+            execution = self._running[query_id] = QueryExecution(query_id, request.db_type, request.query)
+        return execution
+
+    def finish(self, execution: QueryExecution):
+        with self._lock:
+            if self._running.get(execution.query_id) is execution:
+                del self._running[execution.query_id]
+
+    @contextmanager
+    def track(self, request: QueryRequest):
+        execution = self.start(request)
+        try:
+            yield execution
+        finally:
+            self.finish(execution)
+
+    def get(self, query_id: str) -> Optional[QueryExecution]:
+        with self._lock:
+            return self._running.get(query_id)
+
+    def list(self):
+        with self._lock:
+            return [execution.info() for execution in self._running.values()]
+
+running_queries = QueryRegistry()
+
+def query_cancellable(execution: Optional[QueryExecution], canceller):
+    """execution.cancellable(canceller), or a no-op when the caller doesn't track the query."""
+    return execution.cancellable(canceller) if execution is not None else nullcontext()
+
+def kill_mysql_query(request: QueryRequest, thread_id: int):
+    """KILL QUERY has to come from a second session; the pool may be exhausted, so open one directly."""
+    import pymysql
+
+    killer = pymysql.connect(
+        host=request.host,
+        port=request.port,
+        user=request.user,
+        password=request.password,
+        connect_timeout=5
+    )
+    try:
+        cursor = killer.cursor()
+        cursor.execute("KILL QUERY %s", (thread_id,))
+        cursor.close()
+    finally:
+        killer.close()
+
+def kill_mongodb_operation(client, comment: str):
+    """killOp every operation of ours tagged with this comment (including getMores of its cursor)."""
+    operations = client.admin.aggregate([
+        {"$currentOp": {}},
+        {"$match": {"$or": [{"command.comment": comment},
+                            {"cursor.originatingCommand.comment": comment}]}}
+    ])
+    for operation in operations:
+        client.admin.command("killOp", op=operation["opid"])
+
+def fetch_mysql_result(request: QueryRequest, execution: Optional[QueryExecution] = None, session=None):
+    """
+    Run a query on a pooled MySQL connection (or the given session connection) and return
+    (columns, tuple rows, truncated_by).
+    """
+    import pymysql
+
+    limits = ResultLimits.for_request(request)
+    with checkout_connection('mysql', request, session) as connection:
+        # Unbuffered tuple cursor: rows are read in batches so the caps apply while fetching
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        thread_id = connection.thread_id()
+        unread = False
+        try:
+            with query_cancellable(execution, lambda: kill_mysql_query(request, thread_id)):
+                query = request.query
+                if limits.timeout_ms:
+                    query = mysql_timed_sql(connection.get_server_info(), query, limits.timeout_ms)
+                cursor.execute(query)
+                unread = True
+                collector = RowCollector(limits)
+                while collector.add(cursor.fetchmany(collector.batch_size())):
+                    pass
+            unread = collector.truncated_by is not None
+            return result_columns(cursor.description, 'mysql'), collector.rows, collector.truncated_by
+        finally:
+            if unread and session is None:
+                # Closing an unbuffered cursor reads every remaining row; drop the connection instead.
+                # A session has to survive for its next statement, so there the rows are drained.
+                connection.close()
+            else:
+                cursor.close()
+
+def postgresql_declarable(query: str) -> bool:
+    """
+    Whether a statement can run through a named (server-side) cursor. Those are DECLAREd, which
+    takes a single SELECT, WITH, VALUES or TABLE query - but not SELECT ... INTO or a WITH
+    holding INSERT, UPDATE, DELETE or MERGE. Comments are skipped, so they can't hide anything.
+    """
+    tokens = [(kind, text) for kind, text in tokenize_sql(query, 'postgresql') if kind not in ('space', 'comment')]
+    while tokens and tokens[-1][1] == ';':
+        tokens.pop()
+    if not tokens or tokens[0][0] != 'word' or tokens[0][1].upper() not in CACHEABLE_SQL_KEYWORDS:
+        return False
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'symbol' and text == ';':
+            return False
+        if kind == 'word' and text.upper() == 'INTO':
+            return False
+        # A data-modifying statement in a WITH: AS ( INSERT ...
+        if kind == 'word' and text.upper() in WRITING_SQL_KEYWORDS and i > 0 and tokens[i - 1][1] == '(':
+            return False
+    return True
+
+def fetch_postgresql_result(request: QueryRequest, execution: Optional[QueryExecution] = None, session=None):
+    """
+    Run a query on a pooled PostgreSQL connection (or the given session connection) and return
+    (columns, tuple rows, truncated_by).
+    """
+    limits = ResultLimits.for_request(request)
+    with checkout_connection('postgresql', request, session) as connection:
+        # Row-returning statements go through a named (server-side) cursor so the caps apply
+        # while fetching; anything else uses a plain tuple cursor
+        named = postgresql_declarable(request.query)
+        cursor = connection.cursor(name=f"qp_fetch_{uuid.uuid4().hex}") if named else connection.cursor()
+        try:
+            # connection.cancel() is thread-safe and sends a protocol-level cancel request
+            with query_cancellable(execution, connection.cancel):
+                if limits.timeout_ms:
+                    # SET LOCAL ends with the transaction, which the pool rolls back on release
+                    settings = connection.cursor()
+                    settings.execute("SET LOCAL statement_timeout = %s", (limits.timeout_ms,))
+                    settings.close()
+                cursor.execute(request.query)
+                collector = RowCollector(limits)
+                # A named cursor only has a description after the first fetch
+                if named or cursor.description:
+                    while collector.add(cursor.fetchmany(collector.batch_size())):
+                        pass
+            return result_columns(cursor.description, 'postgresql'), collector.rows, collector.truncated_by
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+def fetch_mongodb_result(request: QueryRequest, execution: Optional[QueryExecution] = None):
+    """Run a JSON MongoDB query on the cached client and return (columns, positional rows, truncated_by)."""
+    limits = ResultLimits.for_request(request)
+    # Reuse the cached client (and its discovered topology) for this cluster
+    with mongo_clients.acquire(mongodb_connection_string(request)) as client:
+        comment = f"queryPilot:{execution.query_id}" if execution is not None else None
+        cursor = open_mongodb_cursor(client, request, comment=comment, max_time_ms=limits.timeout_ms,
+                                     raw=MONGO_RAW_BSON)
+        flattener = DocumentFlattener(mongodb_flatten_depth(request))
+        try:
+            with query_cancellable(execution, lambda: kill_mongodb_operation(client, comment)):
+                documents = iter(cursor)
+                collector = RowCollector(limits)
+                # Documents are flattened batch by batch, so only their rows are kept
+                while collector.add(list(map(flattener.flatten, itertools.islice(documents, collector.batch_size())))):
+                    if execution is not None:
+                        execution.check()
+        finally:
+            # Also kills the server-side cursor when a cap stopped the fetch early
+            cursor.close()
+
+    return flattener.columns, flattener.pad(collector.rows), collector.truncated_by
+
+def mongodb_flatten_depth(request: QueryRequest) -> int:
+    return max(request.flattenDepth if request.flattenDepth is not None else MONGO_FLATTEN_DEPTH, 0)
+
+def plain_document(value):
+    """A RawBSONDocument (or a list holding some) decoded into dicts and lists."""
+    if isinstance(value, Mapping):
+        return {key: plain_document(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain_document(item) for item in value]
+    return value
+
+class DocumentFlattener:
+    """
+    Turns MongoDB documents into positional rows in a single pass. Sub-documents are expanded
+    into dotted columns (address.city) up to max_depth levels; deeper sub-documents and arrays
+    stay whole, as one JSON value. Columns are numbered in first-seen order, so rows read before
+    a column appeared are just shorter - pad() fills them in at the end.
+    """
+
+    def __init__(self, max_depth: int):
+        self.max_depth = max_depth
+        self.columns = []
+        self._positions = {}
+
+    def flatten(self, document) -> list:
+        row = [None] * len(self.columns)
+        self._flatten(document, "", 0, row)
+        return row
+
+    def _flatten(self, document, prefix: str, depth: int, row: list):
+        for key, value in document.items():
+            if depth < self.max_depth and isinstance(value, Mapping) and value:
+                self._flatten(value, f"{prefix}{key}.", depth + 1, row)
+                continue
+            path = prefix + key
+            position = self._positions.get(path)
+            if position is None:
+                position = self._positions[path] = len(self.columns)
+                self.columns.append(path)
+                row.append(None)
+            if type(value) is not dict and isinstance(value, (Mapping, list)):
+                value = plain_document(value)
+            row[position] = value
+
+    def pad(self, rows: List[list]) -> List[list]:
+        """Extend rows read before the last column appeared to the full width (in place)."""
+        width = len(self.columns)
+        for row in rows:
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+        return rows
+
+QUERY_FETCHERS = {
+    'mysql': fetch_mysql_result,
+    'postgresql': fetch_postgresql_result,
+    'mongodb': fetch_mongodb_result
+}
+
+def fetch_query_result(request: QueryRequest, execution: Optional[QueryExecution] = None, session=None):
+    """
+    Run a validated query and return (columns, rows, truncated_by) with raw driver values.
+    truncated_by is None, or 'maxRows' / 'maxBytes' when a ResultLimits cap stopped the fetch.
+    If the query is cancelled, the driver's error is replaced with QueryCancelledError.
+    session is a SQL connection held across statements (see BatchSession) to run on instead of a pooled one.
+    """
+    fetcher = QUERY_FETCHERS.get(request.db_type)
+    if fetcher is None:
+        raise ValueError(f"Unsupported database type: {request.db_type}")
+    if execution is not None:
+        execution.check()
+    try:
+        return fetcher(request, execution) if session is None else fetcher(request, execution, session)
+    except Exception as e:
+        if execution is not None and execution.cancelled and not isinstance(e, QueryCancelledError):
+            raise QueryCancelledError() from e
+        raise
+
+class AsyncDriverRegistry:
+    """
+    Driver pools for the asyncio engine (QP_QUERY_ENGINE=asyncio): an asyncpg or aiomysql pool
+    per connection identity and a motor client per MongoDB URI. They live on the event loop,
+    so an in-flight query holds a coroutine and a socket instead of a worker thread.
+    """
+
+    def __init__(self):
+        self._pools = {}  # key -> task creating the pool/client
+        self._kinds = {}  # key -> db_type
+
+    async def get(self, key, db_type: str, create):
+        task = self._pools.get(key)
+        if task is None:
+            # Concurrent first requests for one identity share a single pool creation
+            task = self._pools[key] = asyncio.ensure_future(create())
+            self._kinds[key] = db_type
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if self._pools.get(key) is task:
+                del self._pools[key]
+                del self._kinds[key]
+            raise
+
+    async def close_all(self):
+        pools, self._pools, kinds, self._kinds = self._pools, {}, self._kinds, {}
+        for key, task in pools.items():
+            if not task.done() or task.exception() is not None:
+                continue
+            pool = task.result()
+            try:
+                if kinds[key] == 'postgresql':
+                    await pool.close()
+                elif kinds[key] == 'mysql':
+                    pool.close()
+                    await pool.wait_closed()
+                else:
+                    pool.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        stats = []
+        for key, task in self._pools.items():
+            if not task.done() or task.exception() is not None:
+                continue
+            pool, db_type = task.result(), self._kinds[key]
+            if db_type == 'postgresql':
+                stats.append({"db_type": db_type, "host": key[1], "port": key[2], "user": key[3],
+                              "database": key[4], "size": pool.get_size(), "idle": pool.get_idle_size()})
+            elif db_type == 'mysql':
+                stats.append({"db_type": db_type, "host": key[1], "port": key[2], "user": key[3],
+                              "database": key[4], "size": pool.size, "idle": pool.freesize})
+            else:
+                stats.append({"db_type": db_type})
+        return stats
+
+async_drivers = AsyncDriverRegistry()
+
+ASYNC_DRIVER_MODULES = {'mysql': 'aiomysql', 'postgresql': 'asyncpg', 'mongodb': 'motor'}
+_async_driver_installed = {}
+
+def async_engine_enabled(db_type: str) -> bool:
+    """True when QP_QUERY_ENGINE=asyncio and this backend's asyncio driver is installed."""
+    if QUERY_ENGINE != 'asyncio' or db_type not in ASYNC_DRIVER_MODULES:
+        return False
+    if db_type not in _async_driver_installed:
+        # Without the driver the backend keeps using the threaded engine
+        _async_driver_installed[db_type] = importlib.util.find_spec(ASYNC_DRIVER_MODULES[db_type]) is not None
+    return _async_driver_installed[db_type]
+
+async def async_fetch_mysql_result(request: QueryRequest):
+    """aiomysql version of fetch_mysql_result."""
+    import aiomysql
+
+    async def create_pool():
+        return await aiomysql.create_pool(
+            host=request.host,
+            port=request.port,
+            user=request.user,
+            password=request.password,
+            db=request.database,
+            minsize=POOL_MIN_SIZE,
+            maxsize=ASYNC_POOL_MAX_SIZE,
+            connect_timeout=10,
+            pool_recycle=int(POOL_IDLE_TIMEOUT),
+            # Autocommit gives every query a fresh snapshot, like the rollback on release in ConnectionPool
+            autocommit=True
+        )
+
+    key = connection_key('mysql', request.host, request.port, request.user, request.database, request.password)
+    pool = await async_drivers.get(key, 'mysql', create_pool)
+    try:
+        connection = await asyncio.wait_for(pool.acquire(), POOL_CHECKOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeoutError(
+            f"Timed out after {POOL_CHECKOUT_TIMEOUT:.0f}s waiting for a free connection "
+            f"(pool size {ASYNC_POOL_MAX_SIZE}). Try again shortly."
+        )
+    limits = ResultLimits.for_request(request)
+    cursor = await connection.cursor(aiomysql.SSCursor)
+    unread = False
+    try:
+        query = request.query
+        if limits.timeout_ms:
+            query = mysql_timed_sql(connection.get_server_info(), query, limits.timeout_ms)
+        await cursor.execute(query)
+        unread = True
+        collector = RowCollector(limits)
+        while collector.add(await cursor.fetchmany(collector.batch_size())):
+            pass
+        unread = collector.truncated_by is not None
+        return result_columns(cursor.description, 'mysql'), collector.rows, collector.truncated_by
+    finally:
+        if unread:
+            # Same as fetch_mysql_result: don't read the rest of a truncated result
+            connection.close()
+        else:
+            await cursor.close()
+        pool.release(connection)
+
+async def async_fetch_postgresql_result(request: QueryRequest):
+    """asyncpg version of fetch_postgresql_result."""
+    import asyncpg
+
+    async def create_pool():
+        return await asyncpg.create_pool(
+            host=request.host,
+            port=request.port,
+            user=request.user,
+            password=request.password,
+            database=request.database,
+            min_size=POOL_MIN_SIZE,
+            max_size=ASYNC_POOL_MAX_SIZE,
+            timeout=10,
+            max_inactive_connection_lifetime=POOL_IDLE_TIMEOUT
+        )
+
+    key = connection_key('postgresql', request.host, request.port, request.user, request.database, request.password)
+    pool = await async_drivers.get(key, 'postgresql', create_pool)
+    try:
+        connection = await pool.acquire(timeout=POOL_CHECKOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeoutError(
+            f"Timed out after {POOL_CHECKOUT_TIMEOUT:.0f}s waiting for a free connection "
+            f"(pool size {ASYNC_POOL_MAX_SIZE}). Try again shortly."
+        )
+    limits = ResultLimits.for_request(request)
+    try:
+        # Cursors and SET LOCAL both need a transaction
+        async with connection.transaction():
+            if limits.timeout_ms:
+                await connection.execute(f"SET LOCAL statement_timeout = {int(limits.timeout_ms)}")
+            # A prepared statement exposes the column names even when no rows come back
+            statement = await connection.prepare(request.query)
+            columns = result_columns([(attribute.name, attribute.type.oid) for attribute in statement.get_attributes()],
+                                     'postgresql')
+            collector = RowCollector(limits)
+            if columns:
+                cursor = await statement.cursor()
+                while collector.add([tuple(record) for record in await cursor.fetch(collector.batch_size())]):
+                    pass
+            else:
+                await statement.fetch()
+        return columns, collector.rows, collector.truncated_by
+    finally:
+        await pool.release(connection)
+
+async def async_fetch_mongodb_result(request: QueryRequest):
+    """motor version of fetch_mongodb_result."""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    conn_str = mongodb_connection_string(request)
+
+    async def create_client():
+        try:
+            return AsyncIOMotorClient(conn_str, serverSelectionTimeoutMS=10000)
+        except Exception as e:
+            if "RFC 3986" in str(e) or "must be escaped" in str(e).lower():
+                return AsyncIOMotorClient(fix_mongodb_uri(conn_str), serverSelectionTimeoutMS=10000)
+            raise e
+
+    key = ('mongodb', hashlib.sha256(conn_str.encode("utf-8")).hexdigest())
+    client = await async_drivers.get(key, 'mongodb', create_client)
+    # Motor collections mirror pymongo's find/aggregate/sort/limit API
+    limits = ResultLimits.for_request(request)
+    cursor = open_mongodb_cursor(client, request, max_time_ms=limits.timeout_ms, raw=MONGO_RAW_BSON)
+    flattener = DocumentFlattener(mongodb_flatten_depth(request))
+    collector = RowCollector(limits)
+    try:
+        while collector.add(list(map(flattener.flatten, await cursor.to_list(length=collector.batch_size())))):
+            pass
+    finally:
+        await cursor.close()
+    return flattener.columns, flattener.pad(collector.rows), collector.truncated_by
+
+ASYNC_QUERY_FETCHERS = {
+    'mysql': async_fetch_mysql_result,
+    'postgresql': async_fetch_postgresql_result,
+    'mongodb': async_fetch_mongodb_result
+}
+
+async def async_fetch_query_result(request: QueryRequest):
+    """Asyncio-engine counterpart of fetch_query_result."""
+    return await ASYNC_QUERY_FETCHERS[request.db_type](request)
+
+STREAM_BATCH_SIZE = int(os.getenv("QP_STREAM_BATCH_SIZE", "1000"))
+
+def stream_mysql_rows(request: QueryRequest, batch_size: int, execution: Optional[QueryExecution] = None,
+                      convert=json_value, timeout_ms: Optional[int] = None):
+    """Yield ("columns", [...]) and then ("rows", [...]) batches of tuples from an unbuffered server-side cursor."""
+    import pymysql
+
+    with pooled_connection('mysql', request.host, request.port, request.user,
+                           request.password, request.database) as connection, \
+            query_cancellable(execution, lambda: kill_mysql_query(request, connection.thread_id())):
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        drained = True
+        try:
+            if timeout_ms is None:
+                timeout_ms = ResultLimits.for_request(request).timeout_ms
+            query = request.query
+            if timeout_ms is not None:
+                query = mysql_timed_sql(connection.get_server_info(), query, timeout_ms)
+            cursor.execute(query)
+            drained = False
+            yield "columns", result_columns(cursor.description, 'mysql')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield "rows", rows if convert is None else [tuple(map(convert, row)) for row in rows]
+            drained = True
+        finally:
+            if drained:
+                cursor.close()
+            else:
+                # Closing an unbuffered cursor reads every remaining row; drop the connection instead
+                connection.close()
+
+def stream_postgresql_rows(request: QueryRequest, batch_size: int, execution: Optional[QueryExecution] = None,
+                           convert=json_value, timeout_ms: Optional[int] = None):
+    """Yield ("columns", [...]) and then ("rows", [...]) batches of tuples from a named (server-side) cursor."""
+    with pooled_connection('postgresql', request.host, request.port, request.user,
+                           request.password, request.database) as connection, \
+            query_cancellable(execution, connection.cancel):
+        # Named cursors are DECLAREd, which only works for row-returning queries
+        if postgresql_declarable(request.query):
+            cursor = connection.cursor(name=f"qp_stream_{uuid.uuid4().hex}")
+            cursor.itersize = batch_size
+        else:
+            cursor = connection.cursor()
+        try:
+            if timeout_ms is None:
+                timeout_ms = ResultLimits.for_request(request).timeout_ms
+            if timeout_ms is not None:
+                settings = connection.cursor()
+                settings.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+                settings.close()
+            cursor.execute(request.query)
+            # A named cursor only has a description after the first fetch
+            rows = cursor.fetchmany(batch_size)
+            yield "columns", result_columns(cursor.description, 'postgresql')
+            while rows:
+                yield "rows", rows if convert is None else [tuple(map(convert, row)) for row in rows]
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+def stream_mongodb_rows(request: QueryRequest, batch_size: int, execution: Optional[QueryExecution] = None,
+                        convert=json_value, timeout_ms: Optional[int] = None):
+    """
+    Yield ("columns", [...]) and ("rows", [...]) batches of tuples from a batched MongoDB cursor,
+    flattened like fetch_mongodb_result (see DocumentFlattener). Documents are schemaless,
+    so an updated column list is yielded whenever a batch introduces new fields; the rows
+    after it are padded to the new list, earlier rows are not.
+    """
+    comment = f"queryPilot:{execution.query_id}" if execution is not None else None
+    with mongo_clients.acquire(mongodb_connection_string(request)) as client, \
+            query_cancellable(execution, lambda: kill_mongodb_operation(client, comment)):
+        if timeout_ms is None:
+            timeout_ms = ResultLimits.for_request(request).timeout_ms
+        cursor = open_mongodb_cursor(client, request, batch_size=batch_size, comment=comment, max_time_ms=timeout_ms,
+                                     raw=MONGO_RAW_BSON)
+        flattener = DocumentFlattener(mongodb_flatten_depth(request))
+        try:
+            columns = []
+            documents = iter(cursor)
+            while True:
+                batch = list(map(flattener.flatten, itertools.islice(documents, batch_size)))
+                if execution is not None:
+                    execution.check()
+                if len(flattener.columns) > len(columns) or not columns:
+                    columns = list(flattener.columns)
+                    yield "columns", columns
+                if not batch:
+                    break
+                rows = flattener.pad(batch)
+                yield "rows", rows if convert is None else [tuple(map(convert, row)) for row in rows]
+                if len(batch) < batch_size:
+                    break
+        finally:
+            cursor.close()
+
+async def iterate_in_thread(iterator, executor: Optional[BackendExecutor] = None):
+    """
+    Drive a blocking iterator from the event loop, running each next() call in a worker thread
+    (on the given backend executor, already admitted, or the default one).
+    If the consumer stops early (e.g. the client disconnected) the iterator is closed in the
+    background once any in-flight next() returns, so its cleanup code still runs.
+    """
+    loop = asyncio.get_running_loop()
+    done = object()
+    pending = None
+    try:
+        while True:
+            if executor is not None:
+                pending = asyncio.ensure_future(executor.run(next, iterator, done, force=True))
+            else:
+                pending = loop.run_in_executor(None, next, iterator, done)
+            item = await pending
+            if item is done:
+                break
+            yield item
+    finally:
+        if pending is not None and not pending.done():
+            pending.add_done_callback(lambda _: loop.run_in_executor(None, iterator.close))
+        else:
+            loop.run_in_executor(None, iterator.close)
+
+# Rows are tuples in the order of the last column list, whose names are unique (see
+# result_columns). Values go through convert (json_value by default, None for the driver's
+# values); timeout_ms overrides the ResultLimits statement timeout, 0 disabling it
+STREAM_PRODUCERS = {
+    'mysql': stream_mysql_rows,
+    'postgresql': stream_postgresql_rows,
+    'mongodb': stream_mongodb_rows
+}
+
+def quote_identifier(name: str, dialect: str) -> str:
+    if dialect == 'mysql':
+        return "`" + name.replace("`", "``") + "`"
+    return '"' + name.replace('"', '""') + '"'
+
+def timed_statement(connection, db_type: str, sql: str, timeout_ms: Optional[int]) -> str:
+    """
+    Apply a server-side statement timeout for running sql on a pooled MySQL/PostgreSQL
+    connection, and return the statement to execute.
+    """
+    if not timeout_ms:
+        return sql
+    if db_type == 'mysql':
+        return mysql_timed_sql(connection.get_server_info(), sql, timeout_ms)
+    cursor = connection.cursor()
+    try:
+        # SET LOCAL ends with the transaction, which the pool rolls back on release
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+    finally:
+        cursor.close()
+    return sql
+
+def row_returning_sql(request: QueryRequest) -> str:
+    """The normalized query (comments and trailing ';' removed), ready to be wrapped as a derived table."""
+    query = normalize_sql(request.query, request.db_type)
+    if not query or query.split()[0].upper() not in CACHEABLE_SQL_KEYWORDS:
+        raise ValueError("Only row-returning queries (SELECT, WITH, VALUES, TABLE) can be paginated by key or counted")
+    return query
+
+def fetch_keyset_page(request: QueryRequest, after: Optional[List[Any]], limit: int,
+                      execution: Optional[QueryExecution] = None):
+    """
+    Fetch the rows that follow `after` in orderKey order, by wrapping the query:
+    SELECT * FROM (query) AS qp_page WHERE (keys) > (after) ORDER BY keys LIMIT limit + 1
+    Every page is an index range scan when orderKey is indexed, however deep the page.
+    Returns (columns, tuple rows, more, last key).
+    """
+    dialect = request.db_type
+    keys = ', '.join(quote_identifier(column, dialect) for column in request.orderKey)
+    query = row_returning_sql(request)
+    params = None
+    if after is not None:
+        if len(after) != len(request.orderKey):
+            raise ValueError("Page token does not match orderKey")
+        # With parameters, the drivers treat '%' in the query text as a placeholder
+        query = query.replace('%', '%%')
+        params = tuple(after)
+    sql = f"SELECT * FROM ({query}) AS qp_page"
+    if params is not None:
+        sql += f" WHERE ({keys}) > ({', '.join(['%s'] * len(params))})"
+    sql += f" ORDER BY {keys} LIMIT {limit + 1}"
+
+    with pooled_connection(dialect, request.host, request.port, request.user,
+                           request.password, request.database) as connection:
+        if dialect == 'mysql':
+            thread_id = connection.thread_id()
+            canceller = lambda: kill_mysql_query(request, thread_id)
+        else:
+            canceller = connection.cancel
+        cursor = connection.cursor()
+        try:
+            with query_cancellable(execution, canceller):
+                cursor.execute(timed_statement(connection, dialect, sql,
+                                               ResultLimits.for_request(request).timeout_ms), params)
+                rows = cursor.fetchall()
+            columns = result_columns(cursor.description, dialect)
+        finally:
+            cursor.close()
+
+    more = len(rows) > limit
+    rows = list(rows[:limit])
+    last_key = None
+    if rows:
+        positions = [columns.index(column) for column in request.orderKey]
+        last_key = [json_safe_value(rows[-1][position]) for position in positions]
+    return columns, rows, more, last_key
+
+def count_sql_rows(request: QueryRequest, execution: Optional[QueryExecution] = None) -> int:
+    """SELECT COUNT(*) over the query, wrapped as a derived table."""
+    query = row_returning_sql(request)
+    with pooled_connection(request.db_type, request.host, request.port, request.user,
+                           request.password, request.database) as connection:
+        if request.db_type == 'mysql':
+            thread_id = connection.thread_id()
+            canceller = lambda: kill_mysql_query(request, thread_id)
+        else:
+            canceller = connection.cancel
+        cursor = connection.cursor()
+        try:
+            with query_cancellable(execution, canceller):
+                cursor.execute(timed_statement(connection, request.db_type, f"SELECT COUNT(*) FROM ({query}) AS qp_count",
+                                               ResultLimits.for_request(request).timeout_ms))
+                return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+def count_mongodb_documents(request: QueryRequest, execution: Optional[QueryExecution] = None) -> int:
+    """count_documents() for find queries (honouring their limit), a $count stage for pipelines."""
+    timeout_ms = ResultLimits.for_request(request).timeout_ms
+    with mongo_clients.acquire(mongodb_connection_string(request)) as client:
+        query_obj, collection = parse_mongodb_query(client, request)
+        options = {"maxTimeMS": timeout_ms} if timeout_ms else {}
+        comment = f"queryPilot:{execution.query_id}" if execution is not None else None
+        if comment is not None:
+            options["comment"] = comment
+        with query_cancellable(execution, lambda: kill_mongodb_operation(client, comment)):
+            if 'aggregate' in query_obj:
+                counted = list(collection.aggregate(query_obj['aggregate'] + [{"$count": "n"}], **options))
+                return counted[0]["n"] if counted else 0
+            limit = query_obj.get('limit', 1000)
+            if limit:
+                options["limit"] = limit
+            return collection.count_documents(query_obj.get('query', {}), **options)
+
+def count_query_rows(request: QueryRequest, execution: Optional[QueryExecution] = None) -> int:
+    if request.db_type == 'mongodb':
+        return count_mongodb_documents(request, execution)
+    return count_sql_rows(request, execution)
+
+class HeldCursor:
+    """
+    A paginated result read from a server-side cursor that stays open between page requests.
+    It is a suspended stream producer (stream_*_rows): each page resumes the generator for one
+    more batch, and closing the generator releases the cursor and its connection.
+    The cursor is tracked in running_queries for its whole life, so it can be cancelled.
+    """
+
+    def __init__(self, result_id: str, request: QueryRequest, page_size: int, execution: QueryExecution):
+        self.result_id = result_id
+        self.db_type = request.db_type
+        self.pool_key = connection_key(request.db_type, request.host, request.port, request.user,
+                                       request.database, request.password)
+        self.page_size = page_size
+        self.execution = execution
+        self.columns = []
+        self.served = 0
+        self.closed = False
+        self.last_used = time.monotonic()
+        self._events = STREAM_PRODUCERS[request.db_type](request, page_size, execution)
+        self._lock = threading.Lock()
+
+    def read_page(self):
+        """Blocking; returns (columns, tuple rows, exhausted)."""
+        with self._lock:
+            if self.closed:
+                raise ValueError("Page token has expired; run the query again")
+            self.last_used = time.monotonic()
+            rows = []
+            try:
+                for kind, payload in self._events:
+                    if kind == "columns":
+                        self.columns = payload
+                    else:
+                        rows = payload
+                        break
+            except Exception as e:
+                self._close()
+                if self.execution.cancelled and not isinstance(e, QueryCancelledError):
+                    raise QueryCancelledError() from e
+                raise
+            self.served += len(rows)
+            self.last_used = time.monotonic()
+            exhausted = len(rows) < self.page_size
+            if exhausted:
+                self._close()
+            return self.columns, rows, exhausted
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def close(self):
+        """Blocking; stops the statement if a page is still being read, then releases the cursor."""
+        if self.busy:
+            self.execution.cancel()
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._events.close()
+            finally:
+                running_queries.finish(self.execution)
+
+class PageCursorRegistry:
+    """
+    Held cursors by result ID, least recently used first. Each one occupies a pooled connection,
+    so at most max_cursors are kept, at most max_per_pool of them on one connection pool (so
+    they can't take all of its connections), and cursors idle longer than idle_timeout are closed.
+    """
+
+    def __init__(self, max_cursors: int = PAGE_CURSORS_MAX, idle_timeout: float = PAGE_CURSOR_IDLE_TIMEOUT,
+                 max_per_pool: int = PAGE_CURSORS_PER_POOL):
+        self.max_cursors = max(max_cursors, 1)
+        self.max_per_pool = max(max_per_pool, 1)
+        self.idle_timeout = idle_timeout
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def open(self, result_id: str, request: QueryRequest, page_size: int):
+        """Register a new cursor; returns (cursor, cursors the caller must close)."""
+        execution = running_queries.start(request)
+        cursor = HeldCursor(result_id, request, page_size, execution)
+        with self._lock:
+            evicted = self._pop_expired()
+            while len(self._cursors) >= self.max_cursors:
+                evicted.append(self._cursors.popitem(last=False)[1])
+            same_pool = [held_id for held_id, held in self._cursors.items() if held.pool_key == cursor.pool_key]
+            for held_id in same_pool[:max(len(same_pool) + 1 - self.max_per_pool, 0)]:
+                evicted.append(self._cursors.pop(held_id))
+            self._cursors[result_id] = cursor
+            self.opened += 1
+            self.evicted += len(evicted)
+        return cursor, evicted
+
+    def get(self, result_id: str) -> Optional[HeldCursor]:
+        with self._lock:
+            cursor = self._cursors.get(result_id)
+            if cursor is not None:
+                self._cursors.move_to_end(result_id)
+            return cursor
+
+    def remove(self, result_id: str) -> Optional[HeldCursor]:
+        with self._lock:
+            return self._cursors.pop(result_id, None)
+
+    def sweep(self) -> List[HeldCursor]:
+        """Unregister idle and closed cursors; returns those the caller must close."""
+        with self._lock:
+            expired = self._pop_expired()
+            self.evicted += len(expired)
+            return expired
+
+    def _pop_expired(self) -> List[HeldCursor]:
+        now = time.monotonic()
+        expired = [result_id for result_id, cursor in self._cursors.items()
+                   if cursor.closed or (not cursor.busy and now - cursor.last_used > self.idle_timeout)]
+        return [self._cursors.pop(result_id) for result_id in expired]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": len(self._cursors),
+                "max_cursors": self.max_cursors,
+                "max_per_pool": self.max_per_pool,
+                "idle_timeout": self.idle_timeout,
+                "opened": self.opened,
+                "evicted": self.evicted,
+                "cursors": [{"resultId": cursor.result_id, "db_type": cursor.db_type, "served": cursor.served,
+                             "idleSeconds": round(time.monotonic() - cursor.last_used, 1)}
+                            for cursor in self._cursors.values()]
+            }
+
+page_cursors = PageCursorRegistry()
+
+class RowCountRegistry:
+    """
+    Background row counts for paginated results, by result ID. Counts run concurrently with the
+    first page and are picked up by later pages or /api/results/{id}/count. Each count is a
+    tracked query (see start), so replacing or discarding it stops it server-side. Event loop only.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()  # result ID -> future of the count
+        self._executions = {}  # future -> QueryExecution of a count still running
+
+    def start(self, result_id: str, awaitable, execution: Optional[QueryExecution] = None):
+        """
+        Track a count. execution is the count's entry in running_queries; it is finished when the
+        count completes and cancelled when the count is no longer wanted.
+        """
+        future = asyncio.ensure_future(awaitable)
+        # Failures are reported through status(); don't log them as unretrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if execution is not None:
+            self._executions[future] = execution
+            future.add_done_callback(self._finished)
+        self._store(result_id, future)
+
+    def resolve(self, result_id: str, count: int):
+        """The cursor reached the end, so the count is known without waiting for the query."""
+        previous = self._counts.get(result_id)
+        if previous is not None and previous.done() and not previous.cancelled() and previous.exception() is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(count)
+        self._store(result_id, future)
+        if previous is not None:
+            self._cancel(previous)
+
+    def status(self, result_id: str) -> Optional[Dict[str, Any]]:
+        future = self._counts.get(result_id)
+        if future is None:
+            return None
+        if not future.done():
+            return {"status": "pending"}
+        if future.cancelled():
+            return {"status": "unavailable"}
+        if future.exception() is not None:
+            return {"status": "error", "error": describe_query_error(future.exception())}
+        return {"status": "ready", "totalCount": future.result()}
+
+    def total(self, result_id: str) -> Optional[int]:
+        status = self.status(result_id)
+        return status["totalCount"] if status and status["status"] == "ready" else None
+
+    async def wait(self, result_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        future = self._counts.get(result_id)
+        if future is not None and timeout > 0:
+            await asyncio.wait({future}, timeout=timeout)
+        return self.status(result_id)
+
+    def discard(self, result_id: str):
+        future = self._counts.pop(result_id, None)
+        if future is not None:
+            self._cancel(future)
+
+    def _store(self, result_id: str, future):
+        self._counts[result_id] = future
+        self._counts.move_to_end(result_id)
+        while len(self._counts) > self.max_entries:
+            self._cancel(self._counts.popitem(last=False)[1])
+
+    def _cancel(self, future):
+        if future.done():
+            return
+        execution = self._executions.pop(future, None)
+        future.cancel()
+        if execution is not None:
+            # The worker thread keeps running until the statement is stopped; that may need a new session
+            asyncio.get_running_loop().run_in_executor(None, execution.cancel)
+            running_queries.finish(execution)
+
+    def _finished(self, future):
+        execution = self._executions.pop(future, None)
+        if execution is not None:
+            running_queries.finish(execution)
+
+row_counts = RowCountRegistry()
+
+def page_query_digest(request: QueryRequest) -> str:
+    """Ties a page token to the query and connection it was issued for."""
+    target = [request.db_type, request.host, request.port, request.user, request.database,
+              mongodb_connection_string(request) if request.db_type == 'mongodb' else None,
+              request.query, request.orderKey, request.rowLimit]
+    return hashlib.sha256(json.dumps(target, default=str).encode("utf-8")).hexdigest()[:16]
+
+def encode_page_token(state: Dict[str, Any]) -> str:
+    raw = json.dumps(state, separators=(',', ':'), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_page_token(token: str, digest: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page token")
+    if not isinstance(state, dict) or state.get("q") != digest:
+        raise ValueError("Page token was issued for a different query")
+    return state
+
+NUMERIC_TEXT_CHARS = set("0123456789.-+einfa")  # every character str() of an int or float can contain (1e+20, nan, inf)
+
+def display_text(value) -> str:
+    """A value as the results table shows it, for case-insensitive "contains" filters."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+def decimal_sort_value(value) -> float:
+    """A decimal column's value (usually its exact string) as a float64 to order by; NaN if it isn't a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+class StoredColumn:
+    """
+    One column of a stored result, in numpy arrays.
+    - numeric columns (only ints/floats): `values` (int64 or float64) plus a `nulls` mask
+    - everything else: dictionary-encoded - `codes` (int32, -1 for NULL) index `dictionary`;
+      decimal columns (strings, see convert_decimal) also get float64 `values` to sort by
+    Text filters are evaluated once per distinct value and mapped onto the rows with one take,
+    so their cost barely depends on the row count; numeric columns get their distinct values
+    (np.unique) the first time they are filtered.
+    """
+
+    def __init__(self, name: str, values: List[Any], column_type: Optional[str] = None):
+        import numpy as np
+
+        self.name = name
+        self.column_type = column_type
+        self.numeric = all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values)
+        self._text_view = None
+        self._ranks = None
+        self._last_match = None  # (needle, hits per distinct value) of the previous filter
+        self._lock = threading.Lock()
+        if self.numeric:
+            self.nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+            integral = all(isinstance(v, int) and -2 ** 63 <= v < 2 ** 63 for v in values if v is not None)
+            self.values = np.array([0 if v is None else v for v in values],
+                                   dtype=np.int64 if integral else np.float64)
+            self.nbytes = self.values.nbytes + self.nulls.nbytes
+        else:
+            # Keyed by (type, value) where needed so True, 1 and 1.0 don't share a code
+            lookup = {}
+            self.dictionary = []
+            codes = []
+            for value in values:
+                if value is None:
+                    codes.append(-1)
+                    continue
+                if type(value) is str:
+                    key = value
+                elif isinstance(value, (dict, list)):
+                    # JSON documents aren't hashable; equal documents share a code
+                    key = (type(value), json.dumps(value, sort_keys=True))
+                else:
+                    key = (type(value), value)
+                code = lookup.get(key)
+                if code is None:
+                    code = lookup[key] = len(self.dictionary)
+                    self.dictionary.append(value)
+                codes.append(code)
+            self.codes = np.array(codes, dtype=np.int32)
+            self.nulls = self.codes < 0
+            self.nbytes = self.codes.nbytes + sum(len(display_text(v)) + 64 for v in self.dictionary)
+            if column_type == 'decimal':
+                numbers = np.array([decimal_sort_value(v) for v in self.dictionary] + [0.0], dtype=np.float64)
+                self.values = numbers[self.codes]
+                self.nbytes += self.values.nbytes
+
+    def text_view(self):
+        """
+        (lower-cased text per distinct value, code per row). Numeric texts are ASCII, so they are
+        kept as a compact bytes array for np.char.find; they are built lazily (see warm).
+        """
+        import numpy as np
+
+        with self._lock:
+            if self._text_view is None:
+                if self.numeric:
+                    distinct, inverse = np.unique(self.values[~self.nulls], return_inverse=True)
+                    codes = np.full(len(self.values), -1, dtype=np.int32)
+                    codes[~self.nulls] = inverse
+                    texts = np.array([display_text(v).lower() for v in distinct.tolist()], dtype='S')
+                    self._text_view = (texts, codes)
+                    self.nbytes += texts.nbytes + codes.nbytes
+                else:
+                    self._text_view = ([display_text(v).lower() for v in self.dictionary], self.codes)
+            return self._text_view
+
+    def contains(self, needle: str):
+        """Boolean mask of the rows whose text contains needle (lower-cased); NULL never matches."""
+        import numpy as np
+
+        if self.numeric and not set(needle) <= NUMERIC_TEXT_CHARS:
+            return np.zeros(len(self.nulls), dtype=bool)
+        texts, codes = self.text_view()
+        with self._lock:
+            last = self._last_match
+        if last is not None and last[0] in needle:
+            # The filter was extended (typing): only values that matched before can match now
+            candidates = last[1].nonzero()[0]
+            hits = np.zeros(len(texts), dtype=bool)
+            hits[candidates] = self._match(texts, candidates, needle)
+        else:
+            hits = self._match(texts, None, needle)
+        with self._lock:
+            self._last_match = (needle, hits)
+        # Code -1 (NULL) picks the trailing False
+        return np.append(hits, False)[codes]
+
+    def _match(self, texts, candidates, needle: str):
+        import numpy as np
+
+        if self.numeric:
+            subset = texts if candidates is None else texts[candidates]
+            return np.char.find(subset, needle.encode("ascii")) >= 0
+        if candidates is None:
+            return np.fromiter((needle in text for text in texts), dtype=bool, count=len(texts))
+        return np.fromiter((needle in texts[i] for i in candidates.tolist()), dtype=bool, count=len(candidates))
+
+    def sort_key(self, descending: bool):
+        """Key array for np.lexsort: the value itself, or the rank of a dictionary value in text order."""
+        import numpy as np
+
+        if self.numeric or self.column_type == 'decimal':
+            key = self.values.astype(np.float64)
+        else:
+            with self._lock:
+                if self._ranks is None:
+                    order = sorted(range(len(self.dictionary)),
+                                   key=lambda code: display_text(self.dictionary[code]).lower())
+                    ranks = np.empty(len(order) + 1, dtype=np.int64)
+                    ranks[np.array(order, dtype=np.int64)] = np.arange(len(order))
+                    ranks[-1] = 0  # NULL, ordered by the null flag instead
+                    self._ranks = ranks
+            key = self._ranks[self.codes]
+        return -key if descending else key
+
+    def take(self, indices) -> List[Any]:
+        if self.numeric:
+            values = self.values[indices].tolist()
+            for position in self.nulls[indices].nonzero()[0].tolist():
+                values[position] = None
+            return values
+        return [self.dictionary[code] if code >= 0 else None for code in self.codes[indices].tolist()]
+
+class StoredResult:
+    """
+    An executed result kept server-side in columnar form (see StoredColumn), so the results
+    table can filter, sort and page it without re-querying the source database or shipping
+    every row to the browser. Sort permutations are cached, so typing in a filter over a
+    sorted result only costs the filter.
+    """
+
+    SORT_CACHE_SIZE = 4
+
+    def __init__(self, columns: List[str], column_values: List[List[Any]],
+                 column_types: Optional[List[Optional[str]]] = None):
+        self.columns = columns
+        column_types = column_types or [None] * len(columns)
+        self.stored = [StoredColumn(name, values, column_type)
+                       for name, values, column_type in zip(columns, column_values, column_types)]
+        self.row_count = len(column_values[0]) if column_values else 0
+        self._by_name = {column.name: column for column in self.stored}
+        self._sort_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_encoded(cls, encoded: Dict[str, Any]) -> "StoredResult":
+        """Build from an encode_result payload in any format."""
+        columns = encoded.get("columns") or []
+        if encoded.get("format") == "columnar":
+            dictionaries = encoded.get("dictionaries") or {}
+            column_values = [[dictionaries[name][code] for code in values] if name in dictionaries else values
+                             for name, values in zip(columns, encoded.get("data") or [])]
+        else:
+            if encoded.get("format") == "arrays":
+                rows = encoded.get("data") or []
+            else:
+                rows = [[row.get(column) for column in columns] for row in encoded.get("rows") or []]
+            column_values = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        return cls(columns, column_values, encoded.get("columnTypes"))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.stored) + 1024
+
+    def warm(self):
+        """Build every column's filter index up front, so the first keystroke doesn't pay for it."""
+        for column in self.stored:
+            column.text_view()
+
+    def column(self, name: str) -> StoredColumn:
+        column = self._by_name.get(name)
+        if column is None:
+            raise ValueError(f"Unknown column '{name}'")
+        return column
+
+    def sorted_order(self, sort: List[tuple]):
+        """Row permutation for [(column, descending), ...]; NULLs last in either direction."""
+        import numpy as np
+
+        key = tuple(sort)
+        with self._lock:
+            order = self._sort_cache.get(key)
+            if order is not None:
+                self._sort_cache.move_to_end(key)
+                return order
+        # np.lexsort sorts by the last key first, so the primary column's keys go last
+        keys = []
+        for name, descending in reversed(sort):
+            column = self.column(name)
+            keys.append(column.sort_key(descending))
+            keys.append(column.nulls)
+        order = np.lexsort(keys)
+        with self._lock:
+            self._sort_cache[key] = order
+            while len(self._sort_cache) > self.SORT_CACHE_SIZE:
+                self._sort_cache.popitem(last=False)
+        return order
+
+    def view(self, global_filter: Optional[str], column_filters: Dict[str, str],
+             sort: List[tuple], offset: int, limit: int):
+        """Filter, sort and window the result; returns (window rows as tuples, filtered row count)."""
+        import numpy as np
+
+        mask = None
+        if global_filter:
+            needle = global_filter.lower()
+            mask = np.zeros(self.row_count, dtype=bool)
+            for column in self.stored:
+                mask |= column.contains(needle)
+        for name, text in column_filters.items():
+            if text:
+                matches = self.column(name).contains(text.lower())
+                mask = matches if mask is None else mask & matches
+
+        if sort:
+            order = self.sorted_order(sort)
+            if mask is not None:
+                order = order[mask[order]]
+        else:
+            order = mask.nonzero()[0] if mask is not None else None
+
+        filtered_count = len(order) if order is not None else self.row_count
+        if order is not None:
+            window = order[offset:offset + limit]
+        else:
+            window = np.arange(min(offset, self.row_count), min(offset + limit, self.row_count))
+        rows = list(zip(*(column.take(window) for column in self.stored))) if len(window) else []
+        return rows, filtered_count
+
+result_store = ResultCache(max_bytes=RESULT_STORE_MAX_BYTES)
+
+pending_results = {}  # result ID -> task building its StoredResult
+
+async def store_result(encoded: Dict[str, Any]) -> Optional[str]:
+    """
+    Keep an encoded result for /api/results/{id}/view and return its result ID (None without numpy).
+    The columnar copy is built in the background, so the query response isn't held up by it.
+    """
+    if importlib.util.find_spec("numpy") is None:
+        return None
+    result_id = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+
+    def build():
+        stored = StoredResult.from_encoded(encoded)
+        stored.warm()
+        return stored
+
+    async def keep():
+        try:
+            stored = await loop.run_in_executor(None, build)
+            result_store.put(result_id, stored, stored.nbytes, RESULT_STORE_TTL)
+        finally:
+            pending_results.pop(result_id, None)
+
+    task = pending_results[result_id] = asyncio.ensure_future(keep())
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return result_id
+
+async def kept_result(result_id: str) -> Optional[StoredResult]:
+    """The stored result, waiting for it if it is still being built."""
+    task = pending_results.get(result_id)
+    if task is not None:
+        await asyncio.wait({task})
+    return result_store.get(result_id)
+
+EXPORT_FORMATS = {
+    # format -> (file extension, media type)
+    'csv': ('csv', 'text/csv'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+EXPORT_COMPRESSIONS = {
+    # compression -> (file suffix, media type, optional module it needs)
+    'gzip': ('.gz', 'application/gzip', None),
+    'zstd': ('.zst', 'application/zstd', 'zstandard')
+}
+
+def export_value(value):
+    """
+    Driver values for Parquet: types pyarrow understands pass through, documents and arrays
+    become JSON text and anything else is stringified.
+    """
+    if value is None or isinstance(value, (int, float, str, bool, bytes, decimal.Decimal,
+                                           datetime.date, datetime.time, datetime.timedelta)):
+        return value
+    if isinstance(value, (Mapping, list, tuple)):
+        return json.dumps(json_value(plain_document(value)))
+    return str(value)
+
+def csv_export_value(value):
+    """Values for CSV: the JSON encodings of json_value, with documents and arrays as JSON text."""
+    value = json_value(plain_document(value))
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+# Export format -> converter applied to every value before it is encoded
+EXPORT_CONVERTERS = {
+    'csv': csv_export_value,
+    'jsonl': lambda value: json_value(plain_document(value)),
+    'parquet': export_value
+}
+
+def csv_export_chunks(events):
+    """
+    Encode stream producer events as CSV. The header comes from the first column list, so a
+    producer that adds columns later (MongoDB) has to go through spooled_events first.
+    """
+    columns = None
+    for kind, payload in events:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if kind == "columns":
+            if columns is not None:
+                if len(payload) > len(columns):
+                    raise ValueError(f"Column '{payload[len(columns)]}' appeared after the CSV header was written")
+                continue
+            columns = payload
+            writer.writerow(columns)
+        else:
+            writer.writerows([["" if value is None else value for value in row] for row in payload])
+        yield buffer.getvalue().encode("utf-8")
+
+def spooled_events(events):
+    """
+    Producer events replayed from a temporary file once the whole result has been read: a
+    single ("columns", [...]) event with every column, then the batches with their rows padded
+    to it. For CSV exports of MongoDB results, whose header has to name fields that only show
+    up in later documents. Memory stays at one batch.
+    """
+    columns = []
+    with tempfile.TemporaryFile() as spool:
+        for kind, payload in events:
+            if kind == "columns":
+                columns = payload
+            elif payload:
+                pickle.dump(payload, spool, protocol=pickle.HIGHEST_PROTOCOL)
+        spool.seek(0)
+        yield "columns", columns
+        width = len(columns)
+        while True:
+            try:
+                rows = pickle.load(spool)
+            except EOFError:
+                break
+            yield "rows", [tuple(row) + (None,) * (width - len(row)) for row in rows]
+
+def jsonl_export_chunks(events):
+    """Encode stream producer events as JSON Lines, one object per row."""
+    columns = []
+    for kind, payload in events:
+        if kind == "columns":
+            columns = payload
+        elif payload:
+            yield ("\n".join(json.dumps(dict(zip(columns, row)), default=str) for row in payload) + "\n").encode("utf-8")
+
+class ExportSink:
+    """Write-only file object that collects what a writer produced until it is drained."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_export_chunks(events, codec: str):
+    """
+    Encode stream producer events as Parquet, one row group per batch. A Parquet file has one
+    schema, known only once every batch has been seen, so the batches are first spooled to a
+    temporary file as Arrow IPC (ArrowStreamEncoder: types inferred and then widened, MongoDB
+    fields added as they show up) and the file is written from the spool at the end, converted
+    to the final schema. Memory stays at about one batch. Nothing is sent before the result has
+    been read, so a query that fails aborts the download instead of leaving a truncated file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    encoder = ArrowStreamEncoder('none')
+    with tempfile.TemporaryFile() as spool:
+        for kind, payload in events:
+            if kind == "columns":
+                encoder.set_columns(payload)
+            elif payload:
+                spool.write(encoder.add(payload))
+        spool.write(encoder.finish())
+        size = spool.tell()
+        spool.seek(0)
+
+        # Columns that never held a value are written as strings
+        types = [encoder.types.get(column, pa.null()) for column in encoder.columns]
+        schema = pa.schema([pa.field(column, arrow_stream_type(pa.string() if column_type == pa.null() else column_type))
+                            for column, column_type in zip(encoder.columns, types)])
+        sink = ExportSink()
+        source = pa.PythonFile(spool, mode='r')
+        with pq.ParquetWriter(sink, schema, compression=codec) as writer:
+            # One IPC stream per schema change (see ArrowStreamEncoder)
+            while source.tell() < size:
+                for batch in pa.ipc.open_stream(source):
+                    if batch.num_rows:
+                        arrays = [parquet_column(batch, field) for field in schema]
+                        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                        yield sink.drain()
+    yield sink.drain()
+
+def parquet_column(batch, field):
+    """A spooled batch's column converted to its field in the final Parquet schema (NULLs if the batch predates it)."""
+    import pyarrow as pa
+
+    index = batch.schema.get_field_index(field.name)
+    if index < 0:
+        return pa.nulls(batch.num_rows, type=field.type)
+    try:
+        return fit_arrow_array(batch.column(index), field.type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Only a column that turned into strings can fail to cast (binary, durations)
+        return pa.array([None if value is None else str(value) for value in batch.column(index).to_pylist()],
+                        type=pa.string())
+
+def compress_chunks(chunks, compression: Optional[str]):
+    """Compress a byte stream incrementally; memory stays at one chunk whatever the export size."""
+    if compression is None:
+        yield from chunks
+        return
+    if compression == 'zstd':
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stored_result_events(stored: StoredResult, batch_size: int, convert=None):
+    """Producer-style events over a kept result, so it can be exported without re-running the query."""
+    yield "columns", stored.columns
+    for offset in range(0, stored.row_count, batch_size):
+        rows, _ = stored.view(None, {}, [], offset, batch_size)
+        if convert is not None:
+            rows = [tuple(map(convert, row)) for row in rows]
+        yield "rows", rows
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+ARROW_COMPRESSIONS = ('lz4', 'zstd', 'none')
+
+def negotiate_arrow(requested: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """
+    Return the buffer compression to use when the client asked for an Arrow IPC stream, otherwise None.
+    Arrow is requested with format 'arrow' or Accept: application/vnd.apache.arrow.stream, optionally
+    with a codec parameter (application/vnd.apache.arrow.stream; compression=zstd).
+    Without pyarrow an Accept header falls back to JSON, while an explicit format is an error.
+    """
+    media_range = None
+    for part in (accept or "").split(","):
+        if part.split(";")[0].strip().lower() == ARROW_MEDIA_TYPE:
+            media_range = part
+            break
+    if requested != 'arrow' and media_range is None:
+        return None
+    if importlib.util.find_spec("pyarrow") is None:
+        if requested == 'arrow':
+            raise ValueError("Arrow results need pyarrow, which is not installed on the server")
+        return None
+    compression = ARROW_COMPRESSION
+    for parameter in (media_range or "").split(";")[1:]:
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "compression":
+            compression = value.strip().strip('"').lower()
+    if compression not in ARROW_COMPRESSIONS:
+        raise ValueError(f"Unsupported Arrow compression '{compression}'. Use one of: {', '.join(ARROW_COMPRESSIONS)}")
+    return compression
+
+def wider_arrow_type(known, inferred):
+    """A type that holds both a column's values so far and a new batch's (more decimal digits, ints and floats), or None."""
+    import pyarrow as pa
+
+    if pa.types.is_decimal(known) and pa.types.is_decimal(inferred):
+        scale = max(known.scale, inferred.scale)
+        digits = max(known.precision - known.scale, inferred.precision - inferred.scale)
+        return pa.decimal128(digits + scale, scale) if digits + scale <= 38 else None
+    if pa.types.is_integer(known) and pa.types.is_floating(inferred):
+        return pa.float64()
+    return None
+
+def arrow_stream_type(column_type):
+    """
+    The schema type for a column: decimals get all 38 digits of decimal128 at their scale, so
+    values with more digits in later batches don't need a new schema.
+    """
+    import pyarrow as pa
+
+    if pa.types.is_decimal128(column_type):
+        return pa.decimal128(38, column_type.scale)
+    return column_type
+
+def arrow_column(values):
+    """
+    An Arrow array of driver values: inferred as they are where pyarrow maps them to a flat
+    type, otherwise converted with export_value (documents and arrays as JSON text).
+    """
+    import pyarrow as pa
+
+    try:
+        array = pa.array(values)
+        if not pa.types.is_nested(array.type) and not isinstance(array.type, pa.BaseExtensionType):
+            return array
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+        pass
+    return pa.array([export_value(value) for value in values])
+
+def fit_arrow_array(array, field_type):
+    """An array cast to a schema field's type (a wider one, see wider_arrow_type, or strings)."""
+    import pyarrow as pa
+
+    if array.type == field_type:
+        return array
+    if array.type == pa.null():
+        return pa.nulls(len(array), type=field_type)
+    return array.cast(field_type)
+
+class ArrowStreamEncoder:
+    """
+    Encodes stream producer batches as an Arrow IPC stream, one record batch per cursor fetch,
+    without keeping the result: add() returns the bytes to send for each batch.
+    A column's type is inferred from the first batch with a non-NULL value in it (until then it
+    has Arrow's null type). A batch that brings a new column (MongoDB) or values that don't fit
+    their column's type ends the current IPC stream and starts a new one with the updated
+    schema: a wider type where one holds both (a decimal with more digits, an integer column that
+    turns into floats), strings otherwise (mixed-type MongoDB fields). The body is then several
+    IPC streams back to back.
+    """
+
+    def __init__(self, compression: str):
+        import pyarrow as pa
+
+        self.options = pa.ipc.IpcWriteOptions(compression=None if compression == 'none' else compression)
+        self.columns = []
+        self.types = {}
+        self.row_count = 0
+        self.nbytes = 0
+        self.streams = 0
+        self.truncated_by = None
+        self.finished = False
+        self._sink = ExportSink()
+        self._writer = None
+        self._schema = None
+
+    def set_columns(self, columns: List[str]):
+        # Producers only ever extend the column list
+        self.columns = list(columns)
+
+    def add(self, rows: List[tuple]) -> bytes:
+        """Encode a batch of driver rows (positional, as the producers yield them) column by column."""
+        import pyarrow as pa
+
+        arrays = {}
+        changed = self._writer is None
+        for column, values in zip(self.columns, zip(*rows)):
+            array, column_type = self._convert(column, values)
+            arrays[column] = array
+            known = self.types.get(column)
+            if known is None or arrow_stream_type(known) != arrow_stream_type(column_type):
+                changed = True
+            self.types[column] = column_type
+        if changed:
+            self._start()
+        batch = pa.record_batch([fit_arrow_array(arrays[field.name], field.type) for field in self._schema],
+                                schema=self._schema)
+        self._writer.write_batch(batch)
+        self.row_count += len(rows)
+        self.nbytes += batch.nbytes
+        return self._sink.drain()
+
+    def finish(self, truncated_by: Optional[str] = None) -> bytes:
+        """
+        End the stream with an empty record batch whose custom metadata carries rowCount and
+        truncatedBy, which aren't known when the response starts.
+        """
+        import pyarrow as pa
+
+        self.truncated_by = truncated_by
+        if self._writer is None:
+            for column in self.columns:
+                self.types.setdefault(column, pa.null())
+            self._start()
+        empty = pa.record_batch([pa.array([], type=field.type) for field in self._schema], schema=self._schema)
+        self._writer.write_batch(empty, custom_metadata={"rowCount": str(self.row_count),
+                                                         "truncatedBy": truncated_by or ""})
+        self._writer.close()
+        self.finished = True
+        return self._sink.drain()
+
+    def _start(self):
+        import pyarrow as pa
+
+        if self._writer is not None:
+            self._writer.close()
+        self._schema = pa.schema([pa.field(column, arrow_stream_type(self.types[column])) for column in self.columns])
+        self._writer = pa.ipc.new_stream(self._sink, self._schema, options=self.options)
+        self.streams += 1
+
+    def _convert(self, column: str, values):
+        """(array, the column's type once this batch is in), see the class docstring."""
+        import pyarrow as pa
+
+        known = self.types.get(column)
+        if known != pa.string():
+            try:
+                # Infer, then cast: converting with an explicit type would silently truncate floats to ints
+                array = arrow_column(values)
+                if array.type == pa.null():
+                    return array, known or pa.null()
+                if known is None or known == pa.null() or array.type == known:
+                    return array, array.type
+                wider = wider_arrow_type(known, array.type)
+                if wider is not None:
+                    return array, wider
+                return array.cast(arrow_stream_type(known)), known
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+                pass
+        return pa.array([None if value is None else str(export_value(value)) for value in values],
+                        type=pa.string()), pa.string()
+
+def arrow_result_chunks(request: QueryRequest, encoder: ArrowStreamEncoder,
+                        execution: Optional[QueryExecution] = None):
+    """
+    Read a result straight from the server-side cursor and yield its Arrow IPC bytes batch by
+    batch, enforcing ResultLimits like fetch_query_result (the byte cap is measured on the Arrow
+    buffers). The last chunk ends the stream (see ArrowStreamEncoder.finish).
+    """
+    limits = ResultLimits.for_request(request)
+    batch_size = ARROW_BATCH_SIZE
+    if limits.max_rows is not None:
+        # One row past the cap tells a truncated result apart from one that fits exactly
+        batch_size = max(min(batch_size, limits.max_rows + 1), 1)
+    truncated_by = None
+    # Driver values go to pyarrow as they are; arrow_column converts the columns it can't take
+    events = STREAM_PRODUCERS[request.db_type](request, batch_size, execution, convert=None)
+    try:
+        for kind, payload in events:
+            if kind == "columns":
+                encoder.set_columns(payload)
+                continue
+            if limits.max_rows is not None and encoder.row_count + len(payload) > limits.max_rows:
+                payload = payload[:limits.max_rows - encoder.row_count]
+                truncated_by = 'maxRows'
+            if payload:
+                yield encoder.add(payload)
+            if truncated_by is None and limits.max_bytes is not None and encoder.nbytes > limits.max_bytes:
+                truncated_by = 'maxBytes'
+            if truncated_by is not None:
+                break
+    finally:
+        events.close()
+    yield encoder.finish(truncated_by)
+
+def arrow_headers(execution_time: int, query_id: Optional[str] = None, row_count: Optional[int] = None,
+                  truncated_by: Optional[str] = None, cached: Optional[bool] = None) -> Dict[str, str]:
+    """What QueryResponse would carry next to the rows, as headers of an Arrow IPC body."""
+    headers = {"X-Execution-Time": str(execution_time)}
+    if row_count is not None:
+        headers["X-Row-Count"] = str(row_count)
+    if query_id:
+        headers["X-Query-Id"] = query_id
+    if truncated_by:
+        headers["X-Truncated-By"] = truncated_by
+    if cached is not None:
+        headers["X-Cache"] = "HIT" if cached else "MISS"
+    return headers
+
+class DiagnosticSteps(list):
+    """
+    The `steps` list of a connection test. Appending a step publishes the previous one (its
+    status is settled by then) and the new in-progress one; flush() publishes the last step.
+    This lets the same diagnostics code return all steps at once or stream them as they finish.
+    """
+
+    def __init__(self, publish=None):
+        super().__init__()
+        self._publish = publish
+
+    def append(self, step):
+        if self:
+            self._emit(self[-1])
+        super().append(step)
+        self._emit(step)
+
+    def flush(self):
+        if self:
+            self._emit(self[-1])
+
+    def _emit(self, step):
+        if self._publish is not None:
+            self._publish(dict(step))
+
+class ConnectionProbeError(Exception):
+    """The DNS/TCP probe proved the server unreachable before the driver handshake gave up."""
+
+    def __init__(self, probe: Dict[str, Any]):
+        super().__init__(probe["error"])
+        self.probe = probe
+
+# Outer pool runs whole connection tests; probes and handshakes get their own so they can't deadlock it
+diagnostics_executor = ThreadPoolExecutor(max_workers=DIAGNOSTICS_WORKERS, thread_name_prefix="diagnostics")
+probe_executor = ThreadPoolExecutor(max_workers=DIAGNOSTICS_WORKERS * 2, thread_name_prefix="probe")
+
+def probe_tcp(host: str, port: int, timeout: float = CONNECTION_PROBE_TIMEOUT) -> Dict[str, Any]:
+    """Resolve host and open (then close) a TCP connection to it, timing both."""
+    started = time.monotonic()
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        return {"host": host, "port": port, "reachable": False, "stage": "dns",
+                "error": f"Cannot resolve host '{host}': {e.strerror or e}"}
+    resolved = time.monotonic()
+
+    last_error = None
+    for family, socktype, proto, _, address in addresses:
+        try:
+            with socket.socket(family, socktype, proto) as sock:
+                sock.settimeout(timeout)
+                sock.connect(address)
+            return {"host": host, "port": port, "reachable": True, "address": address[0],
+                    "dnsMs": int((resolved - started) * 1000),
+                    "connectMs": int((time.monotonic() - resolved) * 1000)}
+        except OSError as e:
+            last_error = e
+    return {"host": host, "port": port, "reachable": False, "stage": "tcp",
+            "dnsMs": int((resolved - started) * 1000),
+            "error": f"Nothing is accepting connections on {host}:{port} ({last_error or 'no addresses'})"}
+
+def connect_with_probe(connect, discard, targets, step) -> Any:
+    """
+    Run the driver handshake and DNS/TCP probes of targets [(host, port)] concurrently.
+    Returns connect()'s result or raises its error. If every probe fails while the handshake is
+    still waiting, raises ConnectionProbeError right away instead of waiting for the driver
+    timeout; a handshake that succeeds afterwards is passed to discard().
+    The probe results are recorded on the step as "network".
+    """
+    handshake = probe_executor.submit(connect)
+    probes = [probe_executor.submit(probe_tcp, host, port) for host, port in targets]
+    pending = {handshake, *probes}
+    while not handshake.done():
+        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if probes and all(probe.done() for probe in probes) and not handshake.done():
+            results = [probe.result() for probe in probes]
+            if not any(result["reachable"] for result in results):
+                step["network"] = results
+                handshake.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+                raise ConnectionProbeError(results[0])
+    step["network"] = [probe.result() for probe in probes if probe.done()]
+    return handshake.result()
+
+def unreachable_response(steps, e: ConnectionProbeError, server: str) -> "ConnectionResponse":
+    steps[-1]["status"] = "failed"
+    steps[-1]["error"] = str(e)
+    return ConnectionResponse(
+        success=False,
+        message=f"❌ Cannot reach {server}.\n\n{e}\n\n💡 Possible fixes:\n• Check if the server is running\n• Verify the host address and port number\n• Check your firewall settings\n• Ensure network connectivity",
+        steps=steps,
+        error=str(e)
+    )
+
+def _run_diagnostics(diagnose, request, steps: DiagnosticSteps):
+    try:
+        return diagnose(request, steps)
+    finally:
+        steps.flush()
+
+async def run_connection_diagnostics(diagnose, request) -> "ConnectionResponse":
+    """Run a blocking connection test off the event loop and return its full response."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(diagnostics_executor, _run_diagnostics, diagnose, request, DiagnosticSteps())
+
+def stream_connection_diagnostics(diagnose, request) -> StreamingResponse:
+    """
+    Run a connection test off the event loop and stream it as server-sent events:
+    an `event: step` for each step as it starts and again when it settles, then one
+    `event: result` carrying the same ConnectionResponse the non-streaming endpoint returns.
+    """
+    async def events():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        steps = DiagnosticSteps(lambda step: loop.call_soon_threadsafe(queue.put_nowait, step))
+        task = loop.run_in_executor(diagnostics_executor, _run_diagnostics, diagnose, request, steps)
+        # Scheduled after every step published by the worker, so it arrives last
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        while True:
+            step = await queue.get()
+            if step is None:
+                break
+            yield f"event: step\ndata: {json.dumps(step, default=str)}\n\n"
+        try:
+            result = task.result()
+        except Exception as e:
+            result = ConnectionResponse(success=False, message=f"Unexpected error: {str(e)}", steps=list(steps), error=str(e))
+        yield f"event: result\ndata: {json.dumps(result.model_dump(), default=str)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def mongodb_probe_targets(conn_str: str) -> List[tuple]:
+    """(host, port) pairs from a mongodb:// URI; mongodb+srv:// needs an SRV lookup, so it isn't probed."""
+    if not conn_str.startswith("mongodb://"):
+        return []
+    hosts = conn_str[len("mongodb://"):].split("/", 1)[0].split("?", 1)[0]
+    hosts = hosts[hosts.rfind("@") + 1:]
+    targets = []
+    for host in hosts.split(","):
+        if host.startswith("["):  # IPv6 literal
+            address, _, port = host[1:].partition("]")
+            port = port.lstrip(":")
+        else:
+            address, _, port = host.partition(":")
+        if address:
+            targets.append((address, int(port) if port.isdigit() else 27017))
+    return targets
+
+@app.on_event("shutdown")
+async def close_async_drivers():
+    await async_drivers.close_all()
+
+@app.get("/")
+def read_root():
+    return {"message": "Database LLM Connection Service", "status": "running"}
+
+@app.post("/api/test-connection/mysql", response_model=ConnectionResponse)
+async def test_mysql_connection(request: MySQLConnectionRequest):
+    """
+    Test MySQL database connection with provided credentials.
+    Returns success status and detailed steps of the connection process.
+    """
+    return await run_connection_diagnostics(diagnose_mysql_connection, request)
+
+@app.post("/api/test-connection/mysql/stream")
+async def test_mysql_connection_stream(request: MySQLConnectionRequest):
+    """Same as /api/test-connection/mysql, streaming each step over SSE as it finishes."""
+    return stream_connection_diagnostics(diagnose_mysql_connection, request)
+
+def diagnose_mysql_connection(request: MySQLConnectionRequest, steps: DiagnosticSteps) -> ConnectionResponse:
+    """Blocking MySQL connection test; runs on diagnostics_executor and reports progress through steps."""
+    try:
+        # Step 1: Validate credentials format
+        steps.append({
+            "id": 1,
+            "label": "Validating credentials format",
+            "status": "in_progress",
+            "timestamp": time.time()
+        })
+        
+        # Basic validation
+        if not request.host or not request.user or not request.database:
+            steps[-1]["status"] = "failed"
+            steps[-1]["error"] = "Missing required credentials"
+            return ConnectionResponse(
+                success=False,
+                message="Invalid credentials format",
+                steps=steps,
+                error="Missing required credentials"
+            )
+        
+        steps[-1]["status"] = "completed"
+        
+        # Step 2: Establishing connection
+        steps.append({
+            "id": 2,
+            "label": "Establishing connection",
+            "status": "in_progress",
+            "timestamp": time.time()
+        })
+        
+        try:
+            import pymysql
+            
+            # Attempt to connect to MySQL (without selecting database first),
+            # probing DNS/TCP reachability of the server at the same time
+            connection = connect_with_probe(
+                lambda: pymysql.connect(
+                    host=request.host,
+                    port=request.port,
+                    user=request.user,
+                    password=request.password,
+                    connect_timeout=10,
+                    read_timeout=10,
+                    write_timeout=10
+                ),
+                lambda late_connection: late_connection.close(),
+                [(request.host, request.port)],
+                steps[-1]
+            )
+            
+            steps[-1]["status"] = "completed"
+            
+        except ConnectionProbeError as e:
+            return unreachable_response(steps, e, f"MySQL server at '{request.host}:{request.port}'")
+        except ImportError:
+            steps[-1]["status"] = "failed"
+            steps[-1]["error"] = "PyMySQL not installed"
+            return ConnectionResponse(
+                success=False,
+                message="PyMySQL driver not found. Please install: pip install pymysql",
+                steps=steps,
+                error="PyMySQL not installed"
+            )
+        except pymysql.err.OperationalError as e:
+            steps[-1]["status"] = "failed"
+            error_msg = str(e)
+            steps[-1]["error"] = "Connection failed"
+            
+            # Provide detailed, user-friendly error messages
+            if "Can't connect" in error_msg or "Unknown MySQL server host" in error_msg:
+                message = f"❌ Cannot reach MySQL server at '{request.host}:{request.port}'.\n\n💡 Possible fixes:\n• Check if MySQL server is running\n• Verify the host address and port number\n• Check your firewall settings\n• Ensure network connectivity"
+            elif "Access denied" in error_msg:
+                message = f"❌ Authentication failed for user '{request.user}'.\n\n💡 Possible fixes:\n• Verify your username is correct\n• Check your password\n• Ensure the user has access from your IP\n• Try: GRANT ALL ON {request.database}.* TO '{request.user}'@'%';"
+            elif "cryptography" in error_msg.lower() or "caching_sha2_password" in error_msg.lower() or "sha256_password" in error_msg.lower():
+                # MySQL 8.0+ uses caching_sha2_password by default which requires cryptography package
+                message = f"❌ MySQL Authentication Error (caching_sha2_password).\n\n💡 This is likely due to:\n• Incorrect password for user '{request.user}'\n• MySQL 8.0+ authentication method issue\n\n🔧 Solutions:\n1. Verify your password is correct\n2. Install cryptography: pip install cryptography\n3. Or change MySQL auth method:\n   ALTER USER '{request.user}'@'%' IDENTIFIED WITH mysql_native_password BY 'your_password';"
+                steps[-1]["error"] = "Authentication failed - MySQL 8.0+ requires correct password or cryptography package"
+            else:
+                message = f"❌ Connection failed: {error_msg}\n\n💡 Check your connection details and try again."
+            
+            return ConnectionResponse(
+                success=False,
+                message=message,
+                steps=steps,
+                error=steps[-1]["error"]
+            )
+        except Exception as e:
+            steps[-1]["status"] = "failed"
+            error_msg = str(e)
+            
+            # Check if it's a cryptography-related error
+            if "cryptography" in error_msg.lower() or "sha256_password" in error_msg.lower() or "caching_sha2_password" in error_msg.lower():
+                steps[-1]["error"] = "Authentication error - cryptography package needed"
+                return ConnectionResponse(
+                    success=False,
+                    message=f"❌ MySQL Authentication Error.\n\n💡 MySQL 8.0+ uses advanced authentication which requires:\n1. Correct password for user '{request.user}'\n2. Python cryptography package: pip install cryptography\n\n🔧 Alternative solution:\nChange user authentication method:\nALTER USER '{request.user}'@'%' IDENTIFIED WITH mysql_native_password BY 'your_password';",
+                    steps=steps,
+                    error="Authentication failed"
+                )
+            
+            steps[-1]["error"] = error_msg
+            return ConnectionResponse(
+                success=False,
+                message=f"❌ Unexpected error: {error_msg}",
+                steps=steps,
+                error=error_msg
             )
         
         # Step 3: Authenticating user
@@ -400,8 +3937,15 @@ async def test_postgresql_connection(request: MySQLConnectionRequest):
     Test PostgreSQL database connection with provided credentials.
     Returns success status and detailed steps of the connection process.
     """
-    steps = []
-    
+    return await run_connection_diagnostics(diagnose_postgresql_connection, request)
+
+@app.post("/api/test-connection/postgresql/stream")
+async def test_postgresql_connection_stream(request: MySQLConnectionRequest):
+    """Same as /api/test-connection/postgresql, streaming each step over SSE as it finishes."""
+    return stream_connection_diagnostics(diagnose_postgresql_connection, request)
+
+def diagnose_postgresql_connection(request: MySQLConnectionRequest, steps: DiagnosticSteps) -> ConnectionResponse:
+    """Blocking PostgreSQL connection test; runs on diagnostics_executor and reports progress through steps."""
     try:
         # Step 1: Validate credentials format
         steps.append({
@@ -422,7 +3966,6 @@ async def test_postgresql_connection(request: MySQLConnectionRequest):
                 error="Missing required credentials"
             )
         
-        time.sleep(0.3)  # Simulate processing
         steps[-1]["status"] = "completed"
         
         # Step 2: Establishing connection
@@ -439,17 +3982,24 @@ async def test_postgresql_connection(request: MySQLConnectionRequest):
             # Attempt to connect to PostgreSQL
             # Postgres requires a database to connect to, usually 'postgres' is the default maintenance db
             # But we can try connecting directly to the requested database
-            connection = psycopg2.connect(
-                host=request.host,
-                port=request.port,
-                user=request.user,
-                password=request.password,
-                dbname=request.database,
-                connect_timeout=10
+            connection = connect_with_probe(
+                lambda: psycopg2.connect(
+                    host=request.host,
+                    port=request.port,
+                    user=request.user,
+                    password=request.password,
+                    dbname=request.database,
+                    connect_timeout=10
+                ),
+                lambda late_connection: late_connection.close(),
+                [(request.host, request.port)],
+                steps[-1]
             )
             
             steps[-1]["status"] = "completed"
             
+        except ConnectionProbeError as e:
+            return unreachable_response(steps, e, f"PostgreSQL server at '{request.host}:{request.port}'")
         except ImportError:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = "psycopg2 not installed"
@@ -581,596 +4131,2181 @@ async def test_postgresql_connection(request: MySQLConnectionRequest):
         cursor.close()
         connection.close()
         
-        return ConnectionResponse(
-            success=True,
-            message=f"Successfully connected to PostgreSQL database '{request.database}'",
-            steps=steps
-        )
+        return ConnectionResponse(
+            success=True,
+            message=f"Successfully connected to PostgreSQL database '{request.database}'",
+            steps=steps
+        )
+        
+    except Exception as e:
+        # Catch any unexpected errors
+        return ConnectionResponse(
+            success=False,
+            message=f"Unexpected error: {str(e)}",
+            steps=steps,
+            error=str(e)
+        )
+
+def overloaded_response(e: ExecutorSaturatedError) -> JSONResponse:
+    """429 with Retry-After, shaped like a failed QueryResponse so the UI shows the message."""
+    return JSONResponse(
+        status_code=429,
+        content={"success": False, "error": str(e)},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+async def cancel_on_disconnect(http_request: Request, execution: QueryExecution, awaitable):
+    """Await the query, cancelling it server-side if the client goes away first."""
+    async def watch():
+        while True:
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+            if await http_request.is_disconnected():
+                await asyncio.to_thread(execution.cancel)
+                return
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await awaitable
+    finally:
+        watcher.cancel()
+
+@app.post("/api/execute-query", response_model=QueryResponse)
+async def execute_query(request: QueryRequest, http_request: Request, accept: Optional[str] = Header(None)):
+    """
+    Execute a SQL query on the connected database.
+    Returns query results with columns, rows, and execution time.
+    Compact 'arrays' / 'columnar' encodings can be requested with the 'format' field
+    or the Accept header (see negotiate_result_format), and a typed Arrow IPC stream
+    with format 'arrow' or Accept: application/vnd.apache.arrow.stream (see negotiate_arrow).
+    The query runs under a query ID and is cancelled server-side if the client disconnects.
+    """
+    start_time = time.time()
+    
+    try:
+        # Validate query (empty queries, non-SELECT statements, missing connection string)
+        validation_error = validate_query_request(request)
+        if validation_error:
+            return QueryResponse(
+                success=False,
+                error=validation_error
+            )
+        
+        try:
+            arrow_compression = negotiate_arrow(request.format, accept)
+            result_format = 'arrow' if arrow_compression else negotiate_result_format(request.format, accept)
+        except ValueError as e:
+            return QueryResponse(
+                success=False,
+                error=str(e)
+            )
+        
+        if request.db_type not in QUERY_FETCHERS:
+            return QueryResponse(
+                success=False,
+                error=f"Unsupported database type: {request.db_type}"
+            )
+        
+        # "Run Top N" becomes part of the statement, so the database only produces N rows
+        request = apply_row_limit(request)
+        
+        if request.targets:
+            if arrow_compression:
+                return QueryResponse(
+                    success=False,
+                    error="Arrow results aren't available for fan-out queries"
+                )
+            return await execute_fanout(request, http_request, result_format, start_time)
+        
+        if arrow_compression:
+            return await execute_query_arrow(request, http_request, arrow_compression, start_time)
         
+        try:
+            if request.parallelScan:
+                return await execute_parallel_scan(request, http_request, result_format, start_time)
+            return await run_query_request(request, result_format, start_time, http_request)
+        except ExecutorSaturatedError as e:
+            return overloaded_response(e)
+            
     except Exception as e:
-        # Catch any unexpected errors
-        return ConnectionResponse(
+        return QueryResponse(
+            success=False,
+            error=f"Unexpected error: {str(e)}"
+        )
+
+async def run_query_request(request: QueryRequest, result_format: str, start_time: float,
+                            http_request: Optional[Request] = None, session=None) -> QueryResponse:
+    """
+    Run a validated, row-limited query - from the result cache, or under a query ID on the
+    backend's executor - and build its QueryResponse. Shared by /api/execute-query and
+    /api/execute-batch. With http_request the query is cancelled if that client disconnects;
+    with session it runs on that connection (see BatchSession) and skips the result cache,
+    since its result may depend on earlier statements. Raises ExecutorSaturatedError.
+    """
+    # Serve repeated queries from the result cache
+    cache_key = None if request.bypassCache or session is not None else result_cache_key(request, result_format)
+    if cache_key is not None and not request.refreshCache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return QueryResponse(
+                success=True,
+                rowCount=cached["rowCount"],
+                executionTime=int((time.time() - start_time) * 1000),
+                cached=True,
+                truncated=cached["truncatedBy"] is not None,
+                truncatedBy=cached["truncatedBy"],
+                resultId=await store_result(cached["encoded"])
+                if request.keepResult and cached["rowCount"] >= RESULT_STORE_MIN_ROWS else None,
+                **cached["encoded"]
+            )
+    
+    # Every execution is registered under a query ID so it can be cancelled
+    try:
+        execution = running_queries.start(request)
+    except ValueError as e:
+        return QueryResponse(
             success=False,
-            message=f"Unexpected error: {str(e)}",
-            steps=steps,
             error=str(e)
         )
+    
+    # Run blocking DB operations on the backend's bounded executor to avoid blocking the event loop
+    def run_query():
+        columns, rows, truncated_by = fetch_query_result(request, execution, session)
+        return len(rows), encode_result(columns, rows, result_format), truncated_by
+    
+    async def run():
+        if session is not None or not async_engine_enabled(request.db_type):
+            return await backend_executors[request.db_type].run(run_query)
+        # Native asyncio driver: no worker thread is held while the query is in flight
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(async_fetch_query_result(request))
+        try:
+            with execution.cancellable(lambda: loop.call_soon_threadsafe(task.cancel)):
+                columns, rows, truncated_by = await task
+        except asyncio.CancelledError:
+            if execution.cancelled:
+                raise QueryCancelledError()
+            raise
+        return len(rows), encode_result(columns, rows, result_format), truncated_by
+    
+    try:
+        if http_request is not None:
+            row_count, encoded, truncated_by = await cancel_on_disconnect(http_request, execution, run())
+        else:
+            row_count, encoded, truncated_by = await run()
+    except ExecutorSaturatedError:
+        raise
+    except QueryCancelledError as e:
+        return QueryResponse(
+            success=False,
+            error=str(e),
+            queryId=execution.query_id,
+            cancelled=True
+        )
+    except Exception as e:
+        return QueryResponse(
+            success=False,
+            error=describe_query_error(e),
+            queryId=execution.query_id
+        )
+    finally:
+        running_queries.finish(execution)
+    
+    execution_time = int((time.time() - start_time) * 1000)
+    
+    if cache_key is not None:
+        result_cache.put(
+            cache_key,
+            {"rowCount": row_count, "encoded": encoded, "truncatedBy": truncated_by},
+            estimate_result_size(encoded),
+            result_cache_ttl(request, execution_time)
+        )
+    
+    return QueryResponse(
+        success=True,
+        rowCount=row_count,
+        executionTime=execution_time,
+        cached=False if cache_key is not None else None,
+        queryId=execution.query_id,
+        truncated=truncated_by is not None,
+        truncatedBy=truncated_by,
+        resultId=await store_result(encoded) if request.keepResult and row_count >= RESULT_STORE_MIN_ROWS else None,
+        **encoded
+    )
 
-@app.post("/api/execute-query", response_model=QueryResponse)
-async def execute_query(request: QueryRequest):
+async def execute_query_arrow(request: QueryRequest, http_request: Request, compression: str, start_time: float):
     """
-    Execute a SQL query on the connected database.
-    Returns query results with columns, rows, and execution time.
+    The Arrow branch of /api/execute-query: record batches are built directly from cursor
+    fetches with native column types, and sent as a compressed IPC stream. A result that fits in
+    one batch is answered in full, with its row count in headers; a larger one is streamed batch
+    by batch as it is read. Errors before the first batch are still reported as a JSON QueryResponse.
     """
-    start_time = time.time()
+    cache_key = None if request.bypassCache else result_cache_key(request, f"arrow:{compression}")
+    if cache_key is not None and not request.refreshCache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            headers = arrow_headers(int((time.time() - start_time) * 1000), row_count=cached["rowCount"],
+                                    truncated_by=cached["truncatedBy"], cached=True)
+            return Response(content=cached["arrow"], media_type=ARROW_MEDIA_TYPE, headers=headers)
+    
+    try:
+        execution = running_queries.start(request)
+    except ValueError as e:
+        return QueryResponse(
+            success=False,
+            error=str(e)
+        )
+    
+    executor = backend_executors[request.db_type]
+    encoder = ArrowStreamEncoder(compression)
+    chunks = arrow_result_chunks(request, encoder, execution)
+    
+    def read_head():
+        # The first batch and whatever follows it: the end of the stream for a one-batch result
+        return list(itertools.islice(chunks, 2))
     
+    loop = asyncio.get_running_loop()
     try:
-        # Validate query
-        if not request.query or not request.query.strip():
+        head = await cancel_on_disconnect(http_request, execution, executor.run(read_head))
+    except Exception as e:
+        running_queries.finish(execution)
+        loop.run_in_executor(None, chunks.close)
+        if isinstance(e, ExecutorSaturatedError):
+            return overloaded_response(e)
+        if isinstance(e, QueryCancelledError):
             return QueryResponse(
                 success=False,
-                error="Query cannot be empty"
+                error=str(e),
+                queryId=execution.query_id,
+                cancelled=True
             )
-        
-        # Check for dangerous operations
-        query_upper = request.query.strip().upper()
-        dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE']
-        if any(keyword in query_upper.split()[0] for keyword in dangerous_keywords):
-            return QueryResponse(
-                success=False,
-                error=f"Only SELECT queries are allowed for safety"
+        return QueryResponse(
+            success=False,
+            error=describe_query_error(e),
+            queryId=execution.query_id
+        )
+    
+    execution_time = int((time.time() - start_time) * 1000)
+    
+    if encoder.finished:
+        running_queries.finish(execution)
+        payload = b"".join(head)
+        if cache_key is not None:
+            result_cache.put(
+                cache_key,
+                {"rowCount": encoder.row_count, "arrow": payload, "truncatedBy": encoder.truncated_by},
+                len(payload),
+                result_cache_ttl(request, execution_time)
             )
-        
-        if request.db_type == 'mysql':
+        headers = arrow_headers(execution_time, execution.query_id, encoder.row_count, encoder.truncated_by,
+                                cached=False if cache_key is not None else None)
+        return Response(content=payload, media_type=ARROW_MEDIA_TYPE, headers=headers)
+    
+    def remaining():
+        try:
+            yield from head
+            yield from chunks
+        finally:
+            chunks.close()
+    
+    async def body():
+        # Kept for the result cache until it outgrows it
+        kept = [] if cache_key is not None else None
+        size = 0
+        completed = False
+        try:
+            async for chunk in iterate_in_thread(remaining(), executor):
+                yield chunk
+                if kept is not None:
+                    size += len(chunk)
+                    if size <= result_cache.max_bytes:
+                        kept.append(chunk)
+                    else:
+                        kept = None
+            completed = True
+        finally:
+            running_queries.finish(execution)
+            if not completed:
+                # Client went away (or the read failed mid-stream): stop the statement
+                loop.run_in_executor(None, execution.cancel)
+        if kept is not None:
+            result_cache.put(
+                cache_key,
+                {"rowCount": encoder.row_count, "arrow": b"".join(kept), "truncatedBy": encoder.truncated_by},
+                size,
+                result_cache_ttl(request, int((time.time() - start_time) * 1000))
+            )
+    
+    # Row count and truncation come at the end of the stream (see ArrowStreamEncoder.finish)
+    return StreamingResponse(body(), media_type=ARROW_MEDIA_TYPE, headers=arrow_headers(
+        execution_time, execution.query_id, cached=False if cache_key is not None else None))
+
+FANOUT_MERGES = ('concatenate', 'union', 'aggregate')
+def sum_partials(a, b):
+    if not isinstance(a, numbers.Number) or not isinstance(b, numbers.Number):
+        raise TypeError(f"can't add {type(a).__name__} and {type(b).__name__} values")
+    return a + b
+
+FANOUT_AGGREGATES = {
+    # How per-target partial values combine; a count is merged by adding the partial counts
+    'sum': sum_partials,
+    'count': sum_partials,
+    'min': min,
+    'max': max
+}
+
+def sql_select_aggregates(query: str, dialect: str) -> Optional[List[Optional[str]]]:
+    """
+    The aggregate of each item of a SELECT list: 'SUM', 'COUNT', 'AVG', ... for an item that is a
+    single aggregate call (aliased or not), 'COUNT DISTINCT' and the like for a DISTINCT argument,
+    'expression' for any other item that calls an aggregate and None for one that doesn't.
+    None if the statement isn't a single SELECT with a list of its own (UNION, *, SELECT DISTINCT).
+    """
+    tokens = [token for token in tokenize_sql(query, dialect) if token[0] not in ('space', 'comment')]
+    words = [text.upper() if kind == 'word' else None for kind, text in tokens]
+    if not tokens or words[0] != 'SELECT':
+        return None
+    end = len(tokens)
+    depth = 0
+    for position, (_, text) in enumerate(tokens):
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif depth == 0 and words[position] in ('UNION', 'INTERSECT', 'EXCEPT'):
+            return None
+        elif depth == 0 and words[position] == 'FROM' and end == len(tokens):
+            end = position
+    start = 2 if words[1:2] == ['ALL'] else 1
+    if words[start:start + 1] == ['DISTINCT']:
+        return None
+
+    # Items of the list, each as its positions and the depth of parentheses at each one
+    items = [[]]
+    depth = 0
+    for position in range(start, end):
+        text = tokens[position][1]
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        if depth == 0 and text == ',':
+            items.append([])
+        elif depth > 0 or text != ';':
+            items[-1].append((position, depth))
+
+    functions = []
+    for item in items:
+        if not item or tokens[item[-1][0]][1] == '*':
+            return None
+        positions = [position for position, _ in item]
+        if not any(words[p] in SQL_AGGREGATE_FUNCTIONS and tokens[p + 1][1] == '(' for p in positions[:-1]):
+            functions.append(None)
+            continue
+        first = positions[0]
+        # Whatever follows the call's closing parenthesis (the first one back at depth 0)
+        close = next((index for index, (_, level) in enumerate(item) if index > 0 and level == 0), len(item))
+        alias = positions[close + 1:]
+        single = words[first] in SQL_AGGREGATE_FUNCTIONS and tokens[first + 1][1] == '(' and (
+            not alias or (len(alias) == 2 and words[alias[0]] == 'AS')
+            or (len(alias) == 1 and tokens[alias[0]][0] in ('word', 'quoted')))
+        if not single:
+            functions.append('expression')
+        elif words[first + 2] == 'DISTINCT':
+            functions.append(f"{words[first]} DISTINCT")
+        else:
+            functions.append(words[first])
+    return functions
+
+def infer_fanout_aggregates(request: QueryRequest, columns: List[str], group_by: List[str]) -> Dict[str, str]:
+    """
+    The 'aggregate' merge's aggregates when the request doesn't list them, read from the SQL
+    select list: every column not grouped on has to be a plain SUM, COUNT, MIN or MAX. Raises
+    ValueError for anything else (AVG, COUNT(DISTINCT ...), expressions, MongoDB pipelines),
+    whose per-target values can't be combined by re-applying the function.
+    """
+    functions = sql_select_aggregates(request.query, request.db_type) if request.db_type != 'mongodb' else None
+    if functions is None or len(functions) != len(columns):
+        raise ValueError("list how to merge every column that isn't in groupBy in aggregates")
+    aggregates = {}
+    for column, function in zip(columns, functions):
+        if column in group_by:
+            continue
+        if function == 'AVG':
+            raise ValueError(f"{column} is an average, which can't be merged from per-target averages; "
+                             f"select the sum and the count instead")
+        if function is None or function.lower() not in FANOUT_AGGREGATES:
+            raise ValueError(f"{column} ({function or 'not an aggregate'}) can't be merged across targets; "
+                             f"group by it or list it in aggregates")
+        aggregates[column] = function.lower()
+    return aggregates
+
+def fanout_target_requests(request: QueryRequest) -> List[tuple]:
+    """(name, QueryRequest) per target: the request with the target's connection fields swapped in."""
+    targets = []
+    names = set()
+    for index, target in enumerate(request.targets):
+        fields = {key: value for key, value in target.model_dump().items() if key != 'name' and value is not None}
+        target_request = request.model_copy(update={
+            **fields, "targets": None, "queryId": None, "keepResult": False
+        })
+        name = target.name or (f"{target_request.host}/{target_request.database}" if target_request.host
+                               else target_request.database)
+        if name in names:
+            name = f"{name}#{index + 1}"
+        names.add(name)
+        targets.append((name, target_request))
+    return targets
+
+def merge_fanout_results(results: List[tuple], merge: str, group_by: Optional[List[str]],
+                         aggregates: Optional[Dict[str, str]]) -> tuple:
+    """
+    Merge (name, columns, rows) per successful target into one (columns, rows).
+    - 'concatenate': every target's rows, tagged with the target in a leading _source column
+    - 'union': distinct rows, _source listing every target that returned the row
+    - 'aggregate': one row per groupBy key, with the aggregates re-applied to the partial values
+      (columns not listed are left out); raises ValueError if a target lacks one of those columns
+    Targets returning different columns are aligned by name; missing values are NULL.
+    """
+    columns = []
+    for _, target_columns, _ in results:
+        columns.extend(column for column in target_columns if column not in columns)
+
+    if merge == 'aggregate':
+        group_by = group_by or []
+        aggregates = aggregates or {}
+        merged_columns = group_by + [column for column in aggregates if column not in group_by]
+        groups = OrderedDict()
+        for name, target_columns, rows in results:
+            positions = {column: i for i, column in enumerate(target_columns)}
+            missing = [column for column in merged_columns if column not in positions]
+            if missing:
+                raise ValueError(f"Target '{name}' has no column {', '.join(missing)} to merge")
+            for row in rows:
+                key = tuple(json_safe_value(row[positions[column]]) for column in group_by)
+                merged = groups.get(key)
+                if merged is None:
+                    groups[key] = [row[positions[column]] for column in merged_columns]
+                    continue
+                for i in range(len(group_by), len(merged_columns)):
+                    value = row[positions[merged_columns[i]]]
+                    if value is not None:
+                        merged[i] = value if merged[i] is None else FANOUT_AGGREGATES[aggregates[merged_columns[i]]](merged[i], value)
+        return merged_columns, [tuple(row) for row in groups.values()]
+
+    source = "_source"
+    while source in columns:
+        source = "_" + source
+    merged_rows = []
+    distinct = OrderedDict()  # 'union': row values -> (names of the targets that returned it, row)
+    for name, target_columns, rows in results:
+        positions = [target_columns.index(column) if column in target_columns else None for column in columns]
+        for row in rows:
+            values = tuple(None if i is None else row[i] for i in positions)
+            if merge == 'concatenate':
+                merged_rows.append((name,) + values)
+                continue
+            names, _ = distinct.setdefault(tuple(map(json_safe_value, values)), ([], values))
+            if name not in names:
+                names.append(name)
+    if merge == 'union':
+        merged_rows = [(", ".join(names),) + values for names, values in distinct.values()]
+    return [source] + columns, merged_rows
+
+async def execute_fanout(request: QueryRequest, http_request: Request, result_format: str, start_time: float):
+    """
+    The fan-out branch of /api/execute-query: run one query on every target (at most
+    QP_FANOUT_PARALLELISM at a time), merge the results (see merge_fanout_results) and report
+    each target's outcome in targetResults. A failing target doesn't fail the run; the rest is
+    merged without it. The query ID covers all targets, so cancelling it stops every one.
+    Fan-out results aren't cached, and the row cap applies per target and to the merged result.
+    """
+    merge = request.merge or 'concatenate'
+    if merge not in FANOUT_MERGES:
+        return QueryResponse(success=False, error=f"Unsupported merge '{merge}'. Use one of: {', '.join(FANOUT_MERGES)}")
+    unsupported = sorted(set((request.aggregates or {}).values()) - set(FANOUT_AGGREGATES))
+    if unsupported:
+        return QueryResponse(
+            success=False,
+            error=f"Can't merge {', '.join(unsupported)} across targets. Use one of: {', '.join(FANOUT_AGGREGATES)} "
+                  f"(for an average, select the sum and the count)"
+        )
+    if len(request.targets) > FANOUT_MAX_TARGETS:
+        return QueryResponse(success=False, error=f"A fan-out query can target at most {FANOUT_MAX_TARGETS} connections")
+    targets = fanout_target_requests(request)
+
+    try:
+        execution = running_queries.start(request)
+    except ValueError as e:
+        return QueryResponse(success=False, error=str(e))
+
+    # Each target runs under its own (unregistered) execution; cancelling the query cancels them all
+    children = [QueryExecution(f"{execution.query_id}:{index}", request.db_type, request.query)
+                for index in range(len(targets))]
+    slots = asyncio.Semaphore(max(FANOUT_PARALLELISM, 1))
+
+    async def run_target(index: int):
+        name, target_request = targets[index]
+        target_start = time.time()
+        outcome = {"target": name}
+        async with slots:
+            validation_error = validate_query_request(target_request)
             try:
-                import pymysql
-                
-                # Run blocking DB operations in a thread pool to avoid blocking the event loop
-                def execute_mysql_query():
-                    connection = pymysql.connect(
-                        host=request.host,
-                        port=request.port,
-                        user=request.user,
-                        password=request.password,
-                        database=request.database,
-                        connect_timeout=10,
-                        read_timeout=30,
-                        write_timeout=30,
-                        cursorclass=pymysql.cursors.DictCursor
-                    )
-                    
-                    cursor = connection.cursor()
-                    cursor.execute(request.query)
-                    rows = cursor.fetchall()
-                    
-                    # Get column names
-                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                    
-                    # Convert rows to list of dicts with string keys
-                    formatted_rows = []
-                    for row in rows:
-                        formatted_row = {}
-                        for key, value in row.items():
-                            # Convert any non-serializable types to strings
-                            if value is None:
-                                formatted_row[key] = None
-                            elif isinstance(value, (int, float, str, bool)):
-                                formatted_row[key] = value
-                            else:
-                                formatted_row[key] = str(value)
-                        formatted_rows.append(formatted_row)
-                    
-                    cursor.close()
-                    connection.close()
-                    
-                    return columns, formatted_rows
-                
-                # Run the blocking function in a thread pool
-                columns, formatted_rows = await asyncio.to_thread(execute_mysql_query)
-                
-                execution_time = int((time.time() - start_time) * 1000)
-                
-                return QueryResponse(
-                    success=True,
-                    columns=columns,
-                    rows=formatted_rows,
-                    rowCount=len(formatted_rows),
-                    executionTime=execution_time
-                )
-                
-            except ImportError:
-                return QueryResponse(
-                    success=False,
-                    error="PyMySQL not installed"
-                )
-            except pymysql.err.Error as e:
-                return QueryResponse(
-                    success=False,
-                    error=f"MySQL Error: {str(e)}"
-                )
-                
-        elif request.db_type == 'postgresql':
+                if validation_error:
+                    raise ValueError(validation_error)
+                columns, rows, truncated_by = await backend_executors[request.db_type].run(
+                    fetch_query_result, target_request, children[index])
+            except Exception as e:
+                outcome.update(success=False, error=str(e) if isinstance(e, (ValueError, QueryCancelledError,
+                                                                             ExecutorSaturatedError))
+                               else describe_query_error(e))
+                return outcome, None
+        outcome.update(success=True, rowCount=len(rows), executionTime=int((time.time() - target_start) * 1000))
+        if truncated_by:
+            outcome["truncatedBy"] = truncated_by
+        return outcome, (name, columns, rows)
+
+    def cancel_targets():
+        for child in children:
+            child.cancel()
+
+    try:
+        with execution.cancellable(cancel_targets):
+            finished = await cancel_on_disconnect(
+                http_request, execution, asyncio.gather(*(run_target(index) for index in range(len(targets)))))
+    except QueryCancelledError as e:
+        return QueryResponse(success=False, error=str(e), queryId=execution.query_id, cancelled=True)
+    finally:
+        running_queries.finish(execution)
+
+    target_results = [outcome for outcome, _ in finished]
+    results = [result for _, result in finished if result is not None]
+    if execution.cancelled:
+        return QueryResponse(success=False, error=str(QueryCancelledError()), queryId=execution.query_id,
+                             cancelled=True, targetResults=target_results)
+    if not results:
+        return QueryResponse(success=False, error="The query failed on every target", queryId=execution.query_id,
+                             targetResults=target_results)
+
+    try:
+        aggregates = request.aggregates
+        if merge == 'aggregate' and aggregates is None:
+            aggregates = infer_fanout_aggregates(request, results[0][1], request.groupBy or [])
+        columns, rows = await asyncio.to_thread(merge_fanout_results, results, merge, request.groupBy, aggregates)
+    except (ValueError, TypeError) as e:
+        return QueryResponse(success=False, error=f"Could not merge results: {e}", queryId=execution.query_id,
+                             targetResults=target_results)
+    truncated_by = next((outcome["truncatedBy"] for outcome in target_results if outcome.get("truncatedBy")), None)
+    max_rows = ResultLimits.for_request(request).max_rows
+    if max_rows is not None and len(rows) > max_rows:
+        rows = rows[:max_rows]
+        truncated_by = 'maxRows'
+    encoded = encode_result(columns, rows, result_format)
+
+    return QueryResponse(
+        success=True,
+        rowCount=len(rows),
+        executionTime=int((time.time() - start_time) * 1000),
+        queryId=execution.query_id,
+        truncated=truncated_by is not None,
+        truncatedBy=truncated_by,
+        targetResults=target_results,
+        resultId=await store_result(encoded) if request.keepResult and len(rows) >= RESULT_STORE_MIN_ROWS else None,
+        **encoded
+    )
+
+PARALLEL_SCAN_AGGREGATES = ('COUNT', 'SUM', 'MIN', 'MAX', 'AVG')
+# Aggregate functions whose partial results can't be combined; a query using them runs serially
+SQL_AGGREGATE_FUNCTIONS = PARALLEL_SCAN_AGGREGATES + (
+    'GROUP_CONCAT', 'STRING_AGG', 'ARRAY_AGG', 'JSON_AGG', 'JSONB_AGG', 'JSON_OBJECT_AGG', 'JSONB_OBJECT_AGG',
+    'JSON_ARRAYAGG', 'JSON_OBJECTAGG', 'STD', 'STDDEV', 'STDDEV_POP', 'STDDEV_SAMP', 'VARIANCE', 'VAR_POP',
+    'VAR_SAMP', 'BIT_AND', 'BIT_OR', 'BIT_XOR', 'BOOL_AND', 'BOOL_OR', 'EVERY', 'PERCENTILE_CONT',
+    'PERCENTILE_DISC', 'MODE')
+# Top-level words that make a SELECT more than a single-table scan or aggregate
+PARALLEL_SCAN_UNSUPPORTED = ('DISTINCT', 'HAVING', 'UNION', 'INTERSECT', 'EXCEPT', 'WINDOW', 'INTO', 'FOR',
+                             'LOCK', 'OFFSET', 'FETCH', 'JOIN', 'OVER', 'ROLLUP', 'CUBE', 'GROUPING', 'PROCEDURE')
+PARALLEL_SCAN_CLAUSES = ('FROM', 'WHERE', 'GROUP', 'ORDER', 'LIMIT')
+# Column types (see result_columns) that Python orders like the database does; strings follow
+# the column's collation, so MIN/MAX and ORDER BY on them aren't merged in Python
+MERGE_COMPARABLE_TYPES = ('integer', 'float', 'decimal', 'boolean', 'date', 'datetime', 'time', 'interval')
+PARTITIONABLE_TYPE_PATTERN = re.compile(
+    r"^((tiny|small|medium|big)?int(eger)?|numeric|decimal|real|double|float|date(time)?|timestamp)\b")
+
+MYSQL_PRIMARY_KEY_SQL = """
+    SELECT k.COLUMN_NAME, c.DATA_TYPE
+    FROM information_schema.KEY_COLUMN_USAGE k
+    JOIN information_schema.COLUMNS c
+      ON c.TABLE_SCHEMA = k.TABLE_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME
+    WHERE k.CONSTRAINT_NAME = 'PRIMARY' AND k.TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND k.TABLE_NAME = %s
+    ORDER BY k.ORDINAL_POSITION
+"""
+
+POSTGRESQL_PRIMARY_KEY_SQL = """
+    SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+    WHERE i.indrelid = %s::regclass AND i.indisprimary
+    ORDER BY array_position(i.indkey::int2[], a.attnum)
+"""
+
+class ParallelScanPlan:
+    """
+    A single-table SELECT taken apart so it can run as key-range partitions (parallelScan).
+    Plain scans are run as they are on every range and concatenated; GROUP BY queries and
+    aggregates (COUNT, SUM, MIN, MAX, AVG - which is run as SUM and COUNT) are re-aggregated
+    across partitions. ORDER BY and LIMIT are applied again to the merged rows; check_comparable
+    says whether the result's column types allow that.
+    Raises ValueError, with the reason, for statements that can't be split this way
+    (joins, subqueries in FROM, DISTINCT, HAVING, window functions, OFFSET, ...).
+    """
+
+    def __init__(self, query: str, dialect: str):
+        self.dialect = dialect
+        self._tokens = tokenize_sql(query, dialect)
+        self._sig = [i for i, (kind, _) in enumerate(self._tokens) if kind not in ('space', 'comment')]
+        while self._sig and self._tokens[self._sig[-1]][1] == ';':
+            self._sig.pop()
+        if not self._sig or self._word(0) != 'SELECT':
+            raise ValueError("only SELECT statements can be split")
+
+        # Positions (into the significant tokens) of the top-level clauses
+        clauses = {}
+        depth = 0
+        for position in range(len(self._sig)):
+            kind, text = self._token(position)
+            if kind == 'symbol' and text == '(':
+                depth += 1
+            elif kind == 'symbol' and text == ')':
+                depth -= 1
+            elif kind == 'word' and depth == 0:
+                word = text.upper()
+                if word in PARALLEL_SCAN_UNSUPPORTED or (word == 'SELECT' and position > 0):
+                    raise ValueError(f"{word} can't be split into partitions")
+                if word in PARALLEL_SCAN_CLAUSES:
+                    if word in clauses:
+                        raise ValueError(f"more than one {word} clause")
+                    clauses[word] = position
+        if 'FROM' not in clauses:
+            raise ValueError("there is no table to split")
+        starts = [clauses[word] for word in PARALLEL_SCAN_CLAUSES if word in clauses]
+        if starts != sorted(starts):
+            raise ValueError("unexpected clause order")
+        self._clauses = clauses
+
+        def clause(word, keyword_length=1):
+            if word not in clauses:
+                return None
+            start = clauses[word] + keyword_length
+            end = min([p for p in starts if p > clauses[word]], default=len(self._sig))
+            return list(range(start, end))
+
+        self.from_positions = clause('FROM')
+        self._check_table_reference(self.from_positions)
+        self.where_positions = clause('WHERE')
+        group = clause('GROUP', 2)
+        order = clause('ORDER', 2)
+        limit = clause('LIMIT')
+        for word, positions in (('GROUP', group), ('ORDER', order)):
+            if positions is not None and self._word(clauses[word] + 1) != 'BY':
+                raise ValueError(f"{word} without BY")
+
+        self.limit = None
+        if limit is not None:
+            if len(limit) != 1 or (self._token(limit[0])[0] != 'number' and self._word(limit[0]) != 'ALL'):
+                raise ValueError("only LIMIT n (without an offset) can be re-applied after merging")
+            if self._word(limit[0]) != 'ALL':
+                self.limit = int(self._token(limit[0])[1])
+
+        self.items = [self._select_item(item) for item in self._split(list(range(1, clauses['FROM'])))]
+        self.group_by = [self._group_item(item) for item in self._split(group)] if group else []
+        if len(set(self.group_by)) != len(self.group_by):
+            raise ValueError("a column is grouped twice")
+        self.aggregated = bool(self.group_by) or any(item["function"] for item in self.items)
+        if self.aggregated:
+            self._check_grouping()
+        self.order_by = [self._order_item(item) for item in self._split(order)] if order else []
+
+    # -- token helpers; positions index the significant tokens
+
+    def _token(self, position: int) -> tuple:
+        return self._tokens[self._sig[position]]
+
+    def _word(self, position: int) -> Optional[str]:
+        kind, text = self._token(position)
+        return text.upper() if kind == 'word' else None
+
+    def _text(self, positions) -> str:
+        """Original text of a run of positions, including the whitespace and comments inside it."""
+        if not positions:
+            return ""
+        return "".join(text for _, text in self._tokens[self._sig[positions[0]]:self._sig[positions[-1]] + 1])
+
+    def _normalized(self, positions) -> str:
+        """Comparable form of an expression; a qualified column (t.col) compares as the bare column."""
+        if self._is_name(positions):
+            positions = positions[-1:]
+        return " ".join(text.upper() if kind == 'word' else text for kind, text in map(self._token, positions))
+
+    def _split(self, positions) -> List[list]:
+        """Split positions on top-level commas."""
+        parts = [[]]
+        depth = 0
+        for position in positions:
+            text = self._token(position)[1]
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+            if depth == 0 and text == ',':
+                parts.append([])
+            else:
+                parts[-1].append(position)
+        if any(not part for part in parts):
+            raise ValueError("empty list item")
+        return parts
+
+    def _is_name(self, positions) -> bool:
+        """A plain (possibly qualified) name: name [. name ...]"""
+        return len(positions) % 2 == 1 and all(
+            self._token(p)[0] in ('word', 'quoted') if i % 2 == 0 else self._token(p)[1] == '.'
+            for i, p in enumerate(positions))
+
+    def _closing(self, position: int) -> Optional[int]:
+        """Position of the parenthesis closing the one at position."""
+        depth = 0
+        for current in range(position, len(self._sig)):
+            text = self._token(current)[1]
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+                if depth == 0:
+                    return current
+        return None
+
+    # -- clauses
+
+    def _check_table_reference(self, positions):
+        if not positions:
+            raise ValueError("there is no table to split")
+        if self._is_name(positions):
+            return
+        # table [AS] alias
+        if len(positions) >= 2 and self._token(positions[-1])[0] in ('word', 'quoted'):
+            table = positions[:-2] if self._word(positions[-2]) == 'AS' else positions[:-1]
+            if self._is_name(table):
+                return
+        raise ValueError("only a single table can be split (no joins or subqueries in FROM)")
+
+    def _select_item(self, item) -> Dict[str, Any]:
+        expression, alias = item, None
+        if len(item) >= 3 and self._word(item[-2]) == 'AS':
+            expression, alias = item[:-2], item[-1]
+        elif len(item) >= 2 and self._token(item[-1])[0] in ('word', 'quoted') and (
+                self._token(item[-2])[1] == ')' or self._is_name(item[:-1])):
+            expression, alias = item[:-1], item[-1]
+        function = None
+        if (len(expression) >= 4 and self._word(expression[0]) in PARALLEL_SCAN_AGGREGATES
+                and self._token(expression[1])[1] == '(' and self._closing(expression[1]) == expression[-1]):
+            function = self._word(expression[0])
+            if self._word(expression[2]) == 'DISTINCT':
+                raise ValueError(f"{function}(DISTINCT ...) can't be merged across partitions")
+            if len(self._split(expression[2:-1])) != 1:
+                raise ValueError(f"{function} with more than one argument")
+        inner = expression[2:-1] if function else expression
+        for index, position in enumerate(inner[:-1]):
+            if self._word(position) in SQL_AGGREGATE_FUNCTIONS and self._token(inner[index + 1])[1] == '(':
+                raise ValueError(f"{self._word(position)}(...) can only be merged as a select item of its own")
+        return {
+            "positions": item,
+            "expression": expression,
+            "function": function,
+            "argument": self._text(expression[2:-1]) if function else None,
+            "alias": sql_identifier(*self._token(alias), self.dialect) if alias is not None else None,
+            "star": self._token(expression[-1])[1] == '*' and not function
+        }
+
+    def _group_item(self, positions) -> int:
+        """Index of the select item a GROUP BY entry refers to (by position, alias or expression)."""
+        index = self._select_reference(positions)
+        if index is None or self.items[index]["function"] is not None:
+            raise ValueError("every GROUP BY column has to be selected to merge partitions")
+        return index
+
+    def _select_reference(self, positions) -> Optional[int]:
+        if len(positions) == 1 and self._token(positions[0])[0] == 'number':
+            index = int(self._token(positions[0])[1]) - 1
+            return index if 0 <= index < len(self.items) else None
+        if len(positions) == 1 and self._token(positions[0])[0] in ('word', 'quoted'):
+            name = sql_identifier(*self._token(positions[0]), self.dialect)
+            for index, item in enumerate(self.items):
+                if item["alias"] == name:
+                    return index
+        normalized = self._normalized(positions)
+        for index, item in enumerate(self.items):
+            if self._normalized(item["expression"]) == normalized:
+                return index
+        return None
+
+    def _check_grouping(self):
+        for index, item in enumerate(self.items):
+            if item["star"]:
+                raise ValueError("* can't be selected with aggregates")
+            if item["function"] is None and index not in self.group_by:
+                raise ValueError("every selected column has to be aggregated or grouped")
+
+    def _order_item(self, positions) -> tuple:
+        """((kind, reference), descending, nulls_first) with kind 'index' (select item) or 'name' (result column)."""
+        nulls_first = None
+        if len(positions) >= 3 and self._word(positions[-2]) == 'NULLS' and self._word(positions[-1]) in ('FIRST', 'LAST'):
+            nulls_first = self._word(positions[-1]) == 'FIRST'
+            positions = positions[:-2]
+        descending = False
+        if positions and self._word(positions[-1]) in ('ASC', 'DESC'):
+            descending = self._word(positions[-1]) == 'DESC'
+            positions = positions[:-1]
+        if not positions:
+            raise ValueError("empty ORDER BY item")
+        # Select items are result columns one to one, unless a * expands to several
+        stars = any(item["star"] for item in self.items)
+        index = self._select_reference(positions)
+        if index is not None and not stars:
+            reference = ('position', index)
+        elif index is not None and self.items[index]["alias"] is not None:
+            reference = ('name', self.items[index]["alias"])
+        elif self._is_name(positions) and self._token(positions[0])[0] != 'number' and (stars or index is not None):
+            reference = ('name', sql_identifier(*self._token(positions[-1]), self.dialect))
+        else:
+            raise ValueError("ORDER BY has to use selected columns to be re-applied after merging")
+        if nulls_first is None:
+            # The database's default: MySQL sorts NULLs first, PostgreSQL last (in ascending order)
+            nulls_first = descending if self.dialect == 'postgresql' else not descending
+        return reference, descending, nulls_first
+
+    # -- SQL generation
+
+    @property
+    def table(self) -> str:
+        """The table reference as written, without its alias."""
+        positions = self.from_positions
+        while not self._is_name(positions):
+            positions = positions[:-1]
+        return self._text(positions)
+
+    def table_parts(self) -> List[str]:
+        """The table reference's (schema, table) names, unquoted."""
+        positions = self.from_positions
+        while not self._is_name(positions):
+            positions = positions[:-1]
+        return [sql_identifier(*self._token(p), self.dialect) if self._token(p)[0] == 'quoted' else self._token(p)[1]
+                for p in positions[::2]]
+
+    def _where(self, condition: Optional[str]) -> str:
+        conditions = [f"({self._text(self.where_positions)})"] if self.where_positions else []
+        if condition:
+            conditions.append(f"({condition})")
+        return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    def bounds_sql(self, column: str) -> str:
+        quoted = quote_identifier(column, self.dialect)
+        return f"SELECT MIN({quoted}), MAX({quoted}) FROM {self._text(self.from_positions)}{self._where(None)}"
+
+    def partition_sql(self, condition: str) -> str:
+        """The statement restricted to one key range; aggregates leave ORDER BY and LIMIT for the merge."""
+        from_text = self._text(self.from_positions)
+        if not self.aggregated:
+            tail_start = min((self._clauses[word] for word in ('ORDER', 'LIMIT') if word in self._clauses), default=None)
+            tail = f" {self._text(list(range(tail_start, len(self._sig))))}" if tail_start is not None else ""
+            select_list = self._text(list(range(1, self._clauses['FROM'])))
+            return f"SELECT {select_list} FROM {from_text}{self._where(condition)}{tail}"
+        columns = []
+        for index, item in enumerate(self.items):
+            if item["function"] == 'AVG':
+                columns.append(f"SUM({item['argument']}) AS qp_avg_sum_{index}")
+                columns.append(f"COUNT({item['argument']}) AS qp_avg_count_{index}")
+            else:
+                columns.append(self._text(item["positions"]))
+        group = ", ".join(self._text(self.items[index]["expression"]) for index in self.group_by)
+        return (f"SELECT {', '.join(columns)} FROM {from_text}{self._where(condition)}"
+                + (f" GROUP BY {group}" if group else ""))
+
+    # -- merging
+
+    def check_comparable(self, columns: List[str]):
+        """
+        Raise ValueError unless the merge can compare what it has to: MIN/MAX and ORDER BY need
+        numeric or temporal columns, since Python orders strings by code point and not by the
+        column's collation, and on MySQL (whose default collations ignore case and trailing
+        spaces) so do GROUP BY columns. columns are a partition's ResultColumns; an ambiguous
+        type (None, e.g. MySQL VARCHAR) counts as a string.
+        """
+        types = getattr(columns, "types", None) or [None] * len(columns)
+        if not self.aggregated:
+            merged, merged_types = columns, types
+        else:
+            layout = self._layout()
+            merged = self._merged_columns(columns, layout)
+            merged_types = ['float' if item["function"] == 'AVG' else types[positions[0]]
+                            for item, positions in zip(self.items, layout)]
+            for index, item in enumerate(self.items):
+                compared = item["function"] in ('MIN', 'MAX') or (index in self.group_by and self.dialect == 'mysql')
+                if compared and merged_types[index] not in MERGE_COMPARABLE_TYPES:
+                    raise ValueError(f"{merged[index]} isn't numeric or temporal, so partitions can't be merged "
+                                     f"in the database's collation order")
+        for index, _, _ in self._sort_keys(merged):
+            if merged_types[index] not in MERGE_COMPARABLE_TYPES:
+                raise ValueError(f"ORDER BY {merged[index]} isn't numeric or temporal, so partitions can't be "
+                                 f"merged in the database's collation order")
+
+    def merge(self, results: List[tuple]) -> tuple:
+        """(columns, rows) of every partition, in key order, into the statement's (columns, rows)."""
+        if not self.aggregated:
+            columns = results[0][0] if results else []
+            rows = [row for _, partition_rows in results for row in partition_rows]
+        else:
+            columns, rows = self._reaggregate(results)
+        if self.order_by:
+            rows = self._sort(columns, rows)
+        if self.limit is not None:
+            rows = rows[:self.limit]
+        return columns, rows
+
+    def _layout(self) -> List[list]:
+        """Where each select item's partial value(s) sit in a partition row of an aggregate."""
+        layout = []
+        offset = 0
+        for item in self.items:
+            width = 2 if item["function"] == 'AVG' else 1
+            layout.append(list(range(offset, offset + width)))
+            offset += width
+        return layout
+
+    def _merged_columns(self, partition_columns: List[str], layout: List[list]) -> List[str]:
+        columns = []
+        for item, positions in zip(self.items, layout):
+            if item["function"] == 'AVG':
+                default = self._text(item["expression"]) if self.dialect == 'mysql' else 'avg'
+                columns.append(item["alias"] or default)
+            else:
+                columns.append(partition_columns[positions[0]] if partition_columns else item["alias"])
+        return columns
+
+    def _reaggregate(self, results: List[tuple]) -> tuple:
+        layout = self._layout()
+        columns = self._merged_columns(results[0][0] if results else [], layout)
+
+        groups = OrderedDict()
+        for _, rows in results:
+            for row in rows:
+                key = tuple(row[layout[index][0]] for index in self.group_by)
+                merged = groups.get(key)
+                if merged is None:
+                    groups[key] = [[row[p] for p in positions] for positions in layout]
+                    continue
+                for item, positions, values in zip(self.items, layout, merged):
+                    function = item["function"]
+                    if function is None:
+                        continue
+                    for i, p in enumerate(positions):
+                        value = row[p]
+                        if value is None:
+                            continue
+                        if values[i] is None:
+                            values[i] = value
+                        elif function == 'MIN':
+                            values[i] = min(values[i], value)
+                        elif function == 'MAX':
+                            values[i] = max(values[i], value)
+                        else:
+                            values[i] = values[i] + value
+
+        rows = []
+        for merged in groups.values():
+            row = []
+            for item, values in zip(self.items, merged):
+                if item["function"] == 'AVG':
+                    total, count = values
+                    row.append(total / count if count else None)
+                else:
+                    row.append(values[0])
+            rows.append(tuple(row))
+        if not self.group_by and not rows:
+            # An aggregate without GROUP BY always returns one row, even for an empty table
+            rows.append(tuple(0 if item["function"] == 'COUNT' else None for item in self.items))
+        return columns, rows
+
+    def _sort_keys(self, columns: List[str]) -> List[tuple]:
+        """(column index, descending, nulls_first) of each ORDER BY item."""
+        keys = []
+        for (kind, reference), descending, nulls_first in self.order_by:
+            if kind == 'position':
+                index = reference
+            else:
+                matches = [i for i, column in enumerate(columns) if column == reference] or \
+                          [i for i, column in enumerate(columns) if column.lower() == reference.lower()]
+                index = matches[0] if matches else None
+            if index is None or not 0 <= index < len(columns):
+                raise ValueError("an ORDER BY column is not in the result")
+            keys.append((index, descending, nulls_first))
+        return keys
+
+    def _sort(self, columns: List[str], rows: list) -> list:
+        # Stable sorts from the last key to the first give the combined order
+        for index, descending, nulls_first in reversed(self._sort_keys(columns)):
+            present = [row for row in rows if row[index] is not None]
+            missing = [row for row in rows if row[index] is None]
+            present.sort(key=lambda row: row[index], reverse=descending)
+            rows = missing + present if nulls_first else present + missing
+        return rows
+
+def partition_literal(value) -> str:
+    """A bound as SQL: numbers as they are, dates and timestamps as quoted literals."""
+    if isinstance(value, datetime.datetime):
+        return f"'{value.isoformat(sep=' ')}'"
+    if isinstance(value, datetime.date):
+        return f"'{value.isoformat()}'"
+    return str(value)
+
+def partition_boundaries(low, high, count: int) -> list:
+    """Up to count - 1 increasing split points that divide [low, high] into even ranges."""
+    if isinstance(low, bool) or type(low) is not type(high):
+        raise ValueError("the partition column has to be numeric, a date or a timestamp")
+    if isinstance(low, int):
+        points = [low + (high - low) * i // count for i in range(1, count)]
+    elif isinstance(low, (float, decimal.Decimal)):
+        points = [low + (high - low) * i / count for i in range(1, count)]
+    elif isinstance(low, datetime.datetime):
+        points = [low + (high - low) * i / count for i in range(1, count)]
+    elif isinstance(low, datetime.date):
+        points = [low + datetime.timedelta(days=(high - low).days * i // count) for i in range(1, count)]
+    else:
+        raise ValueError("the partition column has to be numeric, a date or a timestamp")
+    boundaries = []
+    for point in points:
+        if point > low and (not boundaries or point > boundaries[-1]):
+            boundaries.append(point)
+    return boundaries
+
+def partition_conditions(column: str, dialect: str, boundaries: list) -> List[str]:
+    """One range condition per partition; NULL keys go to the first so no row is lost."""
+    quoted = quote_identifier(column, dialect)
+    edges = [None] + boundaries + [None]
+    conditions = []
+    for low, high in zip(edges, edges[1:]):
+        parts = []
+        if low is not None:
+            parts.append(f"{quoted} >= {partition_literal(low)}")
+        if high is not None:
+            parts.append(f"{quoted} < {partition_literal(high)}")
+        condition = " AND ".join(parts)
+        conditions.append(f"{condition} OR {quoted} IS NULL" if low is None else condition)
+    return conditions
+
+class ParallelScanCoordinator:
+    """
+    The connection that plans a parallel scan: it picks the partition column (by default the
+    table's primary key), reads its bounds and the result's column types (from the statement
+    run on no rows). On PostgreSQL it also exports its snapshot and
+    keeps its transaction open until the partitions are done, so they all see the same data.
+    """
+
+    def __init__(self, request: QueryRequest, plan: ParallelScanPlan):
+        self.pool = get_connection_pool(request.db_type, request.host, request.port, request.user,
+                                        request.password, request.database)
+        self.connection = self.pool.acquire()
+        self.snapshot = None
+        try:
+            cursor = self.connection.cursor()
+            try:
+                if request.db_type == 'postgresql':
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cursor.execute("SELECT pg_export_snapshot()")
+                    self.snapshot = cursor.fetchone()[0]
+                self.column = request.partitionColumn or self._primary_key(cursor, request.db_type, plan)
+                cursor.execute(plan.bounds_sql(self.column))
+                self.low, self.high = cursor.fetchone()
+                # The result's column types, for ParallelScanPlan.check_comparable
+                cursor.execute(plan.partition_sql("1 = 0"))
+                cursor.fetchall()
+                self.result_columns = result_columns(cursor.description, request.db_type)
+            finally:
+                cursor.close()
+        except BaseException:
+            self.pool.release(self.connection)
+            raise
+        if self.snapshot is None:
+            # Nothing to share on MySQL: the connection can go straight back
+            self.close()
+
+    @staticmethod
+    def _primary_key(cursor, db_type: str, plan: ParallelScanPlan) -> str:
+        if db_type == 'postgresql':
+            cursor.execute(POSTGRESQL_PRIMARY_KEY_SQL, (plan.table,))
+        else:
+            parts = plan.table_parts()
+            cursor.execute(MYSQL_PRIMARY_KEY_SQL, (parts[-2] if len(parts) > 1 else None, parts[-1]))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError("the table has no primary key; set partitionColumn")
+        if not PARTITIONABLE_TYPE_PATTERN.match(str(row[1]).lower()):
+            raise ValueError(f"the primary key {row[0]} isn't numeric or a date; set partitionColumn")
+        return row[0]
+
+    def close(self):
+        if self.connection is not None:
+            # The rollback on release ends the snapshot's transaction
+            self.pool.release(self.connection)
+            self.connection = None
+
+def fetch_scan_partition(request: QueryRequest, execution: QueryExecution, snapshot: Optional[str]):
+    """fetch_query_result for one partition, inside the coordinator's snapshot when there is one."""
+    if snapshot is None:
+        return fetch_query_result(request, execution)
+    with pooled_connection('postgresql', request.host, request.port, request.user,
+                           request.password, request.database) as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        finally:
+            cursor.close()
+        return fetch_query_result(request, execution, connection)
+
+async def execute_parallel_scan(request: QueryRequest, http_request: Request, result_format: str, start_time: float):
+    """
+    The parallelScan branch of /api/execute-query: split a single-table SELECT into key ranges
+    of the partition column, run them concurrently on pooled connections (in one exported
+    snapshot on PostgreSQL) and merge them (see ParallelScanPlan). Statements that can't be
+    split run as usual; 'partitioning' in the response says which happened, and why.
+    Raises ExecutorSaturatedError.
+    """
+    async def serial(reason: str) -> QueryResponse:
+        response = await run_query_request(request, result_format, start_time, http_request)
+        response.partitioning = {"partitions": 1, "fallback": reason}
+        return response
+
+    if request.db_type not in ('mysql', 'postgresql'):
+        return await serial("parallel scans are only available for MySQL and PostgreSQL")
+    try:
+        plan = ParallelScanPlan(request.query, request.db_type)
+    except ValueError as e:
+        return await serial(str(e))
+
+    executor = backend_executors[request.db_type]
+    count = max(2, min(request.partitions or PARALLEL_SCAN_PARTITIONS, POOL_MAX_SIZE - 1))
+    try:
+        coordinator = await executor.run(ParallelScanCoordinator, request, plan)
+    except ExecutorSaturatedError:
+        raise
+    except ValueError as e:
+        return await serial(str(e))
+    except Exception as e:
+        return QueryResponse(success=False, error=describe_query_error(e))
+
+    try:
+        try:
+            plan.check_comparable(coordinator.result_columns)
+            if coordinator.low is None:
+                raise ValueError("no rows to split")
+            boundaries = partition_boundaries(coordinator.low, coordinator.high, count)
+            if not boundaries:
+                raise ValueError("too few distinct key values to split")
+        except (ValueError, TypeError) as e:
+            await asyncio.to_thread(coordinator.close)
+            return await serial(str(e))
+        conditions = partition_conditions(coordinator.column, request.db_type, boundaries)
+
+        try:
+            execution = running_queries.start(request)
+        except ValueError as e:
+            return QueryResponse(success=False, error=str(e))
+        # Each partition runs under its own (unregistered) execution; cancelling the query cancels them all
+        children = [QueryExecution(f"{execution.query_id}:{index}", request.db_type, request.query)
+                    for index in range(len(conditions))]
+
+        def cancel_partitions():
+            for child in children:
+                child.cancel()
+
+        async def run_partition(index: int):
+            partition_request = request.model_copy(update={"query": plan.partition_sql(conditions[index])})
+            return await executor.run(fetch_scan_partition, partition_request, children[index], coordinator.snapshot,
+                                      force=True)
+
+        try:
+            with execution.cancellable(cancel_partitions):
+                finished = await cancel_on_disconnect(
+                    http_request, execution,
+                    asyncio.gather(*(run_partition(index) for index in range(len(conditions)))))
+        except QueryCancelledError as e:
+            return QueryResponse(success=False, error=str(e), queryId=execution.query_id, cancelled=True)
+        except Exception as e:
+            # One failed partition fails the query; stop the others rather than wait for them
+            cancel_partitions()
+            return QueryResponse(success=False, error=describe_query_error(e), queryId=execution.query_id)
+        finally:
+            running_queries.finish(execution)
+    finally:
+        await asyncio.to_thread(coordinator.close)
+
+    truncated_by = next((truncated for _, _, truncated in finished if truncated), None)
+    try:
+        columns, rows = await asyncio.to_thread(plan.merge, [(columns, rows) for columns, rows, _ in finished])
+    except (ValueError, TypeError) as e:
+        return await serial(f"could not merge partitions: {e}")
+    max_rows = ResultLimits.for_request(request).max_rows
+    if max_rows is not None and len(rows) > max_rows:
+        rows = rows[:max_rows]
+        truncated_by = 'maxRows'
+    encoded = encode_result(columns, rows, result_format)
+
+    return QueryResponse(
+        success=True,
+        rowCount=len(rows),
+        executionTime=int((time.time() - start_time) * 1000),
+        queryId=execution.query_id,
+        truncated=truncated_by is not None,
+        truncatedBy=truncated_by,
+        partitioning={"column": coordinator.column, "partitions": len(conditions),
+                      "snapshot": coordinator.snapshot is not None},
+        resultId=await store_result(encoded) if request.keepResult and len(rows) >= RESULT_STORE_MIN_ROWS else None,
+        **encoded
+    )
+
+@app.post("/api/execute-query/stream")
+async def execute_query_stream(request: QueryRequest):
+    """
+    Execute a query and stream the results as NDJSON instead of one large JSON body.
+    Every line is an event: {"type": "columns"}, {"type": "rows"} (repeated), and finally
+    {"type": "end"} with rowCount/executionTime, or {"type": "error"}.
+    Rows come from server-side cursors in batches, so memory use stays flat and the
+    first rows arrive without waiting for the whole result.
+    If the client disconnects before the end, the query is cancelled server-side.
+    """
+    start_time = time.time()
+    request = apply_row_limit(request)
+    batch_size = max(request.batchSize or STREAM_BATCH_SIZE, 1)
+
+    def events():
+        validation_error = validate_query_request(request)
+        if validation_error:
+            yield {"type": "error", "error": validation_error}
+            return
+        producer = STREAM_PRODUCERS.get(request.db_type)
+        if producer is None:
+            yield {"type": "error", "error": f"Unsupported database type: {request.db_type}"}
+            return
+
+        columns = []
+        row_count = 0
+        try:
+            for kind, payload in producer(request, batch_size, execution):
+                if kind == "columns":
+                    columns = payload
+                else:
+                    row_count += len(payload)
+                    payload = [dict(zip(columns, row)) for row in payload]
+                yield {"type": kind, kind: payload}
+        except Exception as e:
+            if execution.cancelled:
+                yield {"type": "error", "error": str(QueryCancelledError()), "cancelled": True}
+            else:
+                yield {"type": "error", "error": describe_query_error(e)}
+            return
+
+        yield {
+            "type": "end",
+            "rowCount": row_count,
+            "executionTime": int((time.time() - start_time) * 1000)
+        }
+
+    def ndjson_lines():
+        for event in events():
+            yield json.dumps(event, default=str) + "\n"
+
+    # Admission is decided once, before the response starts; the stream's batches then run unchecked
+    executor = backend_executors.get(request.db_type)
+    if executor is not None:
+        try:
+            executor.check_capacity()
+        except ExecutorSaturatedError as e:
+            return overloaded_response(e)
+
+    try:
+        execution = running_queries.start(request)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    async def body():
+        completed = False
+        try:
+            async for line in iterate_in_thread(ndjson_lines(), executor):
+                yield line
+            completed = True
+        finally:
+            running_queries.finish(execution)
+            if not completed:
+                # The client went away mid-stream: stop the statement instead of letting it run on
+                asyncio.get_running_loop().run_in_executor(None, execution.cancel)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.post("/api/execute-query/page", response_model=QueryResponse)
+async def execute_query_page(request: QueryRequest, http_request: Request, accept: Optional[str] = Header(None)):
+    """
+    Execute a query one page at a time. The first call (no pageToken) returns the first page,
+    a resultId and a nextPageToken; pass the token back, with the same query, for each next page.
+    - With orderKey (MySQL/PostgreSQL): keyset pagination - each page is a fresh
+      WHERE (orderKey) > (last key) ORDER BY orderKey LIMIT query, so no state is held
+    - Otherwise: the server-side cursor stays open between pages (see PageCursorRegistry);
+      pages must be read in order
+    The total row count runs concurrently and is returned as totalCount once known, or via
+    GET /api/results/{resultId}/count.
+    """
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+
+    validation_error = validate_query_request(request)
+    if validation_error:
+        return QueryResponse(success=False, error=validation_error)
+    try:
+        result_format = negotiate_result_format(request.format, accept)
+    except ValueError as e:
+        return QueryResponse(success=False, error=str(e))
+    if request.db_type not in QUERY_FETCHERS:
+        return QueryResponse(success=False, error=f"Unsupported database type: {request.db_type}")
+
+    digest = page_query_digest(request)
+    try:
+        state = decode_page_token(request.pageToken, digest) if request.pageToken else None
+    except ValueError as e:
+        return QueryResponse(success=False, error=str(e))
+    result_id = state["r"] if state else uuid.uuid4().hex
+    served = state["n"] if state else 0
+    page_size = tighter_limit(max(request.pageSize or PAGE_SIZE, 1), MAX_RESULT_ROWS)
+    keyset = bool(request.orderKey) and request.db_type in ('mysql', 'postgresql')
+    executor = backend_executors[request.db_type]
+
+    for expired in page_cursors.sweep():
+        loop.run_in_executor(None, expired.close)
+
+    try:
+        if state is None:
+            # Count concurrently with the first page; rowLimit is pushed down so the count honours it.
+            # The count is cancellable as query '<resultId>:count'.
+            executor.check_capacity()
+            count_request = apply_row_limit(request).model_copy(update={"queryId": f"{result_id}:count"})
+            count_execution = running_queries.start(count_request)
+            row_counts.start(result_id, executor.run(count_query_rows, count_request, count_execution, force=True),
+                             count_execution)
+
+        if keyset:
+            limit = page_size if not request.rowLimit else min(page_size, request.rowLimit - served)
+            if limit <= 0:
+                columns, rows, more, last_key = [], [], False, None
+            else:
+                try:
+                    execution = running_queries.start(request)
+                except ValueError as e:
+                    return QueryResponse(success=False, error=str(e))
+                try:
+                    columns, rows, more, last_key = await cancel_on_disconnect(
+                        http_request, execution,
+                        executor.run(fetch_keyset_page, request, state["a"] if state else None, limit, execution))
+                finally:
+                    running_queries.finish(execution)
+            if request.rowLimit and served + len(rows) >= request.rowLimit:
+                more = False
+            next_state = {"m": "keyset", "a": last_key} if more else None
+        else:
+            if state is None:
+                try:
+                    cursor, evicted = page_cursors.open(result_id, apply_row_limit(request), page_size)
+                except ValueError as e:
+                    return QueryResponse(success=False, error=str(e))
+                for victim in evicted:
+                    loop.run_in_executor(None, victim.close)
+            else:
+                cursor = page_cursors.get(result_id)
+                if cursor is None or cursor.closed:
+                    return QueryResponse(success=False, error="Page token has expired; run the query again")
+                if cursor.served != served:
+                    return QueryResponse(success=False, error="Page token was already used; pages of a held cursor must be read in order")
+            try:
+                columns, rows, exhausted = await executor.run(cursor.read_page)
+            except ExecutorSaturatedError:
+                # Nothing was read; a cursor that never ran isn't worth holding on to
+                if state is None:
+                    page_cursors.remove(result_id)
+                    loop.run_in_executor(None, cursor.close)
+                raise
+            except Exception:
+                # read_page already closed the cursor
+                page_cursors.remove(result_id)
+                raise
+            if exhausted:
+                page_cursors.remove(result_id)
+                row_counts.resolve(result_id, served + len(rows))
+            next_state = None if exhausted else {"m": "cursor"}
+    except ExecutorSaturatedError as e:
+        return overloaded_response(e)
+    except QueryCancelledError as e:
+        return QueryResponse(success=False, error=str(e), cancelled=True, resultId=result_id)
+    except Exception as e:
+        return QueryResponse(success=False, error=describe_query_error(e), resultId=result_id)
+
+    if next_state is not None:
+        next_state.update({"q": digest, "r": result_id, "n": served + len(rows)})
+    return QueryResponse(
+        success=True,
+        rowCount=len(rows),
+        executionTime=int((time.time() - start_time) * 1000),
+        resultId=result_id,
+        nextPageToken=encode_page_token(next_state) if next_state is not None else None,
+        totalCount=row_counts.total(result_id),
+        **encode_result(columns, rows, result_format)
+    )
+
+class BatchStatement(BaseModel):
+    query: str
+    id: Optional[str] = None  # Echoed back with the statement's result (e.g. a notebook cell ID)
+    queryId: Optional[str] = None  # For /api/queries/{id}/cancel (generated if omitted)
+    group: Optional[str] = None  # Statements sharing a group run in order on one session
+
+class BatchRequest(BaseModel):
+    statements: List[BatchStatement]
+    host: Optional[str] = None
+    port: Optional[int] = None
+    database: str
+    user: Optional[str] = None
+    password: Optional[str] = None
+    db_type: str  # 'mysql', 'postgresql', or 'mongodb'
+    connectionString: Optional[str] = None  # For MongoDB
+    username: Optional[str] = None  # For MongoDB (alternative to 'user')
+    sequential: bool = False  # Run every statement in order on one session
+    # Applied to every statement, as in QueryRequest
+    format: Optional[str] = None
+    bypassCache: bool = False
+    refreshCache: bool = False
+    timeoutMs: Optional[int] = None
+    maxRows: Optional[int] = None
+    maxBytes: Optional[int] = None
+    rowLimit: Optional[int] = None
+    keepResult: bool = False
+
+SESSION_GROUP = "session"  # Implicit group of the statements that depend on session state
+
+def plan_batch(batch: BatchRequest) -> List[tuple]:
+    """
+    Split a batch into units of work, (group, [statement indexes]) in the order they were listed.
+    Independent statements are units of their own (group None) and run in parallel. Statements
+    sharing a group run in order on one session: explicit groups, and for SQL the implicit
+    'session' group of statements that touch session state or a temp table created before them
+    (see sql_session_state).
+    """
+    if batch.sequential:
+        return [(SESSION_GROUP, list(range(len(batch.statements))))]
+    units = []
+    groups = {}
+    session_tables = set()
+    for index, statement in enumerate(batch.statements):
+        group = statement.group
+        if group is None and batch.db_type in ('mysql', 'postgresql'):
+            stateful, created = sql_session_state(statement.query, batch.db_type, session_tables)
+            if stateful:
+                group = SESSION_GROUP
+                session_tables.update(created)
+        if group is None:
+            units.append((None, [index]))
+        elif group in groups:
+            groups[group].append(index)
+        else:
+            groups[group] = [index]
+            units.append((group, groups[group]))
+    return units
+
+class BatchSession:
+    """
+    A SQL connection checked out for one sequential group of /api/execute-batch, so temp tables,
+    variables and settings carry over between its statements. It is discarded afterwards rather
+    than returned to the pool, so that state never reaches other queries.
+    """
+
+    def __init__(self, batch: BatchRequest):
+        self.pool = get_connection_pool(batch.db_type, batch.host, batch.port, batch.user,
+                                        batch.password, batch.database)
+        self.connection = self.pool.acquire()
+
+    def close(self):
+        self.pool.discard(self.connection)
+
+def batch_statement_request(batch: BatchRequest, statement: BatchStatement) -> QueryRequest:
+    return QueryRequest(
+        query=statement.query, queryId=statement.queryId,
+        host=batch.host, port=batch.port, database=batch.database, user=batch.user, password=batch.password,
+        db_type=batch.db_type, connectionString=batch.connectionString, username=batch.username,
+        format=batch.format, bypassCache=batch.bypassCache, refreshCache=batch.refreshCache,
+        timeoutMs=batch.timeoutMs, maxRows=batch.maxRows, maxBytes=batch.maxBytes,
+        rowLimit=batch.rowLimit, keepResult=batch.keepResult
+    )
+
+@app.post("/api/execute-batch")
+async def execute_batch(batch: BatchRequest):
+    """
+    Run a list of statements against one connection (a notebook's Run All) and stream their
+    results as NDJSON, each as soon as it finishes: {"type": "result", "index": i, ...QueryResponse}
+    per statement, in completion order, then {"type": "end"}. Independent statements run in
+    parallel on pooled connections (at most QP_BATCH_PARALLELISM at a time); sequential groups
+    (see plan_batch) run in order on one session, and stop at their first failure.
+    If the client disconnects, every statement still running is cancelled server-side.
+    """
+    start_time = time.time()
+    if not batch.statements:
+        raise HTTPException(status_code=400, detail="No statements to run")
+    if len(batch.statements) > BATCH_MAX_STATEMENTS:
+        raise HTTPException(status_code=400, detail=f"A batch can have at most {BATCH_MAX_STATEMENTS} statements")
+    if batch.db_type not in QUERY_FETCHERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported database type: {batch.db_type}")
+    try:
+        result_format = negotiate_result_format(batch.format, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Fixed query IDs let a disconnect cancel whatever is running
+    statement_requests = [
+        batch_statement_request(batch, statement).model_copy(update={"queryId": statement.queryId or uuid.uuid4().hex})
+        for statement in batch.statements
+    ]
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(max(BATCH_PARALLELISM, 1))
+    stopped = False
+
+    def emit(index: int, group: Optional[str], response: QueryResponse, skipped: bool = False):
+        event = {"type": "result", "index": index, **response.model_dump(exclude_none=True)}
+        if batch.statements[index].id is not None:
+            event["id"] = batch.statements[index].id
+        if group is not None:
+            event["group"] = group
+        if skipped:
+            event["skipped"] = True
+        results.put_nowait(event)
+
+    async def run_statement(index: int, session=None) -> QueryResponse:
+        request = statement_requests[index]
+        validation_error = validate_query_request(request)
+        if validation_error:
+            return QueryResponse(success=False, error=validation_error)
+        try:
+            return await run_query_request(apply_row_limit(request), result_format, time.time(), session=session)
+        except ExecutorSaturatedError as e:
+            return QueryResponse(success=False, error=str(e))
+
+    async def run_unit(group: Optional[str], indexes: List[int]):
+        async with slots:
+            session = None
+            failure = None
+            skipped = False
             try:
-                import psycopg2
-                import psycopg2.extras
-                
-                # Run blocking DB operations in a thread pool to avoid blocking the event loop
-                def execute_postgresql_query():
-                    connection = psycopg2.connect(
-                        host=request.host,
-                        port=request.port,
-                        user=request.user,
-                        password=request.password,
-                        dbname=request.database,
-                        connect_timeout=10
-                    )
-                    
-                    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                    cursor.execute(request.query)
-                    rows = cursor.fetchall()
-                    
-                    # Get column names
-                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                    
-                    # Convert rows to list of dicts
-                    formatted_rows = []
-                    for row in rows:
-                        formatted_row = {}
-                        for key in columns:
-                            value = row[key]
-                            # Convert any non-serializable types to strings
-                            if value is None:
-                                formatted_row[key] = None
-                            elif isinstance(value, (int, float, str, bool)):
-                                formatted_row[key] = value
-                            else:
-                                formatted_row[key] = str(value)
-                        formatted_rows.append(formatted_row)
-                    
-                    cursor.close()
-                    connection.close()
-                    
-                    return columns, formatted_rows
-                
-                # Run the blocking function in a thread pool
-                columns, formatted_rows = await asyncio.to_thread(execute_postgresql_query)
-                
-                execution_time = int((time.time() - start_time) * 1000)
-                
-                return QueryResponse(
-                    success=True,
-                    columns=columns,
-                    rows=formatted_rows,
-                    rowCount=len(formatted_rows),
-                    executionTime=execution_time
-                )
-                
-            except ImportError:
-                return QueryResponse(
-                    success=False,
-                    error="psycopg2 not installed"
-                )
-            except psycopg2.Error as e:
-                return QueryResponse(
-                    success=False,
-                    error=f"PostgreSQL Error: {str(e)}"
-                )
-                
-        elif request.db_type == 'mongodb':
+                if group is not None and batch.db_type != 'mongodb' and not stopped:
+                    session = await backend_executors[batch.db_type].run(BatchSession, batch)
+            except Exception as e:
+                failure = describe_query_error(e)
+            reported = 0
             try:
-                from pymongo import MongoClient
-                from pymongo.errors import PyMongoError
-                import json
-                from urllib.parse import urlparse, quote_plus
-                
-                if not request.connectionString:
-                    return QueryResponse(
-                        success=False,
-                        error="Connection string is required for MongoDB"
-                    )
-                
-                conn_str = request.connectionString
-                
-                # Override credentials if provided
-                if request.username and request.password:
-                    conn_str = inject_credentials(conn_str, request.username, request.password)
-                
-                # Run blocking DB operations in a thread pool to avoid blocking the event loop
-                def execute_mongodb_query():
-                    # Connect to MongoDB
-                    try:
-                        client = MongoClient(conn_str, serverSelectionTimeoutMS=10000)
-                    except Exception as e:
-                        if "RFC 3986" in str(e) or "must be escaped" in str(e).lower():
-                            fixed_uri = fix_mongodb_uri(conn_str)
-                            client = MongoClient(fixed_uri, serverSelectionTimeoutMS=10000)
-                        else:
-                            raise e
-
-                    # Use the explicitly requested database and ignore any database in connection string
-                    db = client[request.database]
-                    
-                    # Parse the query - expect JSON format
-                    # Format: {"collection": "users", "query": {...}, "limit": 1000}
-                    # or {"collection": "users", "aggregate": [...]}
-                    try:
-                        query_obj = json.loads(request.query)
-                    except json.JSONDecodeError:
-                        client.close()
-                        raise ValueError("Invalid JSON query format. Expected: {\"collection\": \"name\", \"query\": {...}} or {\"collection\": \"name\", \"aggregate\": [...]}")
-                    
-                    if 'collection' not in query_obj:
-                        client.close()
-                        raise ValueError("Query must specify 'collection' field")
-                    
-                    # Parse collection name to handle "database.collection" format
-                    collection_name = query_obj.get('collection')
-                    if not collection_name:
-                        client.close()
-                        raise ValueError("Query must specify 'collection' field")
-                    
-                    target_db = None
-                    target_coll = None
-                    
-                    if '.' in collection_name:
-                        parts = collection_name.split('.', 1)
-                        target_db_name = parts[0]
-                        target_coll_name = parts[1]
-                        target_db = client[target_db_name]
-                        target_coll = target_db[target_coll_name]
+                for index in indexes:
+                    if stopped:
+                        emit(index, group, QueryResponse(success=False, error=str(QueryCancelledError()), cancelled=True))
+                    elif failure is not None:
+                        emit(index, group, QueryResponse(success=False, error=failure), skipped=skipped)
                     else:
-                        # Fallback to requested database if no prefix
-                        target_db = client[request.database]
-                        target_coll = target_db[collection_name]
-                    
-                    # Execute query
-                    if 'aggregate' in query_obj:
-                        # Aggregation pipeline
-                        pipeline = query_obj['aggregate']
-                        cursor = target_coll.aggregate(pipeline)
-                        results = list(cursor)
-                    else:
-                        # Regular find query
-                        find_query = query_obj.get('query', {})
-                        projection = query_obj.get('projection', None)
-                        limit = query_obj.get('limit', 1000)
-                        sort = query_obj.get('sort', None)
-                        
-                        cursor = target_coll.find(find_query, projection)
-                        if sort:
-                            cursor = cursor.sort(sort)
-                        cursor = cursor.limit(limit)
-                        results = list(cursor)
-                    
-                    # Convert MongoDB documents to tabular format
-                    if not results:
-                        client.close()
-                        return [], [], 0
-                    
-                    # Get all unique keys from all documents
-                    all_keys = set()
-                    for doc in results:
-                        all_keys.update(doc.keys())
-                    
-                    columns = sorted(list(all_keys))
-                    
-                    # Convert documents to rows
-                    formatted_rows = []
-                    for doc in results:
-                        row = {}
-                        for key in columns:
-                            value = doc.get(key)
-                            # Convert ObjectId and other MongoDB types to strings
-                            if value is None:
-                                row[key] = None
-                            elif isinstance(value, (int, float, str, bool)):
-                                row[key] = value
-                            else:
-                                row[key] = str(value)
-                        formatted_rows.append(row)
-                    
-                    client.close()
-                    
-                    return columns, formatted_rows, len(formatted_rows)
-                
-                # Run the blocking function in a thread pool
-                columns, formatted_rows, row_count = await asyncio.to_thread(execute_mongodb_query)
-                
-                execution_time = int((time.time() - start_time) * 1000)
-                
-                return QueryResponse(
-                    success=True,
-                    columns=columns,
-                    rows=formatted_rows,
-                    rowCount=row_count,
-                    executionTime=execution_time
-                )
-                
-            except ImportError:
-                return QueryResponse(
-                    success=False,
-                    error="pymongo not installed"
-                )
-            except PyMongoError as e:
-                return QueryResponse(
-                    success=False,
-                    error=f"MongoDB Error: {str(e)}"
-                )
-            except ValueError as e:
-                return QueryResponse(
-                    success=False,
-                    error=str(e)
-                )
+                        response = await run_statement(index, session.connection if session else None)
+                        emit(index, group, response)
+                        if group is not None and not response.success:
+                            failure = "Skipped: an earlier statement in its group failed"
+                            skipped = True
+                    reported += 1
             except Exception as e:
-                return QueryResponse(
-                    success=False,
-                    error=f"Error: {str(e)}"
-                )
-                
+                # body() waits for one event per statement, so whatever broke the unit outside
+                # run_query_request's own error handling fails every statement not reported yet
+                error = describe_query_error(e)
+                for index in indexes[reported:]:
+                    emit(index, group, QueryResponse(success=False, error=error))
+            finally:
+                if session is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, session.close)
+
+    async def body():
+        nonlocal stopped
+        tasks = [asyncio.ensure_future(run_unit(group, indexes)) for group, indexes in plan_batch(batch)]
+        completed = False
+        try:
+            for _ in batch.statements:
+                yield json.dumps(await results.get(), default=str) + "\n"
+            yield json.dumps({
+                "type": "end",
+                "statementCount": len(batch.statements),
+                "executionTime": int((time.time() - start_time) * 1000)
+            }) + "\n"
+            completed = True
+        finally:
+            if not completed:
+                # The client went away: let each unit finish its current statement as cancelled
+                # (so sessions close cleanly) and skip the rest
+                stopped = True
+                loop = asyncio.get_running_loop()
+                for request in statement_requests:
+                    execution = running_queries.get(request.queryId)
+                    if execution is not None:
+                        loop.run_in_executor(None, execution.cancel)
+            for task in tasks:
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+class ExportRequest(QueryRequest):
+    exportFormat: str = 'csv'  # 'csv', 'jsonl' or 'parquet'
+    compression: Optional[str] = None  # 'gzip' or 'zstd'; for Parquet, the codec inside the file
+    fileName: Optional[str] = None  # Download name without extension (default: query_results)
+    resultId: Optional[str] = None  # Export this kept result instead of re-running the query
+
+@app.post("/api/export")
+async def export_query(request: ExportRequest):
+    """
+    Stream a query's complete result as a CSV, JSON Lines or Parquet download.
+    Rows come from the same server-side cursors as /api/execute-query/stream and are encoded
+    and compressed batch by batch, so memory stays flat whatever the size of the export.
+    No row or byte caps apply; the statement timeout is QP_EXPORT_STATEMENT_TIMEOUT.
+    """
+    if request.exportFormat not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format '{request.exportFormat}'. Use one of: {', '.join(EXPORT_FORMATS)}")
+    if request.compression is not None and request.compression not in EXPORT_COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported compression '{request.compression}'. Use one of: {', '.join(EXPORT_COMPRESSIONS)}")
+    required = 'pyarrow' if request.exportFormat == 'parquet' else (EXPORT_COMPRESSIONS[request.compression][2] if request.compression else None)
+    if required and importlib.util.find_spec(required) is None:
+        raise HTTPException(status_code=400, detail=f"{required} is not installed on the server")
+
+    stored = await kept_result(request.resultId) if request.resultId else None
+    if stored is None:
+        validation_error = validate_query_request(request)
+        if validation_error:
+            raise HTTPException(status_code=400, detail=validation_error)
+        producer = STREAM_PRODUCERS.get(request.db_type)
+        if producer is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported database type: {request.db_type}")
+        request = apply_row_limit(request)
+
+    extension, media_type = EXPORT_FORMATS[request.exportFormat]
+    # Parquet compresses column chunks itself; the others are compressed as a whole stream
+    outer_compression = None if request.exportFormat == 'parquet' else request.compression
+    if outer_compression:
+        suffix, media_type, _ = EXPORT_COMPRESSIONS[outer_compression]
+        extension += suffix
+    file_name = re.sub(r"[^\w.-]+", "_", request.fileName or "query_results").strip("._") or "query_results"
+
+    def chunks():
+        convert = EXPORT_CONVERTERS[request.exportFormat]
+        if stored is not None:
+            events = stored_result_events(stored, EXPORT_BATCH_SIZE, convert)
         else:
-            return QueryResponse(
-                success=False,
-                error=f"Unsupported database type: {request.db_type}"
-            )
-            
-    except Exception as e:
-        return QueryResponse(
-            success=False,
-            error=f"Unexpected error: {str(e)}"
-        )
+            events = producer(request, EXPORT_BATCH_SIZE, execution, convert=convert,
+                              timeout_ms=int(EXPORT_STATEMENT_TIMEOUT * 1000))
+        if request.exportFormat == 'csv':
+            if stored is None and request.db_type == 'mongodb':
+                # Any batch of documents can bring new fields, and the header has to name them all
+                events = spooled_events(events)
+            encoded = csv_export_chunks(events)
+        elif request.exportFormat == 'jsonl':
+            encoded = jsonl_export_chunks(events)
+        else:
+            encoded = parquet_export_chunks(events, request.compression or 'snappy')
+        yield from compress_chunks(encoded, outer_compression)
+
+    executor = backend_executors.get(request.db_type) if stored is None else None
+    if executor is not None:
+        try:
+            executor.check_capacity()
+        except ExecutorSaturatedError as e:
+            return overloaded_response(e)
+    execution = None
+    if stored is None:
+        try:
+            execution = running_queries.start(request)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    async def body():
+        completed = False
+        try:
+            async for chunk in iterate_in_thread(chunks(), executor):
+                yield chunk
+            completed = True
+        finally:
+            if execution is not None:
+                running_queries.finish(execution)
+                if not completed:
+                    # Download aborted (or failed mid-stream): stop the statement
+                    asyncio.get_running_loop().run_in_executor(None, execution.cancel)
+
+    return StreamingResponse(body(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{file_name}.{extension}"'
+    })
+
+SQL_SCHEMA_KEYWORDS = ["SELECT", "FROM", "WHERE", "JOIN", "LEFT JOIN", "RIGHT JOIN", 
+                       "INNER JOIN", "OUTER JOIN", "ON", "AND", "OR", "ORDER BY", 
+                       "GROUP BY", "HAVING", "LIMIT", "OFFSET", "AS", "DISTINCT",
+                       "COUNT", "SUM", "AVG", "MAX", "MIN", "INSERT", "UPDATE", 
+                       "DELETE", "CREATE", "DROP", "ALTER", "TABLE", "INDEX",
+                       "PRIMARY KEY", "FOREIGN KEY", "NOT NULL", "UNIQUE", "DEFAULT"]
+
+MYSQL_COLUMNS_SQL = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE,
+           c.COLUMN_KEY, c.COLUMN_DEFAULT, c.EXTRA
+    FROM information_schema.COLUMNS c
+    WHERE c.TABLE_SCHEMA = %s
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+MYSQL_KEYS_SQL = """
+    SELECT 'index' AS kind, s.TABLE_NAME, s.INDEX_NAME, s.COLUMN_NAME, s.SEQ_IN_INDEX,
+           s.NON_UNIQUE = 0 AS is_unique, NULL AS ref_table, NULL AS ref_column
+    FROM information_schema.STATISTICS s
+    WHERE s.TABLE_SCHEMA = %s
+    UNION ALL
+    SELECT 'foreign_key', k.TABLE_NAME, k.CONSTRAINT_NAME, k.COLUMN_NAME, k.ORDINAL_POSITION,
+           NULL, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE k
+    WHERE k.TABLE_SCHEMA = %s AND k.REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY 2, 1, 3, 5
+"""
+
+POSTGRESQL_COLUMNS_SQL = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod),
+           NOT a.attnotnull, pg_get_expr(d.adbin, d.adrelid)
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+    LEFT JOIN pg_catalog.pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    WHERE n.nspname = 'public'
+      AND c.relkind IN ('r', 'p')
+      AND a.attnum > 0 AND NOT a.attisdropped
+      AND has_any_column_privilege(c.oid, 'SELECT, INSERT, UPDATE, REFERENCES')
+    ORDER BY c.relname, a.attnum
+"""
+
+POSTGRESQL_KEYS_SQL = """
+    SELECT 'index' AS kind, t.relname::text, i.relname::text, a.attname::text, k.ord,
+           x.indisunique, x.indisprimary, NULL::text AS ref_table, NULL::text AS ref_column
+    FROM pg_catalog.pg_index x
+    JOIN pg_catalog.pg_class t ON t.oid = x.indrelid
+    JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+    CROSS JOIN LATERAL unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+    WHERE n.nspname = 'public' AND t.relkind IN ('r', 'p')
+    UNION ALL
+    SELECT 'foreign_key', t.relname::text, con.conname::text, a.attname::text, k.ord,
+           NULL, NULL, r.relname::text, ra.attname::text
+    FROM pg_catalog.pg_constraint con
+    JOIN pg_catalog.pg_class t ON t.oid = con.conrelid
+    JOIN pg_catalog.pg_class r ON r.oid = con.confrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, ord)
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    JOIN pg_catalog.pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+    WHERE con.contype = 'f' AND n.nspname = 'public'
+    ORDER BY 2, 1, 3, 5
+"""
+
+def group_schema_keys(tables: Dict[str, Dict[str, Any]], key_rows) -> None:
+    """
+    Attach primaryKey / indexes / foreignKeys to each table in one pass over key rows
+    shaped (kind, table, name, column, position, unique, primary, ref_table, ref_column),
+    sorted by table, kind, name, position.
+    """
+    current = None
+    for kind, table_name, name, column, _, unique, primary, ref_table, ref_column in key_rows:
+        table = tables.get(table_name)
+        if table is None:
+            continue
+        if current is None or current["table"] is not table or current["kind"] != kind or current["name"] != name:
+            if kind == 'index':
+                entry = {"name": name, "columns": [], "unique": bool(unique)}
+                table["indexes"].append(entry)
+                if primary:
+                    table["primaryKey"] = entry["columns"]
+            else:
+                entry = {"name": name, "columns": [], "referencedTable": ref_table, "referencedColumns": []}
+                table["foreignKeys"].append(entry)
+            current = {"table": table, "kind": kind, "name": name, "entry": entry}
+        current["entry"]["columns"].append(column)
+        if kind == 'foreign_key':
+            current["entry"]["referencedColumns"].append(ref_column)
+
+def introspect_mysql_schema(cursor, database: str) -> List[Dict[str, Any]]:
+    """Load every table's columns, keys and indexes with two information_schema queries."""
+    cursor.execute(MYSQL_COLUMNS_SQL, (database,))
+    tables = {}
+    for table_name, name, column_type, nullable, key, default, extra in cursor.fetchall():
+        table = tables.get(table_name)
+        if table is None:
+            table = tables[table_name] = {
+                "name": table_name, "columns": [], "primaryKey": [], "indexes": [], "foreignKeys": []
+            }
+        table["columns"].append({
+            "name": name,
+            "type": column_type,
+            "nullable": nullable == "YES",
+            "key": key,
+            "default": default,
+            "extra": extra
+        })
+
+    cursor.execute(MYSQL_KEYS_SQL, (database, database))
+    group_schema_keys(tables, [
+        (kind, table_name, name, column, position, unique, kind == 'index' and name == 'PRIMARY', ref_table, ref_column)
+        for kind, table_name, name, column, position, unique, ref_table, ref_column in cursor.fetchall()
+    ])
+    return list(tables.values())
+
+def introspect_postgresql_schema(cursor) -> List[Dict[str, Any]]:
+    """Load every public table's columns, keys and indexes with two pg_catalog queries."""
+    cursor.execute(POSTGRESQL_COLUMNS_SQL)
+    tables = {}
+    for table_name, name, column_type, nullable, default in cursor.fetchall():
+        table = tables.get(table_name)
+        if table is None:
+            table = tables[table_name] = {
+                "name": table_name, "columns": [], "primaryKey": [], "indexes": [], "foreignKeys": []
+            }
+        table["columns"].append({
+            "name": name,
+            "type": column_type,
+            "nullable": nullable,
+            "default": default
+        })
+
+    cursor.execute(POSTGRESQL_KEYS_SQL)
+    group_schema_keys(tables, cursor.fetchall())
+    return list(tables.values())
+
+# Schema fingerprints: one cheap aggregate query that changes whenever the catalog does.
+# TABLES covers created/dropped/altered tables; the COLUMNS checksum catches in-place
+# column changes that don't bump CREATE_TIME (e.g. ALGORITHM=INSTANT).
+MYSQL_FINGERPRINT_SQL = """
+    SELECT COUNT(*), MAX(CREATE_TIME), MAX(UPDATE_TIME),
+           SUM(CRC32(CONCAT_WS(':', TABLE_NAME, TABLE_TYPE))),
+           (SELECT SUM(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE,
+                                       IS_NULLABLE, COLUMN_KEY)))
+            FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s)
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = %s
+"""
+
+# Any DDL rewrites the affected pg_class / pg_attribute / pg_constraint rows, giving them a new xmin
+POSTGRESQL_FINGERPRINT_SQL = """
+    SELECT md5(COALESCE(string_agg(entry, ',' ORDER BY entry), ''))
+    FROM (
+        SELECT 'c' || c.oid || ':' || c.xmin AS entry
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm', 'i')
+        UNION ALL
+        SELECT 'a' || a.attrelid || ':' || a.attnum || ':' || a.xmin
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND a.attnum > 0
+        UNION ALL
+        SELECT 'k' || con.oid || ':' || con.xmin
+        FROM pg_catalog.pg_constraint con
+        JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+        WHERE n.nspname = 'public'
+    ) catalog
+"""
+
+def mysql_schema_fingerprint(cursor, database: str) -> str:
+    cursor.execute(MYSQL_FINGERPRINT_SQL, (database, database))
+    return hashlib.sha256(repr(cursor.fetchone()).encode("utf-8")).hexdigest()
+
+def postgresql_schema_fingerprint(cursor) -> str:
+    cursor.execute(POSTGRESQL_FINGERPRINT_SQL)
+    return cursor.fetchone()[0]
+
+MONGODB_SCHEMA_KEYWORDS = ["find", "aggregate", "match", "group", "sort", "limit", 
+                           "project", "lookup", "unwind", "sum", "avg", "count",
+                           "insert", "update", "delete", "collection"]
+
+MONGO_SCHEMA_SAMPLE_SIZE = int(os.getenv("QP_MONGO_SCHEMA_SAMPLE_SIZE", "100"))
+MONGO_SCHEMA_WORKERS = int(os.getenv("QP_MONGO_SCHEMA_WORKERS", "8"))
+MONGO_SCHEMA_COLLECTION_TIMEOUT = float(os.getenv("QP_MONGO_SCHEMA_COLLECTION_TIMEOUT", "5"))  # seconds
+MONGO_SCHEMA_TOTAL_TIMEOUT = float(os.getenv("QP_MONGO_SCHEMA_TOTAL_TIMEOUT", "30"))  # seconds
+MONGO_SCHEMA_MAX_DEPTH = int(os.getenv("QP_MONGO_SCHEMA_MAX_DEPTH", "4"))
+
+mongo_schema_executor = ThreadPoolExecutor(max_workers=MONGO_SCHEMA_WORKERS, thread_name_prefix="mongo-schema")
+
+def bson_type_name(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__
+
+def collect_field_types(doc, histograms: Dict[str, Dict[str, int]], prefix: str = "", depth: int = 0) -> None:
+    """Count value types per field, descending into sub-documents (and arrays of them) as dotted paths."""
+    for key, value in doc.items():
+        path = f"{prefix}{key}"
+        counts = histograms.setdefault(path, {})
+        type_name = bson_type_name(value)
+        counts[type_name] = counts.get(type_name, 0) + 1
+        if depth >= MONGO_SCHEMA_MAX_DEPTH:
+            continue
+        if isinstance(value, dict):
+            collect_field_types(value, histograms, path + ".", depth + 1)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    collect_field_types(item, histograms, path + ".", depth + 1)
+
+def sample_collection_schema(collection, sample_size: int = MONGO_SCHEMA_SAMPLE_SIZE,
+                             time_budget: float = MONGO_SCHEMA_COLLECTION_TIMEOUT) -> Dict[str, Any]:
+    """
+    Infer a collection's fields from a random $sample, stopping once the time budget is spent.
+    Each field reports its most common non-null type plus a histogram of all observed types.
+    """
+    from pymongo.errors import ExecutionTimeout, OperationFailure
+
+    deadline = time.monotonic() + time_budget
+    max_time_ms = max(int(time_budget * 1000), 1)
+    histograms = {}
+    sampled = 0
+    timed_out = False
+
+    try:
+        cursor = collection.aggregate([{"$sample": {"size": sample_size}}], maxTimeMS=max_time_ms)
+    except OperationFailure:
+        # $sample isn't available everywhere (e.g. some views) - fall back to a plain bounded scan
+        cursor = collection.find().limit(sample_size).max_time_ms(max_time_ms)
+
+    try:
+        for doc in cursor:
+            collect_field_types(doc, histograms)
+            sampled += 1
+            if time.monotonic() > deadline:
+                timed_out = sampled < sample_size
+                break
+    except ExecutionTimeout:
+        timed_out = True
+    finally:
+        cursor.close()
+
+    columns = []
+    for path in sorted(histograms):
+        counts = histograms[path]
+        non_null = {name: count for name, count in counts.items() if name != "null"}
+        columns.append({
+            "name": path,
+            "type": max(non_null, key=non_null.get) if non_null else "null",
+            "types": counts
+        })
+    return {"columns": columns, "sampled": sampled, "timedOut": timed_out}
+
+def infer_mongodb_schema(client, deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Sample every user collection on a bounded worker pool and return them as schema tables,
+    within QP_MONGO_SCHEMA_TOTAL_TIMEOUT or until the given time.monotonic() deadline.
+    A database whose collections can't be listed in time is returned as one table named after
+    it, marked timedOut (or with the error), next to whatever else was sampled.
+    """
+    # Filter out system databases for schema
+    user_dbs = [d for d in client.list_database_names() if d not in ['admin', 'config', 'local']]
+    listings = [(db_name, mongo_schema_executor.submit(client[db_name].list_collection_names))
+                for db_name in user_dbs]
+
+    if deadline is None:
+        deadline = time.monotonic() + MONGO_SCHEMA_TOTAL_TIMEOUT
+    jobs = []
+    unlisted = []
+    for db_name, listing in listings:
+        try:
+            coll_names = listing.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeoutError:
+            listing.cancel()
+            unlisted.append({"name": db_name, "columns": [], "sampled": 0, "timedOut": True})
+            continue
+        except Exception as e:
+            unlisted.append({"name": db_name, "columns": [], "sampled": 0, "error": str(e)})
+            continue
+        for coll_name in coll_names:
+            jobs.append((f"{db_name}.{coll_name}",
+                         mongo_schema_executor.submit(sample_collection_schema, client[db_name][coll_name])))
+
+    tables = []
+    for full_table_name, job in jobs:
+        try:
+            sample = job.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeoutError:
+            job.cancel()
+            sample = {"columns": [], "sampled": 0, "timedOut": True}
+        except Exception as e:
+            sample = {"columns": [], "sampled": 0, "error": str(e)}
+        tables.append({"name": full_table_name, **sample})
+    return tables + unlisted
+
+def mongodb_database_fingerprint(client, db_name: str) -> list:
+    db = client[db_name]
+    stats = db.command("dbStats")
+    return [
+        db_name,
+        sorted(db.list_collection_names()),
+        stats.get("indexes"),
+        len(str(int(stats.get("objects") or 0)))
+    ]
+
+def mongodb_schema_fingerprint(client, deadline: float) -> Optional[str]:
+    """
+    Collection lists plus coarse dbStats. Document counts are bucketed by order of magnitude
+    so ordinary writes don't force a re-sample, while a collection that grows 10x does.
+    Databases are read concurrently on the schema worker pool; if one doesn't answer by the
+    time.monotonic() deadline (or fails) the fingerprint is None, so the schema counts as stale.
+    """
+    user_dbs = sorted(d for d in client.list_database_names() if d not in ['admin', 'config', 'local'])
+    reads = [mongo_schema_executor.submit(mongodb_database_fingerprint, client, db_name) for db_name in user_dbs]
+    parts = []
+    for read in reads:
+        try:
+            parts.append(read.result(timeout=max(deadline - time.monotonic(), 0)))
+        except Exception:
+            for pending in reads:
+                pending.cancel()
+            return None
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def resolve_schema_db_type(request: SchemaRequest) -> str:
+    if request.db_type:
+        return request.db_type
+    # Try to determine database type based on port if not specified
+    if request.port == 3306:
+        return 'mysql'
+    if request.port == 5432:
+        return 'postgresql'
+    if request.connectionString:
+        return 'mongodb'
+    return 'mysql'  # Default
+
+def schema_cache_key(db_type: str, request: SchemaRequest) -> tuple:
+    if db_type == 'mongodb':
+        conn_str = mongodb_connection_string(request) or ""
+        return ('mongodb', hashlib.sha256(conn_str.encode("utf-8")).hexdigest())
+    return connection_key(db_type, request.host, request.port, request.user,
+                          request.database, request.password)
+
+# Each loader returns (fingerprint, schema); schema is None when the fingerprint is still known_fingerprint
+
+def load_mysql_schema(request: SchemaRequest, known_fingerprint: Optional[str]):
+    import pymysql
+    with pooled_connection('mysql', request.host, request.port, request.user,
+                           request.password, request.database) as connection:
+        cursor = connection.cursor()
+        try:
+            fingerprint = mysql_schema_fingerprint(cursor, request.database)
+            if fingerprint == known_fingerprint:
+                return fingerprint, None
+            # Two bulk catalog queries instead of SHOW TABLES + one DESCRIBE per table
+            tables = introspect_mysql_schema(cursor, request.database)
+            return fingerprint, {"tables": tables, "keywords": SQL_SCHEMA_KEYWORDS}
+        finally:
+            cursor.close()
+
+def load_postgresql_schema(request: SchemaRequest, known_fingerprint: Optional[str]):
+    import psycopg2
+    with pooled_connection('postgresql', request.host, request.port, request.user,
+                           request.password, request.database) as connection:
+        cursor = connection.cursor()
+        try:
+            fingerprint = postgresql_schema_fingerprint(cursor)
+            if fingerprint == known_fingerprint:
+                return fingerprint, None
+            # Two bulk pg_catalog queries instead of one information_schema query per table
+            tables = introspect_postgresql_schema(cursor)
+            return fingerprint, {"tables": tables, "keywords": SQL_SCHEMA_KEYWORDS}
+        finally:
+            cursor.close()
+
+def load_mongodb_schema(request: SchemaRequest, known_fingerprint: Optional[str]):
+    import pymongo
+    with mongo_clients.acquire(mongodb_connection_string(request)) as client:
+        # Fingerprinting and sampling share one deadline; the fingerprint gets at most one
+        # collection's budget of it, so a slow server still leaves time to re-sample
+        started = time.monotonic()
+        deadline = started + MONGO_SCHEMA_TOTAL_TIMEOUT
+        fingerprint = mongodb_schema_fingerprint(client, min(deadline, started + MONGO_SCHEMA_COLLECTION_TIMEOUT))
+        if fingerprint is not None and fingerprint == known_fingerprint:
+            return fingerprint, None
+        # Collections are sampled concurrently, each within its own time budget
+        tables = infer_mongodb_schema(client, deadline)
+        return fingerprint, {"tables": tables, "keywords": MONGODB_SCHEMA_KEYWORDS}
+
+SCHEMA_LOADERS = {
+    'mysql': (load_mysql_schema, 'MySQL', 'PyMySQL'),
+    'postgresql': (load_postgresql_schema, 'PostgreSQL', 'psycopg2'),
+    'mongodb': (load_mongodb_schema, 'MongoDB', 'pymongo')
+}
 
 @app.post("/api/schema")
-async def get_database_schema(request: SchemaRequest):
+async def get_database_schema(request: SchemaRequest, if_none_match: Optional[str] = Header(None)):
     """
     Fetch database schema (tables/collections and columns/fields) for autocomplete.
     Returns table/collection names, column/field names, and data types.
+
+    Schemas are cached per connection and revalidated with a cheap catalog fingerprint.
+    The response carries an ETag; a matching If-None-Match gets 304 Not Modified.
     """
     try:
-        db_type = request.db_type
-        
-        # Try to determine database type based on port if not specified
-        if not db_type:
-            if request.port == 3306:
-                db_type = 'mysql'
-            elif request.port == 5432:
-                db_type = 'postgresql'
-            elif request.connectionString:
-                db_type = 'mongodb'
-            else:
-                db_type = 'mysql'  # Default
+        db_type = resolve_schema_db_type(request)
+        if db_type not in SCHEMA_LOADERS:
+            raise HTTPException(status_code=400, detail=f"Unsupported database type: {db_type}")
+        if db_type == 'mongodb' and not request.connectionString:
+            raise HTTPException(status_code=400, detail="Connection string required for MongoDB")
         
-        if db_type == 'mysql':
-            try:
-                import pymysql
-                
-                connection = pymysql.connect(
-                    host=request.host,
-                    port=request.port,
-                    user=request.user,
-                    password=request.password,
-                    database=request.database,
-                    connect_timeout=10
-                )
-                
-                cursor = connection.cursor()
-                
-                # Get all tables
-                cursor.execute("SHOW TABLES")
-                tables_result = cursor.fetchall()
-                
-                schema = {
-                    "tables": [],
-                    "keywords": ["SELECT", "FROM", "WHERE", "JOIN", "LEFT JOIN", "RIGHT JOIN", 
-                                "INNER JOIN", "OUTER JOIN", "ON", "AND", "OR", "ORDER BY", 
-                                "GROUP BY", "HAVING", "LIMIT", "OFFSET", "AS", "DISTINCT",
-                                "COUNT", "SUM", "AVG", "MAX", "MIN", "INSERT", "UPDATE", 
-                                "DELETE", "CREATE", "DROP", "ALTER", "TABLE", "INDEX",
-                                "PRIMARY KEY", "FOREIGN KEY", "NOT NULL", "UNIQUE", "DEFAULT"]
-                }
-                
-                # For each table, get columns
-                for table_row in tables_result:
-                    table_name = table_row[0]
-                    
-                    # Get column information
-                    cursor.execute(f"DESCRIBE `{table_name}`")
-                    columns_result = cursor.fetchall()
-                    
-                    columns = []
-                    for col in columns_result:
-                        columns.append({
-                            "name": col[0],
-                            "type": col[1],
-                            "nullable": col[2] == "YES",
-                            "key": col[3],
-                            "default": col[4],
-                            "extra": col[5]
-                        })
-                    
-                    schema["tables"].append({
-                        "name": table_name,
-                        "columns": columns
-                    })
-                
-                cursor.close()
-                connection.close()
-                
-                return schema
-                
-            except ImportError:
-                raise HTTPException(status_code=500, detail="PyMySQL not installed")
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"MySQL error: {str(e)}")
+        key = schema_cache_key(db_type, request)
+        entry = None if request.refresh else schema_cache.get(key)
         
-        elif db_type == 'postgresql':
+        if entry is not None and schema_cache.is_fresh(entry):
+            # Checked recently: answer without touching the catalog at all
+            schema_cache.record_hit()
+        else:
+            loader, label, driver = SCHEMA_LOADERS[db_type]
+            known_fingerprint = entry["fingerprint"] if entry is not None else None
             try:
-                import psycopg2
-                
-                connection = psycopg2.connect(
-                    host=request.host,
-                    port=request.port,
-                    user=request.user,
-                    password=request.password,
-                    dbname=request.database,
-                    connect_timeout=10
-                )
-                
-                cursor = connection.cursor()
-                
-                # Get all tables from public schema
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables 
-                    WHERE table_schema = 'public' 
-                    AND table_type = 'BASE TABLE'
-                """)
-                tables_result = cursor.fetchall()
-                
-                schema = {
-                    "tables": [],
-                    "keywords": ["SELECT", "FROM", "WHERE", "JOIN", "LEFT JOIN", "RIGHT JOIN", 
-                                "INNER JOIN", "OUTER JOIN", "ON", "AND", "OR", "ORDER BY", 
-                                "GROUP BY", "HAVING", "LIMIT", "OFFSET", "AS", "DISTINCT",
-                                "COUNT", "SUM", "AVG", "MAX", "MIN", "INSERT", "UPDATE", 
-                                "DELETE", "CREATE", "DROP", "ALTER", "TABLE", "INDEX",
-                                "PRIMARY KEY", "FOREIGN KEY", "NOT NULL", "UNIQUE", "DEFAULT"]
-                }
-                
-                # For each table, get columns
-                for table_row in tables_result:
-                    table_name = table_row[0]
-                    
-                    # Get column information
-                    cursor.execute("""
-                        SELECT column_name, data_type, is_nullable, column_default
-                        FROM information_schema.columns
-                        WHERE table_schema = 'public' AND table_name = %s
-                        ORDER BY ordinal_position
-                    """, (table_name,))
-                    columns_result = cursor.fetchall()
-                    
-                    columns = []
-                    for col in columns_result:
-                        columns.append({
-                            "name": col[0],
-                            "type": col[1],
-                            "nullable": col[2] == "YES",
-                            "default": col[3]
-                        })
-                    
-                    schema["tables"].append({
-                        "name": table_name,
-                        "columns": columns
-                    })
-                
-                cursor.close()
-                connection.close()
-                
-                return schema
-                
+                fingerprint, schema = await backend_executors[db_type].run(loader, request, known_fingerprint)
+            except ExecutorSaturatedError as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
             except ImportError:
-                raise HTTPException(status_code=500, detail="psycopg2 not installed")
+                raise HTTPException(status_code=500, detail=f"{driver} not installed")
             except Exception as e:
-                raise HTTPException(status_code=500, detail=f"PostgreSQL error: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"{label} error: {str(e)}")
+            
+            if schema is None:
+                entry = schema_cache.revalidate(key, entry)
+            else:
+                entry = schema_cache.put(key, schema, fingerprint)
         
-        elif db_type == 'mongodb':
-            try:
-                from pymongo import MongoClient
-                from urllib.parse import urlparse, quote_plus
-                
-                if not conn_str:
-                    raise HTTPException(status_code=400, detail="Connection string required for MongoDB")
-                
-                # Override credentials if provided
-                if request.username and request.password:
-                    conn_str = inject_credentials(conn_str, request.username, request.password)
-
-                try:
-                    client = MongoClient(conn_str, serverSelectionTimeoutMS=10000)
-                except Exception as e:
-                    if "RFC 3986" in str(e) or "must be escaped" in str(e).lower():
-                        fixed_uri = fix_mongodb_uri(conn_str)
-                        client = MongoClient(fixed_uri, serverSelectionTimeoutMS=10000)
-                    else:
-                        raise e
-                        
-                # Use explicit database name
-                db = client[request.database]
-                
-                # Get all databases
-                total_databases = client.list_database_names()
-                
-                # Filter out system databases for schema
-                user_dbs = [d for d in total_databases if d not in ['admin', 'config', 'local']]
-                
-                schema = {
-                    "tables": [],
-                    "keywords": ["find", "aggregate", "match", "group", "sort", "limit", 
-                                "project", "lookup", "unwind", "sum", "avg", "count",
-                                "insert", "update", "delete", "collection"]
-                }
-                
-                # Iterate through all user databases
-                for db_name in user_dbs:
-                    db = client[db_name]
-                    collection_names = db.list_collection_names()
-                    
-                    for coll_name in collection_names:
-                        collection = db[coll_name]
-                        full_table_name = f"{db_name}.{coll_name}"
-                        
-                        # Sample first 100 documents to infer fields
-                        sample_docs = list(collection.find().limit(100))
-                        
-                        # Get all unique fields
-                        fields = set()
-                        for doc in sample_docs:
-                            fields.update(doc.keys())
-                        
-                        # Create column info
-                        columns = []
-                        for field in sorted(fields):
-                            # Try to infer type from first occurrence
-                            field_type = "mixed"
-                            for doc in sample_docs:
-                                if field in doc:
-                                    value = doc[field]
-                                    if isinstance(value, str):
-                                        field_type = "string"
-                                    elif isinstance(value, int):
-                                        field_type = "int"
-                                    elif isinstance(value, float):
-                                        field_type = "double"
-                                    elif isinstance(value, bool):
-                                        field_type = "boolean"
-                                    elif isinstance(value, list):
-                                        field_type = "array"
-                                    elif isinstance(value, dict):
-                                        field_type = "object"
-                                    else:
-                                        field_type = str(type(value).__name__)
-                                    break
-                            
-                            columns.append({
-                                "name": field,
-                                "type": field_type
-                            })
-                        
-                        schema["tables"].append({
-                            "name": full_table_name,
-                            "columns": columns
-                        })
-                
-                client.close()
-                return schema
-                
-            except ImportError:
-                raise HTTPException(status_code=500, detail="pymongo not installed")
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"MongoDB error: {str(e)}")
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported database type: {db_type}")
+        headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, entry["etag"]):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=entry["schema"], headers=headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
@@ -1178,6 +6313,163 @@ async def get_database_schema(request: SchemaRequest):
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/result-cache")
+def get_result_cache_stats():
+    """Report result cache usage (entries, bytes, hit rate, evictions)."""
+    return {
+        **result_cache.stats(),
+        "settings": {
+            "ttl": RESULT_CACHE_TTL,
+            "max_ttl": RESULT_CACHE_MAX_TTL
+        }
+    }
+
+@app.delete("/api/result-cache")
+def clear_result_cache():
+    """Drop every cached query result."""
+    return {"success": True, "cleared": result_cache.clear()}
+
+@app.get("/api/llm-cache")
+def get_llm_cache_stats():
+    """Report Query Pilot answer cache usage for both tiers."""
+    return llm_cache.stats()
+
+@app.delete("/api/llm-cache")
+def clear_llm_cache():
+    """Drop every cached Query Pilot answer, in memory and on disk."""
+    return {"success": True, "cleared": llm_cache.clear()}
+
+@app.get("/api/queries")
+def list_running_queries():
+    """Queries currently executing, with their IDs and elapsed time."""
+    return {"queries": running_queries.list()}
+
+@app.post("/api/queries/{query_id}/cancel")
+async def cancel_query(query_id: str):
+    """
+    Stop a running query server-side: KILL QUERY on MySQL, a protocol cancel request on
+    PostgreSQL, killOp on MongoDB (plus closing its cursor between batches).
+    """
+    execution = running_queries.get(query_id)
+    if execution is None:
+        raise HTTPException(status_code=404, detail=f"No running query with ID '{query_id}'")
+    # Sending the cancel may need a new database session, so keep it off the event loop
+    cancelled = await asyncio.to_thread(execution.cancel)
+    return {"success": True, "queryId": query_id, "alreadyCancelled": not cancelled}
+
+@app.get("/api/results/{result_id}/count")
+async def get_result_count(result_id: str, wait: float = 0):
+    """
+    Total row count of a paginated result: status 'pending', 'ready' (with totalCount), 'error'
+    or 'unavailable'. With wait=N, waits up to N seconds (max 30) for a pending count.
+    """
+    status = await row_counts.wait(result_id, min(max(wait, 0), 30))
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No paginated result with ID '{result_id}'")
+    return {"resultId": result_id, **status}
+
+@app.delete("/api/results/{result_id}")
+async def close_result(result_id: str):
+    """Release a result: close a paginated result's held cursor, forget its count, drop a kept result."""
+    cursor = page_cursors.remove(result_id)
+    if cursor is not None:
+        await asyncio.get_running_loop().run_in_executor(None, cursor.close)
+    row_counts.discard(result_id)
+    stored = result_store.pop(result_id)
+    return {"success": True, "resultId": result_id, "closedCursor": cursor is not None,
+            "droppedResult": stored is not None}
+
+class ResultSort(BaseModel):
+    column: str
+    direction: str = 'asc'  # 'asc' or 'desc'
+
+class ResultViewRequest(BaseModel):
+    globalFilter: Optional[str] = None  # Case-insensitive "contains" over every column
+    columnFilters: Dict[str, str] = {}  # Column -> case-insensitive "contains"
+    sort: List[ResultSort] = []  # Primary sort first; NULLs sort last
+    offset: int = 0
+    limit: int = 300
+    format: Optional[str] = None  # 'rows' (default), 'arrays' or 'columnar'
+
+@app.post("/api/results/{result_id}/view")
+async def view_result(result_id: str, request: ResultViewRequest):
+    """
+    Filter, sort and window a result kept with keepResult, without re-running the query.
+    Returns the window's rows plus filteredCount (rows matching the filters) and totalRows.
+    """
+    start_time = time.time()
+    stored = await kept_result(result_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Result is no longer available; run the query again")
+    try:
+        result_format = negotiate_result_format(request.format, None)
+        sort = []
+        for key in request.sort:
+            if key.direction not in ('asc', 'desc'):
+                raise ValueError(f"Invalid sort direction '{key.direction}'. Use 'asc' or 'desc'")
+            sort.append((key.column, key.direction == 'desc'))
+        rows, filtered_count = await asyncio.get_running_loop().run_in_executor(
+            None, stored.view, request.globalFilter, request.columnFilters, sort,
+            max(request.offset, 0), min(max(request.limit, 0), MAX_RESULT_ROWS or request.limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "resultId": result_id,
+        "offset": max(request.offset, 0),
+        "rowCount": len(rows),
+        "filteredCount": filtered_count,
+        "totalRows": stored.row_count,
+        "executionTime": int((time.time() - start_time) * 1000),
+        **encode_result(stored.columns, rows, result_format)
+    }
+
+@app.get("/api/result-store")
+def get_result_store_stats():
+    """Results kept server-side for /api/results/{id}/view."""
+    return result_store.stats()
+
+@app.get("/api/page-cursors")
+def get_page_cursor_stats():
+    """Server-side cursors held open for paginated results."""
+    return page_cursors.stats()
+
+@app.get("/api/executors")
+def get_executor_stats():
+    """Per-backend executor load: running/queued calls, rejections and queue wait times."""
+    return {name: executor.stats() for name, executor in backend_executors.items()}
+
+@app.get("/api/schema-cache")
+def get_schema_cache_stats():
+    """Schema cache hit/revalidation counters."""
+    return schema_cache.stats()
+
+@app.delete("/api/schema-cache")
+def clear_schema_cache():
+    """Drop every cached schema; the next /api/schema call per connection re-introspects."""
+    return {"success": True, "cleared": schema_cache.clear()}
+
+@app.get("/api/pools")
+def get_pool_stats():
+    """
+    Report connection pool usage for MySQL and PostgreSQL and the shared MongoDB clients.
+    Idle connections are swept as a side effect so the numbers are current.
+    """
+    connection_pools.sweep()
+    mongo_clients.evict_idle()
+    return {
+        "pools": connection_pools.stats(),
+        "mongodb": mongo_clients.stats(),
+        "engine": QUERY_ENGINE,
+        "async_pools": async_drivers.stats(),
+        "settings": {
+            "min_size": POOL_MIN_SIZE,
+            "max_size": POOL_MAX_SIZE,
+            "idle_timeout": POOL_IDLE_TIMEOUT,
+            "checkout_timeout": POOL_CHECKOUT_TIMEOUT
+        }
+    }
+
 # MongoDB test connection endpoint
 @app.post("/api/test-connection/mongodb", response_model=ConnectionResponse)
 async def test_mongodb_connection(request: MongoDBConnectionRequest):
@@ -1185,8 +6477,15 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
     Test MongoDB database connection with provided credentials.
     Returns success status and detailed steps of the connection process.
     """
-    steps = []
-    
+    return await run_connection_diagnostics(diagnose_mongodb_connection, request)
+
+@app.post("/api/test-connection/mongodb/stream")
+async def test_mongodb_connection_stream(request: MongoDBConnectionRequest):
+    """Same as /api/test-connection/mongodb, streaming each step over SSE as it finishes."""
+    return stream_connection_diagnostics(diagnose_mongodb_connection, request)
+
+def diagnose_mongodb_connection(request: MongoDBConnectionRequest, steps: DiagnosticSteps) -> ConnectionResponse:
+    """Blocking MongoDB connection test; runs on diagnostics_executor and reports progress through steps."""
     try:
         # Step 1: Validate credentials format
         steps.append({
@@ -1206,7 +6505,6 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
                 error="Missing connection string"
             )
             
-        time.sleep(0.3)
         steps[-1]["status"] = "completed"
         
         # Step 2: Establishing connection
@@ -1228,22 +6526,29 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
             if request.username and request.password:
                 conn_str = inject_credentials(conn_str, request.username, request.password)
             
-            # Try to connect
-            try:
-                client = MongoClient(conn_str, serverSelectionTimeoutMS=10000)
-                # Force a check to validate the URI format immediately
-                client.admin.command('ping')
-            except Exception as e:
-                # If error is about escaping, try to fix it
-                if "RFC 3986" in str(e) or "must be escaped" in str(e).lower():
-                    print(f"Attempting to fix MongoDB URI: {conn_str}") 
-                    fixed_uri = fix_mongodb_uri(conn_str)
-                    client = MongoClient(fixed_uri, serverSelectionTimeoutMS=10000)
-                else:
-                    raise e
+            # Try to connect (the cache repairs unescaped credentials in the URI if needed)
+            def connect():
+                lease = mongo_clients.acquire(conn_str)
+                try:
+                    # Force a check to validate the connection immediately
+                    lease.client.admin.command('ping')
+                except Exception:
+                    lease.release()
+                    raise
+                return lease
+            
+            lease = connect_with_probe(
+                connect,
+                lambda late_lease: late_lease.release(),
+                mongodb_probe_targets(conn_str),
+                steps[-1]
+            )
+            client = lease.client
             
             steps[-1]["status"] = "completed"
             
+        except ConnectionProbeError as e:
+            return unreachable_response(steps, e, "MongoDB server")
         except ImportError:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = "pymongo not installed"
@@ -1298,7 +6603,7 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
         except OperationFailure as e:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = "Authentication failed"
-            client.close()
+            lease.release()
             return ConnectionResponse(
                 success=False,
                 message="Authentication failed. Please check your credentials.",
@@ -1308,7 +6613,7 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
         except Exception as e:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = str(e)
-            client.close()
+            lease.release()
             return ConnectionResponse(
                 success=False,
                 message=f"Authentication error: {str(e)}",
@@ -1337,7 +6642,7 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
         except Exception as e:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = str(e)
-            client.close()
+            lease.release()
             return ConnectionResponse(
                 success=False,
                 message=f"Database access error: {str(e)}",
@@ -1366,7 +6671,7 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
         except Exception as e:
             steps[-1]["status"] = "failed"
             steps[-1]["error"] = str(e)
-            client.close()
+            lease.release()
             return ConnectionResponse(
                 success=False,
                 message=f"Query privilege test failed: {str(e)}",
@@ -1383,7 +6688,7 @@ async def test_mongodb_connection(request: MongoDBConnectionRequest):
         })
         
         # Clean up
-        client.close()
+        lease.release()
         
         return ConnectionResponse(
             success=True,
@@ -1404,37 +6709,253 @@ class QueryPilotRequest(BaseModel):
     system_prompt: str
     user_prompt: str
     model: str = "llama3.2"
+    temperature: float = 0.1
+    bypassCache: bool = False  # Generate a fresh answer (and replace the cached one)
+
+class LLMResponseCache:
+    """
+    Query Pilot answers keyed by (model, system prompt hash, user prompt hash, temperature):
+    an in-memory LRU tier (a ResultCache) in front of a SQLite file that survives restarts.
+    Both tiers expire entries after QP_LLM_CACHE_TTL and evict the least recently used ones
+    past their byte budgets. If the file can't be opened, only the memory tier is used.
+    """
+
+    def __init__(self, path: str, ttl: float, max_bytes: int, max_disk_bytes: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = ResultCache(max_bytes)
+        self.disk_hits = 0
+        self.disk_error = None
+        self._db = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request: QueryPilotRequest) -> str:
+        def digest(text: str) -> str:
+            return hashlib.sha256(text.encode("utf-8")).hexdigest()
+        parts = [request.model, digest(request.system_prompt), digest(request.user_prompt), repr(request.temperature)]
+        return digest("\0".join(parts))
+
+    def _connection(self):
+        """The SQLite connection, opened on first use; None when the disk tier is off or failed."""
+        if self._db is None and self.path and self.disk_error is None:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_responses (
+                        key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER,
+                        created_at REAL, expires_at REAL, last_used REAL)
+                """)
+                db.execute("CREATE INDEX IF NOT EXISTS llm_responses_last_used ON llm_responses (last_used)")
+                db.commit()
+                self._db = db
+            except sqlite3.Error as e:
+                self.disk_error = str(e)
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        """Blocking (SQLite on a memory miss); the cached answer or None."""
+        response = self.memory.get(key)
+        if response is not None:
+            return response
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return None
+            now = time.time()
+            row = db.execute("SELECT response, expires_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE llm_responses SET last_used = ? WHERE key = ?", (now, key))
+            db.commit()
+            self.disk_hits += 1
+        # Promote to the memory tier for the rest of its lifetime
+        self.memory.put(key, row[0], len(row[0].encode("utf-8")), row[1] - now)
+        return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        """Blocking; store an answer in both tiers, then trim the file to its budget."""
+        if self.ttl <= 0:
+            return
+        size = len(response.encode("utf-8"))
+        self.memory.put(key, response, size, self.ttl)
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return
+            now = time.time()
+            db.execute("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (key, model, response, size, now, now + self.ttl, now))
+            db.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+            if total > self.max_disk_bytes:
+                # Least recently used first, until the rest fits
+                evicted = []
+                for old_key, old_size in db.execute("SELECT key, size FROM llm_responses ORDER BY last_used"):
+                    if total <= self.max_disk_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= old_size
+                db.executemany("DELETE FROM llm_responses WHERE key = ?", evicted)
+            db.commit()
+
+    def clear(self) -> int:
+        cleared = self.memory.clear()
+        with self._lock:
+            db = self._connection()
+            if db is not None:
+                cleared = max(cleared, db.execute("DELETE FROM llm_responses").rowcount)
+                db.commit()
+        return cleared
+
+    def stats(self):
+        disk = {"path": self.path or None, "hits": self.disk_hits, "error": self.disk_error}
+        with self._lock:
+            db = self._connection()
+            if db is not None:
+                entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+                disk.update(entries=entries, bytes=size, max_bytes=self.max_disk_bytes)
+        return {"memory": self.memory.stats(), "disk": disk, "ttl": self.ttl}
+
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_DISK_BYTES)
+
+class LLMError(Exception):
+    """Ollama answered with an error status or an error object."""
+
+class OllamaClient:
+    """
+    One pooled httpx.AsyncClient for the Ollama API, so /api/query-pilot reuses keep-alive
+    connections and never blocks the event loop while a completion is generated.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                # The read timeout applies per chunk, so long generations are fine while tokens keep coming
+                timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                                    max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    async def generate(self, payload: Dict[str, Any]) -> str:
+        """The whole completion for a non-streaming /api/generate payload."""
+        response = await self._http().post("/api/generate", json={**payload, "stream": False})
+        if response.status_code != 200:
+            raise LLMError(f"LLM API Error {response.status_code}: {response.text}")
+        data = response.json()
+        if data.get("error"):
+            raise LLMError(f"LLM API Error: {data['error']}")
+        return data.get("response", "")
+
+    async def stream(self, payload: Dict[str, Any]):
+        """
+        Yield the completion's tokens as Ollama generates them. Closing the generator early
+        closes the connection, which makes Ollama stop generating.
+        """
+        async with self._http().stream("POST", "/api/generate", json={**payload, "stream": True}) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise LLMError(f"LLM API Error {response.status_code}: {body}")
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise LLMError(f"LLM API Error: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    return
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+ollama = OllamaClient(OLLAMA_URL)
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    await ollama.close()
+
+def ollama_payload(request: QueryPilotRequest) -> Dict[str, Any]:
+    return {
+        "model": request.model,
+        "prompt": f"{request.system_prompt}\n\n{request.user_prompt}",
+        "options": {
+            "temperature": request.temperature
+        }
+    }
 
 @app.post("/api/query-pilot")
 async def query_pilot(request: QueryPilotRequest):
     """
     Endpoint for AI SQL generation / fixing.
-    Calls local Ollama API.
+    Calls local Ollama API and returns the whole completion; see /api/query-pilot/stream
+    for the tokens as they are generated. Answers are cached (see LLMResponseCache) unless
+    bypassCache is set; "cached" says whether this one came from the cache.
     """
     try:
-        import urllib.request
-        import urllib.error
-        import json
-        
-        # Assuming Ollama is running on default port 11434
-        ollama_url = "http://localhost:11434/api/generate"
-        
-        payload = {
-            "model": request.model,
-            "prompt": f"{request.system_prompt}\n\n{request.user_prompt}",
-            "stream": False,
-            "options": {
-                "temperature": 0.1
-            }
-        }
-        
-        req = urllib.request.Request(ollama_url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
-        with urllib.request.urlopen(req, timeout=60.0) as response:
-            data = json.loads(response.read().decode())
-            return {"success": True, "sql": data.get("response", "")}
-            
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode()
-        raise HTTPException(status_code=500, detail=f"LLM API Error {e.code}: {error_body}")
+        key = LLMResponseCache.key(request)
+        if not request.bypassCache:
+            cached = await asyncio.to_thread(llm_cache.get, key)
+            if cached is not None:
+                return {"success": True, "sql": cached, "cached": True}
+        sql = await ollama.generate(ollama_payload(request))
+        if sql.strip():
+            # An empty answer is worth retrying, not repeating
+            await asyncio.to_thread(llm_cache.put, key, request.model, sql)
+        return {"success": True, "sql": sql, "cached": False}
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM Error: {str(e)}")
+
+@app.post("/api/query-pilot/stream")
+async def query_pilot_stream(request: QueryPilotRequest):
+    """
+    /api/query-pilot as server-sent events: an `event: token` ({"text": ...}) per generated
+    chunk, then `event: result` with the same body as /api/query-pilot, or `event: error`.
+    A cached answer arrives as a single token. If the client disconnects, the request to
+    Ollama is closed and the generation stops (and nothing is cached).
+    """
+    async def events():
+        key = LLMResponseCache.key(request)
+        if not request.bypassCache:
+            cached = await asyncio.to_thread(llm_cache.get, key)
+            if cached is not None:
+                yield f"event: token\ndata: {json.dumps({'text': cached})}\n\n"
+                yield f"event: result\ndata: {json.dumps({'success': True, 'sql': cached, 'cached': True})}\n\n"
+                return
+        tokens = []
+        try:
+            async for token in ollama.stream(ollama_payload(request)):
+                tokens.append(token)
+                yield f"event: token\ndata: {json.dumps({'text': token})}\n\n"
+        except LLMError as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': f'LLM Error: {str(e)}'})}\n\n"
+            return
+        sql = "".join(tokens)
+        if sql.strip():
+            await asyncio.to_thread(llm_cache.put, key, request.model, sql)
+        yield f"event: result\ndata: {json.dumps({'success': True, 'sql': sql, 'cached': False})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
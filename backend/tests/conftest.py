@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend is a single module; make it importable as `main`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
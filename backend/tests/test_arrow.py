@@ -0,0 +1,105 @@
+import decimal
+import json
+
+import pytest
+
+import main
+
+pa = pytest.importorskip("pyarrow")
+
+
+def read_streams(data):
+    """Every IPC stream in the body, with the custom metadata of the last batch."""
+    source = pa.BufferReader(data)
+    tables, metadata = [], None
+    while source.tell() < source.size():
+        reader = pa.ipc.open_stream(source)
+        batches = []
+        while True:
+            try:
+                batch, metadata = reader.read_next_batch_with_custom_metadata()
+            except StopIteration:
+                break
+            batches.append(batch)
+        tables.append(pa.Table.from_batches(batches, schema=reader.schema))
+    return tables, metadata
+
+
+def encode(batches, columns):
+    encoder = main.ArrowStreamEncoder('none')
+    encoder.set_columns(columns)
+    data = b"".join(encoder.add([tuple(row.get(column) for column in columns) for row in batch]) for batch in batches)
+    return data + encoder.finish(), encoder
+
+
+def test_columns_keep_native_types_and_nested_values_are_json():
+    data, encoder = encode([[{"id": 1, "price": decimal.Decimal("9.50"), "doc": {"a": [1, 2]}, "note": None}],
+                            [{"id": 2, "price": decimal.Decimal("1234.25"), "doc": [1], "note": None}]],
+                           ["id", "price", "doc", "note"])
+    (table,), metadata = read_streams(data)
+    assert encoder.streams == 1
+    assert table.schema.field("id").type == pa.int64()
+    assert table.schema.field("price").type == pa.decimal128(38, 2)
+    assert table.schema.field("note").type == pa.null()
+    assert [json.loads(value) for value in table.column("doc").to_pylist()] == [{"a": [1, 2]}, [1]]
+    assert table.column("price").to_pylist() == [decimal.Decimal("9.50"), decimal.Decimal("1234.25")]
+    assert metadata[b"rowCount"] == b"2" and metadata[b"truncatedBy"] == b""
+
+
+def test_new_columns_and_mixed_types_start_a_new_stream():
+    encoder = main.ArrowStreamEncoder('none')
+    encoder.set_columns(["a"])
+    data = encoder.add([(1,)])
+    encoder.set_columns(["a", "b"])
+    data += encoder.add([(2.5, "x")])
+    data += encoder.add([("three", "y")])
+    data += encoder.finish("maxRows")
+    tables, metadata = read_streams(data)
+    assert [table.schema.field("a").type for table in tables] == [pa.int64(), pa.float64(), pa.string()]
+    assert [table.to_pylist() for table in tables] == [[{"a": 1}], [{"a": 2.5, "b": "x"}], [{"a": "three", "b": "y"}]]
+    assert metadata[b"rowCount"] == b"3" and metadata[b"truncatedBy"] == b"maxRows"
+
+
+def test_empty_result_is_a_valid_stream():
+    data, _ = encode([], ["id"])
+    (table,), metadata = read_streams(data)
+    assert table.num_rows == 0 and table.column_names == ["id"]
+    assert metadata[b"rowCount"] == b"0"
+
+
+def fake_producer(total):
+    def produce(request, batch_size, execution=None, convert=main.json_value, timeout_ms=None):
+        yield "columns", ["n"]
+        for start in range(0, total, batch_size):
+            numbers = range(start, min(start + batch_size, total))
+            yield "rows", [(n if convert is None else convert(n),) for n in numbers]
+    return produce
+
+
+@pytest.mark.parametrize("total, streamed", [(3, False), (25, True)])
+def test_execute_query_arrow_answers_small_results_whole_and_streams_large_ones(monkeypatch, total, streamed):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "ARROW_BATCH_SIZE", 10)
+    monkeypatch.setitem(main.STREAM_PRODUCERS, "mysql", fake_producer(total))
+    body = {"db_type": "mysql", "host": "db", "port": 3306, "user": "app", "password": "secret",
+            "database": "shop", "query": "SELECT n FROM numbers", "format": "arrow", "bypassCache": True}
+    response = TestClient(main.app).post("/api/execute-query", json=body)
+    assert response.headers["content-type"] == main.ARROW_MEDIA_TYPE
+    assert ("x-row-count" not in response.headers) == streamed
+    tables, metadata = read_streams(response.content)
+    assert pa.concat_tables(tables).column("n").to_pylist() == list(range(total))
+    assert metadata[b"rowCount"] == str(total).encode()
+
+
+def test_driver_values_are_converted_only_where_arrow_cant_take_them():
+    import uuid
+
+    key = uuid.UUID(int=1)
+    data, _ = encode([[{"id": key, "blob": b"\x00", "doc": {"a": 1}, "tags": ["x"]}],
+                      [{"id": key, "blob": None, "doc": "plain", "tags": None}]], ["id", "blob", "doc", "tags"])
+    tables, _ = read_streams(data)
+    assert tables[0].schema.field("id").type == pa.string()
+    assert tables[0].schema.field("blob").type == pa.binary()
+    assert tables[0].to_pylist()[0] == {"id": str(key), "blob": b"\x00", "doc": '{"a": 1}', "tags": '["x"]'}
+    assert tables[-1].to_pylist()[-1]["doc"] == "plain"
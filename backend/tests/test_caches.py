@@ -0,0 +1,89 @@
+import main
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_result_cache_evicts_least_recently_used_past_its_budget():
+    cache = main.ResultCache(max_bytes=30)
+    cache.put("a", 1, 10, 60)
+    cache.put("b", 2, 10, 60)
+    cache.put("c", 3, 10, 60)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("d", 4, 10, 60)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == [1, 3, 4]
+    assert cache.stats()["evicted"] == 1 and cache.stats()["bytes"] == 30
+
+
+def test_result_cache_rejects_oversized_and_ttl_less_entries():
+    cache = main.ResultCache(max_bytes=30)
+    assert cache.put("big", 1, 31, 60) is False
+    assert cache.put("now", 1, 1, 0) is False
+    assert cache.stats()["rejected"] == 2 and cache.stats()["entries"] == 0
+
+
+def test_result_cache_expires_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    cache = main.ResultCache(max_bytes=100)
+    cache.put("a", 1, 10, 5)
+    clock.now += 4
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1 and cache.stats()["bytes"] == 0
+
+
+def test_result_cache_pop_and_clear():
+    cache = main.ResultCache(max_bytes=100)
+    cache.put("a", 1, 10, 60)
+    cache.put("b", 2, 10, 60)
+    assert cache.pop("a") == 1 and cache.pop("a") is None
+    assert cache.clear() == 1 and cache.stats()["bytes"] == 0
+
+
+def test_llm_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "llm.sqlite3")
+    main.LLMResponseCache(path, 60, 1024, 1024).put("k", "llama3.2", "SELECT 1")
+    restarted = main.LLMResponseCache(path, 60, 1024, 1024)
+    assert restarted.get("k") == "SELECT 1"
+    assert restarted.disk_hits == 1
+    assert restarted.get("k") == "SELECT 1"
+    assert restarted.disk_hits == 1  # promoted to the memory tier
+
+
+def test_llm_cache_expires_answers_in_both_tiers(tmp_path, monkeypatch):
+    clock, wall = Clock(), Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    monkeypatch.setattr(main.time, "time", wall)
+    cache = main.LLMResponseCache(str(tmp_path / "llm.sqlite3"), 60, 1024, 1024)
+    cache.put("k", "llama3.2", "SELECT 1")
+    clock.now += 61
+    wall.now += 61
+    assert cache.get("k") is None
+
+
+def test_llm_cache_keeps_the_file_within_its_budget(tmp_path, monkeypatch):
+    wall = Clock()
+    monkeypatch.setattr(main.time, "time", wall)
+    path = str(tmp_path / "llm.sqlite3")
+    cache = main.LLMResponseCache(path, 60, 1024, 20)
+    for key in "abc":
+        cache.put(key, "llama3.2", "x" * 8)
+        wall.now += 1
+    restarted = main.LLMResponseCache(path, 60, 1024, 20)
+    assert [restarted.get(key) for key in "abc"] == [None, "x" * 8, "x" * 8]
+
+
+def test_llm_cache_key_depends_on_every_input():
+    request = main.QueryPilotRequest(system_prompt="s", user_prompt="u")
+    key = main.LLMResponseCache.key(request)
+    assert key == main.LLMResponseCache.key(main.QueryPilotRequest(system_prompt="s", user_prompt="u"))
+    for change in ({"user_prompt": "v"}, {"system_prompt": "t"}, {"model": "other"}, {"temperature": 0.7}):
+        assert main.LLMResponseCache.key(request.model_copy(update=change)) != key
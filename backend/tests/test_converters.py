@@ -0,0 +1,66 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("value, expected", [
+    (decimal.Decimal("1.10"), "1.10"),
+    (datetime.datetime(2024, 1, 2, 3, 4, 5), "2024-01-02T03:04:05"),
+    (datetime.date(2024, 1, 2), "2024-01-02"),
+    (datetime.time(1, 2), "01:02:00"),
+    (datetime.timedelta(hours=-1, seconds=5), "-00:59:55"),
+    (b"\x00\xff", "AP8="),
+    (uuid.UUID(int=1), "00000000-0000-0000-0000-000000000001"),
+    ({"k": decimal.Decimal("2"), "when": datetime.date(2024, 1, 2)}, {"k": "2", "when": "2024-01-02"}),
+    ([1, (2, b"\x01")], [1, [2, "AQ=="]]),
+    (None, None),
+])
+def test_json_value(value, expected):
+    assert main.json_value(value) == expected
+
+
+def test_epoch_temporal_format(monkeypatch):
+    monkeypatch.setattr(main, "TEMPORAL_FORMAT", "epoch")
+    assert main.convert_temporal(datetime.datetime(1970, 1, 1, 0, 0, 1)) == 1000
+    assert main.convert_temporal(datetime.timedelta(seconds=1.5)) == 1500
+
+
+def test_convert_json_parses_documents_and_keeps_other_text():
+    assert main.convert_json('{"a": [1]}') == {"a": [1]}
+    assert main.convert_json("not json") == "not json"
+
+
+def test_column_converters_use_cursor_types_and_infer_the_rest():
+    columns = main.ResultColumns(["price", "n", "doc"], ["decimal", None, None])
+    types, converters = main.column_converters(columns, [(decimal.Decimal("1.5"), 2, {"a": 1})])
+    assert types == ["decimal", "integer", "json"]
+    assert converters[0] is main.convert_decimal
+
+
+def test_encode_result_converts_every_format():
+    columns = main.ResultColumns(["price", "day"], ["decimal", "date"])
+    rows = [(decimal.Decimal("9.50"), datetime.date(2024, 1, 2)), (None, None)]
+    assert main.encode_result(columns, rows, "rows") == {
+        "columns": ["price", "day"], "columnTypes": ["decimal", "date"],
+        "rows": [{"price": "9.50", "day": "2024-01-02"}, {"price": None, "day": None}]}
+    assert main.encode_result(columns, rows, "arrays")["data"] == [["9.50", "2024-01-02"], [None, None]]
+    columnar = main.encode_result(columns, rows, "columnar")
+    assert columnar["format"] == "columnar" and columnar["columnTypes"] == ["decimal", "date"]
+
+
+def test_document_flattener_expands_sub_documents_up_to_max_depth():
+    flattener = main.DocumentFlattener(1)
+    rows = [flattener.flatten({"_id": 1, "a": {"b": 1, "c": {"d": 2}}, "tags": [1]}),
+            flattener.flatten({"_id": 2, "z": True})]
+    assert flattener.columns == ["_id", "a.b", "a.c", "tags", "z"]
+    assert flattener.pad(rows) == [[1, 1, {"d": 2}, [1], None], [2, None, None, None, True]]
+
+
+def test_document_flattener_depth_zero_keeps_documents_whole():
+    flattener = main.DocumentFlattener(0)
+    assert flattener.flatten({"a": {"b": 1}}) == [{"b": 1}]
+    assert flattener.columns == ["a"]
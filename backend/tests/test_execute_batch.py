@@ -0,0 +1,20 @@
+import json
+
+import main
+
+
+def test_a_unit_that_breaks_still_reports_every_statement(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    def broken(request):
+        raise RuntimeError("tokenizer failed")
+
+    monkeypatch.setattr(main, "apply_row_limit", broken)
+    body = {"db_type": "mongodb", "database": "shop", "connectionString": "mongodb://db", "sequential": True,
+            "statements": [{"query": '{"collection": "orders"}', "id": "a"},
+                           {"query": '{"collection": "users"}', "id": "b"}]}
+    response = TestClient(main.app).post("/api/execute-batch", json=body)
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [(event["type"], event.get("id"), event.get("success")) for event in events] == [
+        ("result", "a", False), ("result", "b", False), ("end", None, None)]
+    assert events[0]["error"] == "Error: tokenizer failed"
@@ -0,0 +1,107 @@
+import csv
+import decimal
+import io
+import json
+
+import pytest
+
+import main
+
+DOCUMENT = {"_id": 1, "address": {"city": "Oslo", "zip": decimal.Decimal("0150")}, "tags": ["a", "b"]}
+
+
+def export_events(fmt):
+    convert = main.EXPORT_CONVERTERS[fmt]
+    columns = list(DOCUMENT)
+    yield "columns", columns
+    yield "rows", [tuple(convert(DOCUMENT[column]) for column in columns)]
+
+
+def test_csv_export_writes_nested_values_as_json():
+    text = b"".join(main.csv_export_chunks(export_events("csv"))).decode("utf-8")
+    header, row = list(csv.reader(io.StringIO(text)))
+    assert header == ["_id", "address", "tags"]
+    assert row[0] == "1"
+    assert json.loads(row[1]) == {"city": "Oslo", "zip": "150"}
+    assert json.loads(row[2]) == ["a", "b"]
+
+
+def test_jsonl_export_keeps_nested_values_structured():
+    text = b"".join(main.jsonl_export_chunks(export_events("jsonl"))).decode("utf-8")
+    assert json.loads(text) == {"_id": 1, "address": {"city": "Oslo", "zip": "150"}, "tags": ["a", "b"]}
+
+
+def test_parquet_export_writes_nested_values_as_json():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = b"".join(main.parquet_export_chunks(export_events("parquet"), "snappy"))
+    row = pq.read_table(io.BytesIO(data)).to_pylist()[0]
+    assert row["_id"] == 1
+    assert json.loads(row["address"]) == {"city": "Oslo", "zip": "150"}
+    assert json.loads(row["tags"]) == ["a", "b"]
+
+
+def test_stored_result_export_applies_converter():
+    stored = main.StoredResult(["doc"], [[{"a": [1, 2]}]])
+    events = list(main.stored_result_events(stored, 10, main.EXPORT_CONVERTERS["csv"]))
+    assert events[1] == ("rows", [('{"a": [1, 2]}',)])
+
+
+def test_csv_export_writes_one_header_and_empty_nulls():
+    events = [("columns", ["a", "b"]), ("rows", [(1, None)]),
+              ("columns", ["a", "b"]), ("rows", [("x,y", 2)])]
+    text = b"".join(main.csv_export_chunks(iter(events))).decode("utf-8")
+    assert text == 'a,b\n1,\n"x,y",2\n'
+
+
+def test_jsonl_export_writes_one_object_per_row():
+    events = [("columns", ["a"]), ("rows", [(1,), (None,)]), ("rows", [])]
+    text = b"".join(main.jsonl_export_chunks(iter(events))).decode("utf-8")
+    assert [json.loads(line) for line in text.splitlines()] == [{"a": 1}, {"a": None}]
+
+
+def parquet_rows(events):
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(io.BytesIO(b"".join(main.parquet_export_chunks(iter(events), "snappy"))))
+    return table.schema, table.to_pylist()
+
+
+def test_parquet_export_widens_types_seen_in_later_batches():
+    pa = pytest.importorskip("pyarrow")
+    schema, rows = parquet_rows([("columns", ["n", "late", "price"]),
+                                 ("rows", [(1, None, decimal.Decimal("1.5"))]),
+                                 ("rows", [(1.5, 7, decimal.Decimal("2.25"))])])
+    assert [field.type for field in schema] == [pa.float64(), pa.int64(), pa.decimal128(38, 2)]
+    assert rows == [{"n": 1.0, "late": None, "price": decimal.Decimal("1.50")},
+                    {"n": 1.5, "late": 7, "price": decimal.Decimal("2.25")}]
+
+
+def test_parquet_export_keeps_fields_that_show_up_later():
+    schema, rows = parquet_rows([("columns", ["_id"]), ("rows", [(1,)]),
+                                 ("columns", ["_id", "extra"]), ("rows", [(2, "x")])])
+    assert schema.names == ["_id", "extra"]
+    assert rows == [{"_id": 1, "extra": None}, {"_id": 2, "extra": "x"}]
+
+
+def test_parquet_export_sends_nothing_when_the_query_fails():
+    pytest.importorskip("pyarrow")
+
+    def failing():
+        yield "columns", ["n"]
+        yield "rows", [(1,)]
+        raise RuntimeError("connection lost")
+
+    chunks = main.parquet_export_chunks(failing(), "snappy")
+    with pytest.raises(RuntimeError):
+        next(chunks)
+
+
+def test_spooled_csv_export_names_fields_from_later_documents():
+    events = [("columns", ["_id"]), ("rows", [(1,)]), ("columns", ["_id", "extra"]), ("rows", [(2, "x")])]
+    text = b"".join(main.csv_export_chunks(main.spooled_events(iter(events)))).decode("utf-8")
+    assert text == "_id,extra\n1,\n2,x\n"
+
+
+def test_csv_export_rejects_columns_after_the_header():
+    events = [("columns", ["_id"]), ("rows", [(1,)]), ("columns", ["_id", "extra"]), ("rows", [(2, "x")])]
+    with pytest.raises(ValueError):
+        b"".join(main.csv_export_chunks(iter(events)))
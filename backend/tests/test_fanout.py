@@ -0,0 +1,31 @@
+import pytest
+
+import main
+
+
+def fanout_request(query):
+    return main.QueryRequest(db_type="postgresql", host="db", port=5432, user="app", password="secret",
+                             database="shop", query=query)
+
+
+def test_aggregates_are_read_from_the_select_list():
+    request = fanout_request("SELECT region, SUM(amount) AS total, COUNT(*) orders, MAX(day) "
+                             "FROM sales GROUP BY region")
+    aggregates = main.infer_fanout_aggregates(request, ["region", "total", "orders", "max"], ["region"])
+    assert aggregates == {"total": "sum", "orders": "count", "max": "max"}
+    results = [("a", ["region", "total", "orders", "max"], [("eu", 10, 2, 5)]),
+               ("b", ["region", "total", "orders", "max"], [("eu", 5, 1, 7)])]
+    assert main.merge_fanout_results(results, "aggregate", ["region"], aggregates) == (
+        ["region", "total", "orders", "max"], [("eu", 15, 3, 7)])
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT region, AVG(amount) FROM sales GROUP BY region",
+    "SELECT region, COUNT(DISTINCT customer) FROM sales GROUP BY region",
+    "SELECT region, SUM(amount) / 100 FROM sales GROUP BY region",
+    "SELECT region, note FROM sales",
+    "SELECT * FROM sales",
+])
+def test_columns_that_cant_be_recombined_are_refused(query):
+    with pytest.raises(ValueError):
+        main.infer_fanout_aggregates(fanout_request(query), ["region", "value"], ["region"])
@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+
+import main
+
+
+class FakeDatabase:
+    def __init__(self, name, collections, delay=0.0):
+        self.name = name
+        self.collections = collections
+        self.delay = delay
+
+    def list_collection_names(self):
+        time.sleep(self.delay)
+        return self.collections
+
+    def command(self, name):
+        return {"indexes": len(self.collections), "objects": 10}
+
+    def __getitem__(self, name):
+        return (self.name, name)
+
+
+class FakeClient:
+    def __init__(self, databases):
+        self.databases = {database.name: database for database in databases}
+
+    def list_database_names(self):
+        return list(self.databases) + ["admin"]
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+
+def test_slow_collection_listing_returns_a_partial_schema(monkeypatch):
+    monkeypatch.setattr(main, "MONGO_SCHEMA_TOTAL_TIMEOUT", 0.2)
+    monkeypatch.setattr(main, "sample_collection_schema",
+                        lambda collection: {"columns": [{"name": "_id"}], "sampled": 1})
+    client = FakeClient([FakeDatabase("shop", ["orders"]), FakeDatabase("logs", ["events"], delay=1.0)])
+    tables = main.infer_mongodb_schema(client)
+    assert tables == [
+        {"name": "shop.orders", "columns": [{"name": "_id"}], "sampled": 1},
+        {"name": "logs", "columns": [], "sampled": 0, "timedOut": True},
+    ]
+
+
+def test_fingerprint_gives_up_at_the_deadline():
+    client = FakeClient([FakeDatabase("shop", ["orders"])])
+    assert main.mongodb_schema_fingerprint(client, time.monotonic() + 1) is not None
+    client.databases["logs"] = FakeDatabase("logs", [], delay=1.0)
+    started = time.monotonic()
+    assert main.mongodb_schema_fingerprint(client, started + 0.2) is None
+    assert time.monotonic() - started < 0.5
+
+
+def test_unknown_fingerprint_resamples(monkeypatch):
+    monkeypatch.setattr(main, "sample_collection_schema",
+                        lambda collection: {"columns": [{"name": "_id"}], "sampled": 1})
+
+    class Clients:
+        @contextmanager
+        def acquire(self, connection_string):
+            yield FakeClient([FakeDatabase("shop", ["orders"])])
+
+    monkeypatch.setattr(main, "mongo_clients", Clients())
+    monkeypatch.setattr(main, "mongodb_schema_fingerprint", lambda client, deadline: None)
+    request = main.SchemaRequest(db_type="mongodb", database="shop", connectionString="mongodb://db")
+    assert main.load_mongodb_schema(request, None)[1]["tables"] == [
+        {"name": "shop.orders", "columns": [{"name": "_id"}], "sampled": 1}]
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import main
+
+
+def make_request(host="db1", query_id=None):
+    return main.QueryRequest(db_type="mysql", host=host, port=3306, user="app", password="secret",
+                             database="shop", query="SELECT * FROM orders", queryId=query_id)
+
+
+def test_held_cursors_per_pool_are_limited_oldest_first():
+    registry = main.PageCursorRegistry(max_cursors=8, max_per_pool=2)
+    first, _ = registry.open("r1", make_request(), 100)
+    registry.open("r2", make_request(), 100)
+    other, evicted = registry.open("r3", make_request(host="db2"), 100)
+    assert evicted == []
+    _, evicted = registry.open("r4", make_request(), 100)
+    assert evicted == [first]
+    assert [cursor["resultId"] for cursor in registry.stats()["cursors"]] == ["r2", "r3", "r4"]
+    for result_id in ("r2", "r3", "r4"):
+        registry.remove(result_id).close()
+    first.close()
+
+
+def test_discarded_count_is_cancelled_and_unregistered():
+    async def scenario():
+        registry = main.RowCountRegistry()
+        execution = main.running_queries.start(make_request(query_id="r1:count"))
+        started, release = threading.Event(), threading.Event()
+
+        def count():
+            with execution.cancellable(release.set):
+                started.set()
+                release.wait(5)
+                execution.check()
+            return 42
+
+        registry.start("r1", asyncio.get_running_loop().run_in_executor(None, count), execution)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        assert main.running_queries.get("r1:count") is execution
+        registry.discard("r1")
+        await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+        assert execution.cancelled
+        assert main.running_queries.get("r1:count") is None
+        assert registry.status("r1") is None
+
+    asyncio.run(scenario())
+
+
+def test_finished_count_is_unregistered():
+    async def scenario():
+        registry = main.RowCountRegistry()
+        execution = main.running_queries.start(make_request(query_id="r2:count"))
+        registry.start("r2", asyncio.sleep(0, 7), execution)
+        assert (await registry.wait("r2", 1)) == {"status": "ready", "totalCount": 7}
+        await asyncio.sleep(0)
+        assert main.running_queries.get("r2:count") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("column_type", ["int", "bigint(20) unsigned", "numeric(12,2)", "double precision",
+                                         "date", "datetime", "datetime(6)", "timestamp without time zone"])
+def test_partitionable_key_types(column_type):
+    assert main.PARTITIONABLE_TYPE_PATTERN.match(column_type)
+
+
+@pytest.mark.parametrize("column_type", ["varchar(64)", "uuid", "text", "time"])
+def test_non_partitionable_key_types(column_type):
+    assert not main.PARTITIONABLE_TYPE_PATTERN.match(column_type)
+
+
+def test_datetime_boundaries_split_evenly():
+    low = datetime.datetime(2024, 1, 1)
+    assert main.partition_boundaries(low, datetime.datetime(2024, 1, 5), 4) == [
+        datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 3), datetime.datetime(2024, 1, 4)]
+
+
+def test_integer_boundaries_and_conditions_cover_every_row():
+    boundaries = main.partition_boundaries(1, 100, 4)
+    assert boundaries == [25, 50, 75]
+    assert main.partition_conditions("id", "mysql", boundaries) == [
+        "`id` < 25 OR `id` IS NULL", "`id` >= 25 AND `id` < 50", "`id` >= 50 AND `id` < 75", "`id` >= 75"]
+
+
+def test_narrow_ranges_get_fewer_partitions():
+    assert main.partition_boundaries(1, 3, 8) == [2]
+    assert main.partition_boundaries(5, 5, 4) == []
+    with pytest.raises(ValueError):
+        main.partition_boundaries("a", "z", 4)
+
+
+def test_date_boundaries_are_quoted_literals():
+    boundaries = main.partition_boundaries(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31), 3)
+    assert boundaries == [datetime.date(2024, 1, 11), datetime.date(2024, 1, 21)]
+    assert main.partition_conditions("day", "postgresql", boundaries)[1] == (
+        "\"day\" >= '2024-01-11' AND \"day\" < '2024-01-21'")
+
+
+def test_plain_scan_keeps_order_and_limit_per_partition_and_after_merge():
+    plan = main.ParallelScanPlan("SELECT id FROM t WHERE id > 0 ORDER BY id DESC LIMIT 3", "postgresql")
+    assert plan.bounds_sql("id") == 'SELECT MIN("id"), MAX("id") FROM t WHERE (id > 0)'
+    assert plan.partition_sql("id >= 2") == "SELECT id FROM t WHERE (id > 0) AND (id >= 2) ORDER BY id DESC LIMIT 3"
+    assert plan.merge([(["id"], [(1,), (2,)]), (["id"], [(3,), (4,)])]) == (["id"], [(4,), (3,), (2,)])
+
+
+def test_aggregates_are_recombined_across_partitions():
+    plan = main.ParallelScanPlan("SELECT region, COUNT(*) AS n, AVG(amount) AS avg_amount FROM sales "
+                                 "GROUP BY region ORDER BY n DESC LIMIT 2", "mysql")
+    assert plan.partition_sql("`id` < 50") == (
+        "SELECT region, COUNT(*) AS n, SUM(amount) AS qp_avg_sum_2, COUNT(amount) AS qp_avg_count_2 "
+        "FROM sales WHERE (`id` < 50) GROUP BY region")
+    columns = ["region", "n", "qp_avg_sum_2", "qp_avg_count_2"]
+    merged = plan.merge([(columns, [("eu", 2, 10, 2), ("us", 1, 5, 1)]),
+                         (columns, [("eu", 1, 20, 1), ("apac", 4, 8, 4)])])
+    assert merged == (["region", "n", "avg_amount"], [("apac", 4, 2.0), ("eu", 3, 10.0)])
+
+
+@pytest.mark.parametrize("query", ["SELECT * FROM a JOIN b ON a.id = b.id", "SELECT DISTINCT a FROM t",
+                                   "SELECT * FROM t LIMIT 5 OFFSET 2", "UPDATE t SET a = 1"])
+def test_unsplittable_statements_are_refused(query):
+    with pytest.raises(ValueError):
+        main.ParallelScanPlan(query, "mysql")
+
+
+@pytest.mark.parametrize("query, types", [
+    ("SELECT name FROM t ORDER BY name", [None]),
+    ("SELECT MAX(name) AS top FROM t", ["string"]),
+    ("SELECT region, COUNT(*) FROM sales GROUP BY region", [None, "integer"]),
+])
+def test_string_comparisons_are_left_to_the_database(query, types):
+    plan = main.ParallelScanPlan(query, "mysql")
+    columns = main.ResultColumns([f"c{index}" for index in range(len(types))], types)
+    with pytest.raises(ValueError):
+        plan.check_comparable(columns)
+
+
+def test_numeric_and_temporal_comparisons_are_merged():
+    plan = main.ParallelScanPlan("SELECT day, MAX(amount), AVG(amount) AS a FROM sales GROUP BY day ORDER BY a",
+                                 "mysql")
+    plan.check_comparable(main.ResultColumns(["day", "MAX(amount)", "s", "c"],
+                                             ["date", "decimal", "decimal", "integer"]))
+    plan = main.ParallelScanPlan("SELECT region, COUNT(*) AS n FROM sales GROUP BY region ORDER BY n", "postgresql")
+    plan.check_comparable(main.ResultColumns(["region", "n"], ["string", "integer"]))
@@ -0,0 +1,39 @@
+import time
+
+import main
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(idle_timeout=60):
+    return main.ConnectionPool(("test",), FakeConnection, lambda connection, idle_for: True,
+                               lambda connection: None, min_size=1, max_size=4, idle_timeout=idle_timeout)
+
+
+def test_evict_idle_keeps_min_size_while_the_pool_is_in_use():
+    pool = make_pool(idle_timeout=0.05)
+    connections = [pool.acquire(), pool.acquire()]
+    for connection in connections:
+        pool.release(connection)
+    time.sleep(0.06)
+    pool.last_used = time.monotonic()
+    assert pool.evict_idle() == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_idle_pool_drains_and_is_dropped_from_the_registry():
+    registry = main.PoolRegistry(sweep_interval=3600)
+    pool = registry.get(("test",), lambda: make_pool(idle_timeout=0.05))
+    connection = pool.acquire()
+    pool.release(connection)
+    time.sleep(0.06)
+    registry.sweep()
+    assert connection.closed
+    assert pool.is_unused()
+    assert registry.stats() == []
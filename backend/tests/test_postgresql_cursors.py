@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+
+import pytest
+
+import main
+
+pytest.importorskip("psycopg2")
+
+
+class FakeCursor:
+    def __init__(self, name, description=None, rows=()):
+        self.name = name
+        self.description = description
+        self.executed = []
+        self._rows = list(rows)
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors = []
+        self.description = None
+        self.rows = []
+
+    def cursor(self, name=None, cursor_factory=None):
+        cursor = FakeCursor(name, self.description, self.rows) if name else FakeCursor(name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def cancel(self):
+        pass
+
+
+def make_request(query):
+    return main.QueryRequest(db_type="postgresql", host="db", port=5432, user="app", password="secret",
+                             database="shop", query=query)
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection()
+
+    @contextmanager
+    def pooled_connection(*args):
+        yield connection
+
+    monkeypatch.setattr(main, "pooled_connection", pooled_connection)
+    return connection
+
+
+def query_cursor(connection, query):
+    return next(cursor for cursor in connection.cursors if query in cursor.executed)
+
+
+@pytest.mark.parametrize("query, named", [
+    ("-- newest first\nSELECT * FROM orders ORDER BY id DESC", True),
+    ("SELECT * INTO TEMP snapshot FROM orders", False),
+])
+def test_stream_and_fetch_pick_the_same_cursor(connection, query, named):
+    list(main.stream_postgresql_rows(make_request(query), 100))
+    assert (query_cursor(connection, query).name is not None) == named
+    connection.cursors.clear()
+    main.fetch_postgresql_result(make_request(query))
+    assert (query_cursor(connection, query).name is not None) == named
+
+
+def test_stream_keeps_every_column_with_a_duplicate_name(connection):
+    connection.description = [("id", 23), ("id", 23), ("name", 25)]
+    connection.rows = [(1, 10, "a"), (2, 20, "b")]
+    query = "SELECT o.id, c.id, c.name FROM orders o JOIN customers c USING (customer_id)"
+    events = list(main.stream_postgresql_rows(make_request(query), 100))
+    assert events == [("columns", ["id", "id_2", "name"]), ("rows", [(1, 10, "a"), (2, 20, "b")])]
@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+
+class FakeOllama:
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    async def generate(self, payload):
+        self.calls += 1
+        return self.answer
+
+    async def stream(self, payload):
+        self.calls += 1
+        for token in self.answer.split(" "):
+            yield token
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "llm_cache", main.LLMResponseCache("", 60, 1024 * 1024, 0))
+    return TestClient(main.app)
+
+
+PROMPT = {"system_prompt": "You write SQL.", "user_prompt": "all orders"}
+
+
+@pytest.mark.parametrize("path", ["/api/query-pilot", "/api/query-pilot/stream"])
+def test_blank_answers_are_not_cached(monkeypatch, client, path):
+    ollama = FakeOllama("  ")
+    monkeypatch.setattr(main, "ollama", ollama)
+    client.post(path, json=PROMPT)
+    client.post(path, json=PROMPT)
+    assert ollama.calls == 2
+    assert main.llm_cache.get(main.LLMResponseCache.key(main.QueryPilotRequest(**PROMPT))) is None
+
+
+def test_answers_are_served_from_the_cache(monkeypatch, client):
+    ollama = FakeOllama("SELECT * FROM orders")
+    monkeypatch.setattr(main, "ollama", ollama)
+    assert client.post("/api/query-pilot", json=PROMPT).json()["cached"] is False
+    assert client.post("/api/query-pilot", json=PROMPT).json() == {
+        "success": True, "sql": "SELECT * FROM orders", "cached": True}
+    assert ollama.calls == 1
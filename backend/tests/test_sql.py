@@ -0,0 +1,117 @@
+import pytest
+
+import main
+
+
+def test_mysql_timeout_is_a_hint_on_the_top_level_select():
+    query = "-- report\nWITH a AS (SELECT 1) SELECT * FROM a"
+    assert main.mysql_timed_sql("8.0.36", query, 500) == (
+        "-- report\nWITH a AS (SELECT 1) SELECT /*+ MAX_EXECUTION_TIME(500) */ * FROM a")
+
+
+def test_mysql_timeout_joins_an_existing_hint():
+    assert main.mysql_timed_sql("8.0.36", "SELECT /*+ NO_ICP(t) */ * FROM t", 500) == (
+        "SELECT /*+ MAX_EXECUTION_TIME(500) NO_ICP(t) */ * FROM t")
+
+
+def test_mysql_timeout_leaves_other_statements_alone():
+    assert main.mysql_timed_sql("8.0.36", "UPDATE t SET a = 1", 500) == "UPDATE t SET a = 1"
+
+
+def test_mariadb_timeout_is_set_for_the_statement():
+    assert main.mysql_timed_sql("10.11.6-MariaDB", "SELECT 1", 1500) == (
+        "SET STATEMENT max_statement_time = 1.500 FOR SELECT 1")
+
+
+def cache_key(query, db_type="mysql"):
+    request = main.QueryRequest(db_type=db_type, host="db", port=3306, user="app", password="secret",
+                                database="shop", query=query)
+    return main.result_cache_key(request, "rows")
+
+
+def test_result_cache_key_normalizes_comments_and_whitespace():
+    assert cache_key("/* report */ SELECT  id\nFROM t;") == cache_key("SELECT id FROM t")
+    assert cache_key("-- weekly\nWITH a AS (SELECT 1) SELECT * FROM a") is not None
+
+
+def test_result_cache_key_skips_statements_that_must_not_be_cached():
+    for query in ["-- note\nDELETE FROM t",
+                  "SELECT id INTO @last FROM t",
+                  "SELECT * INTO OUTFILE '/tmp/t.csv' FROM t",
+                  "SELECT * FROM t FOR UPDATE",
+                  "SELECT * FROM t LOCK IN SHARE MODE",
+                  "SELECT NOW()",
+                  "SELECT id FROM t ORDER BY RAND()",
+                  "SELECT CURRENT_TIMESTAMP",
+                  "/*!50000 SELECT 1 */"]:
+        assert cache_key(query) is None, query
+    for query in ["SELECT nextval('ids')",
+                  "SELECT * INTO TEMP copy FROM t",
+                  "SELECT * FROM t FOR SHARE",
+                  "WITH gone AS (DELETE FROM t RETURNING *) SELECT * FROM gone"]:
+        assert cache_key(query, "postgresql") is None, query
+
+
+def test_result_cache_key_separates_connections_and_formats():
+    key = cache_key("SELECT 1")
+    assert key != cache_key("SELECT 1", "postgresql")
+    request = main.QueryRequest(db_type="mysql", host="db", port=3306, user="app", password="secret",
+                                database="shop", query="SELECT 1")
+    assert main.result_cache_key(request, "arrays") != key
+
+
+def test_postgresql_declarable_skips_comments():
+    assert main.postgresql_declarable("-- top customers\nSELECT * FROM customers;")
+    assert main.postgresql_declarable("/* a */ WITH a AS (SELECT 1) SELECT * FROM a")
+    assert main.postgresql_declarable("SELECT * FROM t FOR UPDATE")
+
+
+def test_postgresql_declarable_refuses_what_declare_cannot_run():
+    assert not main.postgresql_declarable("-- copy\nSELECT * INTO TEMP snapshot FROM t")
+    assert not main.postgresql_declarable("WITH gone AS (DELETE FROM t RETURNING *) SELECT * FROM gone")
+    assert not main.postgresql_declarable("SELECT 1; SELECT 2")
+    assert not main.postgresql_declarable("/* SELECT */ UPDATE t SET a = 1")
+
+
+def test_tokenize_sql_round_trips_and_classifies_tokens():
+    query = "SELECT 'it''s', `col` -- note\n/*+ BKA(t) */ 1.5 FROM t"
+    tokens = main.tokenize_sql(query, "mysql")
+    assert "".join(text for _, text in tokens) == query
+    assert [(kind, text) for kind, text in tokens if kind != "space"] == [
+        ("word", "SELECT"), ("string", "'it''s'"), ("symbol", ","), ("quoted", "`col`"),
+        ("comment", "-- note"), ("hint", "/*+ BKA(t) */"), ("number", "1.5"), ("word", "FROM"), ("word", "t")]
+
+
+def test_tokenize_sql_follows_postgresql_quoting():
+    tokens = main.tokenize_sql("SELECT $$a;b$$, E'\\'x', \"Name\" FROM t", "postgresql")
+    assert ("string", "$$a;b$$") in tokens
+    assert ("string", "'\\'x'") in tokens
+    assert ("quoted", '"Name"') in tokens
+    # MySQL only treats "--" followed by whitespace as a comment
+    assert ("comment", "--1") not in main.tokenize_sql("SELECT 1 --1", "mysql")
+    assert ("comment", "--1") in main.tokenize_sql("SELECT 1 --1", "postgresql")
+
+
+def test_normalize_sql_drops_comments_whitespace_and_semicolons():
+    assert main.normalize_sql("  SELECT  a, -- why\n 'x  y'  FROM t ;; ") == "SELECT a, 'x  y' FROM t"
+
+
+@pytest.mark.parametrize("query, dialect, expected", [
+    ("SELECT * FROM t", "mysql", "SELECT * FROM t LIMIT 100"),
+    ("SELECT * FROM t LIMIT 500", "mysql", "SELECT * FROM t LIMIT 100"),
+    ("SELECT * FROM t LIMIT 5", "mysql", "SELECT * FROM t LIMIT 5"),
+    ("SELECT * FROM t LIMIT 10, 500", "mysql", "SELECT * FROM t LIMIT 10, 100"),
+    ("SELECT credit_limit FROM t", "mysql", "SELECT credit_limit FROM t LIMIT 100"),
+    ("SELECT * FROM t FOR UPDATE", "mysql", "SELECT * FROM t LIMIT 100 FOR UPDATE"),
+    ("WITH a AS (SELECT * FROM t LIMIT 900) SELECT * FROM a", "mysql",
+     "WITH a AS (SELECT * FROM t LIMIT 900) SELECT * FROM a LIMIT 100"),
+    ("SELECT * FROM t LIMIT ALL", "postgresql", "SELECT * FROM t LIMIT 100"),
+    ("SELECT * FROM t FETCH FIRST 500 ROWS ONLY", "postgresql", "SELECT * FROM t FETCH FIRST 100 ROWS ONLY"),
+])
+def test_push_down_sql_limit(query, dialect, expected):
+    assert main.push_down_sql_limit(query, dialect, 100) == expected
+
+
+@pytest.mark.parametrize("query", ["UPDATE t SET a = 1", "SELECT 1; SELECT 2", "SELECT * FROM t LIMIT %s"])
+def test_push_down_sql_limit_leaves_other_statements_alone(query):
+    assert main.push_down_sql_limit(query, "mysql", 100) == query
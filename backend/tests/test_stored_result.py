@@ -0,0 +1,43 @@
+import pytest
+
+import main
+
+pytest.importorskip("numpy")
+
+
+def make_result():
+    columns = main.ResultColumns(["name", "price", "qty"], ["string", "decimal", "integer"])
+    encoded = main.encode_result(
+        columns,
+        [["apple", main.decimal.Decimal("9.50"), 3],
+         ["pear", main.decimal.Decimal("10.25"), None],
+         ["plum", None, 12],
+         ["fig", main.decimal.Decimal("100"), 1]],
+        "arrays")
+    return main.StoredResult.from_encoded(encoded)
+
+
+def test_decimal_columns_sort_numerically_and_keep_their_text():
+    rows, count = make_result().view(None, {}, [("price", False)], 0, 10)
+    assert count == 4
+    assert [row[1] for row in rows] == ["9.50", "10.25", "100", None]
+
+
+def test_sort_descending_keeps_nulls_last():
+    rows, _ = make_result().view(None, {}, [("qty", True)], 0, 10)
+    assert [row[2] for row in rows] == [12, 3, 1, None]
+
+
+def test_filters_match_text_and_combine():
+    result = make_result()
+    rows, count = result.view("p", {}, [], 0, 10)
+    assert count == 3
+    assert [row[0] for row in rows] == ["apple", "pear", "plum"]
+    rows, count = result.view(None, {"price": "10", "name": "fi"}, [], 0, 10)
+    assert count == 1 and rows[0][0] == "fig"
+
+
+def test_view_windows_the_filtered_rows():
+    rows, count = make_result().view(None, {}, [("name", False)], 1, 2)
+    assert count == 4
+    assert [row[0] for row in rows] == ["fig", "pear"]
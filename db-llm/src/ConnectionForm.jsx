@@ -4,6 +4,7 @@ import { MdCastConnected } from "react-icons/md"
 import { LuEye, LuEyeOff } from "react-icons/lu";
 import './ConnectionForm.css'
 import ConnectionTestModal from './ConnectionTestModal'
+import { streamConnectionTest, mergeStep } from './connectionTest'
 
 // Validation rules for each database field
 const validationRules = {
@@ -269,19 +270,14 @@ function ConnectionForm({ database, onBack, onConnect }) {
                 const timeoutId = setTimeout(() => controller.abort(), 15000)
 
                 try {
-                    const response = await fetch(endpoint, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify(requestBody),
-                        signal: controller.signal
+                    // Steps stream in over SSE as the backend finishes them
+                    const data = await streamConnectionTest(endpoint, requestBody, {
+                        signal: controller.signal,
+                        onStep: (step) => setTestSteps(prev => mergeStep(prev, step))
                     })
 
                     clearTimeout(timeoutId)
 
-                    const data = await response.json()
-
                     setTestSteps(data.steps || [])
                     setTestSuccess(data.success)
                     setErrorMessage(data.error || data.message)
@@ -594,6 +590,7 @@ function ConnectionForm({ database, onBack, onConnect }) {
                 isOpen={showModal}
                 onClose={() => setShowModal(false)}
                 steps={testSteps}
+                isRunning={isTesting}
                 isSuccess={testSuccess}
                 errorMessage={errorMessage}
                 onRetry={handleRetry}
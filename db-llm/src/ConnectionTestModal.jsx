@@ -3,7 +3,7 @@ import { createPortal } from 'react-dom'
 import { Box, Button } from '@primer/react-brand'
 import './ConnectionTestModal.css'
 
-function ConnectionTestModal({ isOpen, onClose, steps, isSuccess, errorMessage, onRetry, onNavigateToWorkspace }) {
+function ConnectionTestModal({ isOpen, onClose, steps, isRunning = false, isSuccess, errorMessage, onRetry, onNavigateToWorkspace }) {
     const [visibleSteps, setVisibleSteps] = useState([])
     const [showResult, setShowResult] = useState(false)
 
@@ -18,8 +18,9 @@ function ConnectionTestModal({ isOpen, onClose, steps, isSuccess, errorMessage,
             setVisibleSteps([])
             setShowResult(false)
         } else {
-            // Reset first to ensure clean slate
-            setVisibleSteps([])
+            // Steps already shown are updated in place (streamed tests report each step twice:
+            // when it starts and when it settles); new steps cascade in below them
+            setVisibleSteps(prev => prev.map(shown => steps.find(step => step.id === shown.id) || shown))
             setShowResult(false)
 
             const timeouts = []
@@ -35,15 +36,17 @@ function ConnectionTestModal({ isOpen, onClose, steps, isSuccess, errorMessage,
                 timeouts.push(t)
             })
 
-            // Show result quickly after steps
-            const tResult = setTimeout(() => {
-                setShowResult(true)
-            }, steps.length * 50 + 100)
-            timeouts.push(tResult)
+            // Show result quickly after steps, once the test has finished
+            if (!isRunning) {
+                const tResult = setTimeout(() => {
+                    setShowResult(true)
+                }, steps.length * 50 + 100)
+                timeouts.push(tResult)
+            }
 
             return () => timeouts.forEach(clearTimeout)
         }
-    }, [isOpen, steps])
+    }, [isOpen, steps, isRunning])
 
     if (!isOpen) return null
 
@@ -6,6 +6,9 @@ import QueryCell from './QueryCell'
 import MarkdownCell from './MarkdownCell'
 import AIGeneratorButton from './AIGeneratorButton'
 import { RUN_OPTIONS, THEMES, FONT_FAMILIES } from './QueryEditor'
+import { decodeQueryResult } from './queryResults'
+import { newQueryId, cancelQuery } from './queryCancellation'
+import { executeBatch } from './executeBatch'
 import './NotebookView.css'
 import { RiColorFilterAiLine } from "react-icons/ri";
 
@@ -100,6 +103,8 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
     const cellRefs = useRef({})
     // Store abort controllers for each cell execution
     const abortControllersRef = useRef({})
+    // The in-flight /api/execute-batch request of Run All
+    const runAllControllerRef = useRef(null)
 
     // Click outside to close dropdowns
     useEffect(() => {
@@ -208,6 +213,7 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
         const controller = abortControllersRef.current[cellId]
         if (controller) {
             controller.abort()
+            cancelQuery(controller.queryId)
             delete abortControllersRef.current[cellId]
 
             // Update cell state to show cancellation clearly
@@ -223,24 +229,16 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
         // Cancel any existing execution for this cell
         if (abortControllersRef.current[cellId]) {
             abortControllersRef.current[cellId].abort()
+            cancelQuery(abortControllersRef.current[cellId].queryId)
         }
 
-        // Create new controller
+        // Create new controller; its query ID lets the backend stop the statement on cancel
         const controller = new AbortController()
+        controller.queryId = newQueryId()
         abortControllersRef.current[cellId] = controller
         const signal = controller.signal
 
-        let queryToExecute = query.trim()
-
-        // Append LIMIT if needed
-        if (selectedLimit.value !== -1) {
-            // Simple check to avoid double LIMIT
-            // Remove trailing semicolon
-            queryToExecute = queryToExecute.replace(/;\s*$/, '')
-            if (!queryToExecute.toLowerCase().includes('limit')) {
-                queryToExecute += ` LIMIT ${selectedLimit.value}`
-            }
-        }
+        const queryToExecute = query.trim()
 
         // Set executing state
         setCells(prev => prev.map(cell =>
@@ -260,7 +258,12 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
                     username: connectionDetails.username,
                     password: connectionDetails.password,
                     connectionString: connectionDetails.connectionString,
-                    db_type: database?.id || connectionDetails.db_type || 'mysql'
+                    db_type: database?.id || connectionDetails.db_type || 'mysql',
+                    format: 'columnar',
+                    keepResult: true,
+                    // The backend pushes the run limit into the statement (LIMIT / $limit)
+                    rowLimit: selectedLimit.value !== -1 ? selectedLimit.value : null,
+                    queryId: controller.queryId
                 }),
                 signal: signal // Pass the abort signal
             })
@@ -272,11 +275,7 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
                     cell.id === cellId
                         ? {
                             ...cell,
-                            results: {
-                                columns: data.columns,
-                                rows: data.rows,
-                                rowCount: data.rowCount
-                            },
+                            results: decodeQueryResult(data),
                             executionTime: data.executionTime,
                             lastRunAt: Date.now(),
                             error: null,
@@ -307,14 +306,13 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
         }
     }
 
-    const handleRunAll = () => {
+    const handleRunAll = async () => {
         // Get all SQL cells that need to be executed
         const cellsToExecute = cells.filter(cell => cell.type === 'sql' && cell.query && cell.query.trim())
 
         if (cellsToExecute.length === 0) return
 
-        // STEP 1: Set ALL cells to executing state in ONE batch update
-        // This prevents state update delays from blocking concurrent execution
+        // Set ALL cells to executing state in ONE batch update
         const cellIdsToExecute = cellsToExecute.map(c => c.id)
         setCells(prev => prev.map(cell =>
             cellIdsToExecute.includes(cell.id)
@@ -322,98 +320,86 @@ function NotebookView({ onExecuteQuery, schema, connectionDetails, database, onI
                 : cell
         ))
 
-        // STEP 2: Immediately fire ALL fetch requests concurrently
-        // All network requests start at the same time - no waiting!
-        const executionPromises = cellsToExecute.map(cell => {
-            // Cancel any existing execution for this cell
+        // Each cell keeps its own controller and query ID, so a single cell can still be cancelled
+        const controllers = cellsToExecute.map(cell => {
             if (abortControllersRef.current[cell.id]) {
                 abortControllersRef.current[cell.id].abort()
+                cancelQuery(abortControllersRef.current[cell.id].queryId)
             }
-
-            // Create new controller
             const controller = new AbortController()
+            controller.queryId = newQueryId()
             abortControllersRef.current[cell.id] = controller
-            const signal = controller.signal
+            return controller
+        })
 
-            let queryToExecute = cell.query.trim()
+        // A new Run All replaces the previous one
+        if (runAllControllerRef.current) runAllControllerRef.current.abort()
+        const runAllController = new AbortController()
+        runAllControllerRef.current = runAllController
 
-            // Append LIMIT if needed
-            if (selectedLimit.value !== -1) {
-                queryToExecute = queryToExecute.replace(/;\s*$/, '')
-                if (!queryToExecute.toLowerCase().includes('limit')) {
-                    queryToExecute += ` LIMIT ${selectedLimit.value}`
-                }
+        const finishCell = (index) => {
+            const cellId = cellsToExecute[index].id
+            if (abortControllersRef.current[cellId] === controllers[index]) {
+                delete abortControllersRef.current[cellId]
             }
+        }
 
-            // Fire the fetch request immediately - this is non-blocking!
-            console.log(`🚀 Starting execution for cell ${cell.id} at ${Date.now()}`)
-
-            return fetch('http://localhost:8000/api/execute-query', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    query: queryToExecute,
-                    host: connectionDetails.host,
-                    port: connectionDetails.port,
-                    database: connectionDetails.database,
-                    user: connectionDetails.user,
-                    username: connectionDetails.username,
-                    password: connectionDetails.password,
-                    connectionString: connectionDetails.connectionString,
-                    db_type: database?.id || connectionDetails.db_type || 'mysql'
-                }),
-                signal: signal
-            })
-                .then(response => response.json())
-                .then(data => {
-                    console.log(`✅ Cell ${cell.id} completed at ${Date.now()}`)
-                    // Update this specific cell with results
-                    if (data.success) {
-                        setCells(prev => prev.map(c =>
-                            c.id === cell.id
-                                ? {
-                                    ...c,
-                                    results: {
-                                        columns: data.columns,
-                                        rows: data.rows,
-                                        rowCount: data.rowCount
-                                    },
-                                    executionTime: data.executionTime,
-                                    lastRunAt: Date.now(),
-                                    error: null,
-                                    isExecuting: false
-                                }
-                                : c
-                        ))
-                    } else {
-                        setCells(prev => prev.map(c =>
-                            c.id === cell.id
-                                ? { ...c, results: null, error: data.error || 'Query execution failed', isExecuting: false }
-                                : c
-                        ))
-                    }
-                })
-                .catch(error => {
-                    if (error.name === 'AbortError') {
-                        console.log(`❌ Cell ${cell.id} execution aborted`)
-                        return null
-                    }
-                    console.error(`❌ Cell ${cell.id} failed:`, error)
-                    setCells(prev => prev.map(c =>
-                        c.id === cell.id
-                            ? { ...c, results: null, error: `Connection error: ${error.message}`, isExecuting: false }
-                            : c
-                    ))
-                })
-                .finally(() => {
-                    delete abortControllersRef.current[cell.id]
-                })
-        })
-
-        // Wait for all to complete (they're already running concurrently!)
-        Promise.all(executionPromises).then(() => {
-            console.log('🎉 All cell executions completed!')
-        })
+        // One request for the whole notebook; results stream back as each statement finishes
+        try {
+            await executeBatch({
+                statements: cellsToExecute.map((cell, index) => ({
+                    id: cell.id,
+                    query: cell.query.trim(),
+                    queryId: controllers[index].queryId
+                })),
+                host: connectionDetails.host,
+                port: connectionDetails.port,
+                database: connectionDetails.database,
+                user: connectionDetails.user,
+                username: connectionDetails.username,
+                password: connectionDetails.password,
+                connectionString: connectionDetails.connectionString,
+                db_type: database?.id || connectionDetails.db_type || 'mysql',
+                format: 'columnar',
+                keepResult: true,
+                // The backend pushes the run limit into each statement (LIMIT / $limit)
+                rowLimit: selectedLimit.value !== -1 ? selectedLimit.value : null
+            }, (data) => {
+                // Cancelled cells were already updated by handleCancelExecution
+                if (controllers[data.index].signal.aborted) return
+                finishCell(data.index)
+                setCells(prev => prev.map(c =>
+                    c.id === data.id
+                        ? data.success
+                            ? {
+                                ...c,
+                                results: decodeQueryResult(data),
+                                executionTime: data.executionTime,
+                                lastRunAt: Date.now(),
+                                error: null,
+                                isExecuting: false
+                            }
+                            : { ...c, results: null, error: data.error || 'Query execution failed', isExecuting: false }
+                        : c
+                ))
+            }, runAllController.signal)
+        } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('Run All aborted')
+                return
+            }
+            console.error('Run All failed:', error)
+            // Cells still waiting for a result get the error
+            const pending = cellsToExecute.filter((cell, index) => abortControllersRef.current[cell.id] === controllers[index])
+            cellsToExecute.forEach((cell, index) => finishCell(index))
+            setCells(prev => prev.map(c =>
+                pending.some(cell => cell.id === c.id)
+                    ? { ...c, results: null, error: `Connection error: ${error.message}`, isExecuting: false }
+                    : c
+            ))
+        } finally {
+            if (runAllControllerRef.current === runAllController) runAllControllerRef.current = null
+        }
     }
 
     const handleClearAll = () => {
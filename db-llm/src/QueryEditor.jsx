@@ -249,20 +249,11 @@ function QueryEditor({ onExecuteQuery, onCancelQuery, isExecuting, height = 250,
 
             if (!queryToExecute.trim()) return
 
-            let modifiedQuery = queryToExecute.trim()
-
-            // Remove trailing semicolon(s) and whitespace so LIMIT is appended correctly
-            modifiedQuery = modifiedQuery.replace(/;\s*$/, '')
-
-            // Add LIMIT if not already present and limit is specified
-            if (selectedLimit.value !== -1) {
-                if (!modifiedQuery.toLowerCase().includes('limit')) {
-                    modifiedQuery += ` LIMIT ${selectedLimit.value}`
-                }
-            }
+            const modifiedQuery = queryToExecute.trim()
 
+            // The run limit is applied by the backend, which rewrites the statement's own LIMIT
             console.log('Executing query:', modifiedQuery)
-            onExecuteQuery(modifiedQuery)
+            onExecuteQuery(modifiedQuery, selectedLimit.value !== -1 ? selectedLimit.value : null)
         }
     }
 
@@ -2,10 +2,9 @@ import { useState, useRef, useEffect } from 'react'
 import queryPilotLogo from './assets/query-pilot-logo.png'
 import BorderGlow from './BorderGlow'
 import { FaArrowCircleUp } from "react-icons/fa"
+import { streamQueryPilot } from './queryPilot'
 import './QueryPilot.css'
 
-const API_BASE = 'http://localhost:8000'
-
 /**
  * QueryPilot – AI-powered SQL assistant panel.
  *
@@ -21,7 +20,9 @@ function QueryPilot({ currentQuery, schema, onAccept, onClose }) {
     const [isLoading, setIsLoading] = useState(false)
     const [error, setError] = useState(null)
     const [diffLines, setDiffLines] = useState([])
+    const [streamedText, setStreamedText] = useState('')
     const textareaRef = useRef(null)
+    const abortRef = useRef(null)
 
     // Auto-focus the textarea
     useEffect(() => {
@@ -30,6 +31,9 @@ function QueryPilot({ currentQuery, schema, onAccept, onClose }) {
         }
     }, [])
 
+    // Closing the panel stops a generation that is still streaming
+    useEffect(() => () => abortRef.current?.abort(), [])
+
     // Build schema context string
     const buildSchemaContext = () => {
         if (!schema?.tables?.length) return ''
@@ -41,17 +45,18 @@ function QueryPilot({ currentQuery, schema, onAccept, onClose }) {
     }
 
     const callLLM = async (systemPrompt, userPrompt) => {
-        const response = await fetch(`${API_BASE}/api/query-pilot`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ system_prompt: systemPrompt, user_prompt: userPrompt })
-        })
-        if (!response.ok) {
-            const err = await response.json().catch(() => ({ detail: 'LLM request failed' }))
-            throw new Error(err.detail || 'LLM request failed')
+        abortRef.current?.abort()
+        const controller = new AbortController()
+        abortRef.current = controller
+        setStreamedText('')
+        try {
+            return await streamQueryPilot(
+                { system_prompt: systemPrompt, user_prompt: userPrompt },
+                { signal: controller.signal, onToken: text => setStreamedText(prev => prev + text) }
+            )
+        } finally {
+            if (abortRef.current === controller) abortRef.current = null
         }
-        const data = await response.json()
-        return data.sql
     }
 
     const extractSQL = (text) => {
@@ -100,7 +105,7 @@ function QueryPilot({ currentQuery, schema, onAccept, onClose }) {
     }
 
     const handleRun = async () => {
-        if (!prompt.trim()) return
+        if (!prompt.trim() || isLoading) return
         setError(null)
         setIsLoading(true)
         setSuggestion(null)
@@ -130,9 +135,11 @@ ${hasQuery ? `\nCURRENT SQL IN EDITOR:\n${currentQuery}` : ''}`
             setSuggestion(sql)
             setDiffLines(computeDiff(currentQuery || '', sql))
         } catch (e) {
+            if (e.name === 'AbortError') return
             setError(e.message)
         } finally {
             setIsLoading(false)
+            setStreamedText('')
         }
     }
 
@@ -276,8 +283,18 @@ ${hasQuery ? `\nCURRENT SQL IN EDITOR:\n${currentQuery}` : ''}`
                 </div>
             )}
 
+            {/* Tokens as they stream in */}
+            {isLoading && !suggestion && streamedText && (
+                <div className="qp-stream">
+                    <pre className="qp-stream-text">{streamedText}</pre>
+                    <div className="qp-skeleton-label">
+                        <span className="qp-spinner" /> Llama 3.2 is writing…
+                    </div>
+                </div>
+            )}
+
             {/* Loading skeleton */}
-            {isLoading && !suggestion && (
+            {isLoading && !suggestion && !streamedText && (
                 <div className="qp-skeleton">
                     <div className="qp-skeleton-bar" style={{ width: '80%' }} />
                     <div className="qp-skeleton-bar" style={{ width: '60%' }} />
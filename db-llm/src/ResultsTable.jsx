@@ -20,6 +20,8 @@ import {
 } from '@primer/octicons-react'
 import { MdFullscreen, MdFullscreenExit, MdOutlineContentCopy } from "react-icons/md"
 import TableSettings from './TableSettings'
+import { cellText, fetchResultView } from './queryResults'
+import { EXPORT_OPTIONS } from './exportQuery'
 import './ResultsTable.css'
 
 const DEFAULT_SETTINGS = {
@@ -37,13 +39,58 @@ const DEFAULT_SETTINGS = {
     showRowNumbers: true,
 }
 
+// Results this large are filtered, sorted and paged by the backend instead of in the browser
+const SERVER_VIEW_MIN_ROWS = 10000
+
+function filterAndSortRows(rows, globalFilter, columnFilters, sortConfig) {
+    // Apply global filter
+    let filteredRows = rows.filter(row => {
+        if (!globalFilter) return true
+        return Object.values(row).some(value =>
+            cellText(value).toLowerCase().includes(globalFilter.toLowerCase())
+        )
+    })
+
+    // Apply column filters
+    Object.keys(columnFilters).forEach(column => {
+        const filterValue = columnFilters[column]
+        if (filterValue) {
+            filteredRows = filteredRows.filter(row =>
+                cellText(row[column]).toLowerCase().includes(filterValue.toLowerCase())
+            )
+        }
+    })
+
+    // Apply sorting
+    if (sortConfig.column) {
+        filteredRows.sort((a, b) => {
+            const aValue = a[sortConfig.column]
+            const bValue = b[sortConfig.column]
+
+            if (aValue === null || aValue === undefined) return 1
+            if (bValue === null || bValue === undefined) return -1
+
+            let comparison = 0
+            if (typeof aValue === 'number' && typeof bValue === 'number') {
+                comparison = aValue - bValue
+            } else {
+                comparison = cellText(aValue).localeCompare(cellText(bValue))
+            }
+
+            return sortConfig.direction === 'asc' ? comparison : -comparison
+        })
+    }
+
+    return filteredRows
+}
+
 const ROW_HEIGHT_MAP = {
     compact: '10px',
     normal: '12px',
     comfortable: '16px'
 }
 
-function ResultsTable({ results, error, isLoading, executionTime, compact = true, lastRunAt, onClearResult }) {
+function ResultsTable({ results, error, isLoading, executionTime, compact = true, lastRunAt, onClearResult, onExportFull }) {
     const [currentPage, setCurrentPage] = useState(1)
     const [isFullScreen, setIsFullScreen] = useState(false)
     const [globalFilter, setGlobalFilter] = useState('')
@@ -119,6 +166,41 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
         }
     }, [settings])
 
+    // Server-side view of large results: { rows, filteredCount } for the current page
+    const [serverView, setServerView] = useState(null)
+    const useServerView = Boolean(results?.resultId) && (results?.rows?.length || 0) >= SERVER_VIEW_MIN_ROWS
+
+    useEffect(() => {
+        setServerView(null)
+    }, [results])
+
+    useEffect(() => {
+        if (!useServerView) return
+        const controller = new AbortController()
+        // Debounced so typing in a filter sends one request per pause, not per keystroke
+        const timer = setTimeout(() => {
+            fetchResultView(results.resultId, {
+                globalFilter: globalFilter || null,
+                columnFilters,
+                sort: sortConfig.column ? [{ column: sortConfig.column, direction: sortConfig.direction }] : [],
+                offset: (currentPage - 1) * rowsPerPage,
+                limit: rowsPerPage
+            }, controller.signal)
+                // null: the backend no longer has the result, so fall back to filtering here
+                .then(view => setServerView(view || { unavailable: true }))
+                .catch(err => {
+                    if (err.name !== 'AbortError') {
+                        console.error('Failed to load result view:', err)
+                        setServerView({ unavailable: true })
+                    }
+                })
+        }, 100)
+        return () => {
+            clearTimeout(timer)
+            controller.abort()
+        }
+    }, [useServerView, results, globalFilter, columnFilters, sortConfig, currentPage])
+
     // Error state management
     const [isErrorExpanded, setIsErrorExpanded] = useState(false)
 
@@ -200,50 +282,18 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
 
     const { columns, rows } = results
 
+    // Small results are filtered and sorted here; large ones by the backend (exports still run here)
+    const serverMode = useServerView && !serverView?.unavailable
+    const getFilteredRows = () => filterAndSortRows(rows, globalFilter, columnFilters, sortConfig)
+    const filteredRows = serverMode ? null : getFilteredRows()
+    const filteredCount = serverMode ? (serverView?.filteredCount ?? rows.length) : filteredRows.length
 
-
-    // Apply global filter
-    let filteredRows = rows.filter(row => {
-        if (!globalFilter) return true
-        return Object.values(row).some(value =>
-            String(value).toLowerCase().includes(globalFilter.toLowerCase())
-        )
-    })
-
-    // Apply column filters
-    Object.keys(columnFilters).forEach(column => {
-        const filterValue = columnFilters[column]
-        if (filterValue) {
-            filteredRows = filteredRows.filter(row =>
-                String(row[column]).toLowerCase().includes(filterValue.toLowerCase())
-            )
-        }
-    })
-
-    // Apply sorting
-    if (sortConfig.column) {
-        filteredRows.sort((a, b) => {
-            const aValue = a[sortConfig.column]
-            const bValue = b[sortConfig.column]
-
-            if (aValue === null || aValue === undefined) return 1
-            if (bValue === null || bValue === undefined) return -1
-
-            let comparison = 0
-            if (typeof aValue === 'number' && typeof bValue === 'number') {
-                comparison = aValue - bValue
-            } else {
-                comparison = String(aValue).localeCompare(String(bValue))
-            }
-
-            return sortConfig.direction === 'asc' ? comparison : -comparison
-        })
-    }
-
-    const totalPages = Math.ceil(filteredRows.length / rowsPerPage)
+    const totalPages = Math.ceil(filteredCount / rowsPerPage)
     const startIndex = (currentPage - 1) * rowsPerPage
     const endIndex = startIndex + rowsPerPage
-    const currentRows = filteredRows.slice(startIndex, endIndex)
+    const currentRows = serverMode
+        ? (serverView ? serverView.rows : rows.slice(startIndex, endIndex))
+        : filteredRows.slice(startIndex, endIndex)
 
     const handlePreviousPage = () => {
         setCurrentPage(prev => Math.max(1, prev - 1))
@@ -291,6 +341,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
     // Export as CSV (download)
     const exportAsCSV = () => {
         if (!results) return
+        const exportRows = getFilteredRows()
 
         const { columns, rows } = results
         const csvRows = []
@@ -299,13 +350,13 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
         csvRows.push(columns.join(','))
 
         // Add data rows
-        filteredRows.forEach(row => {
+        exportRows.forEach(row => {
             const values = columns.map(col => {
                 const val = row[col]
                 // Handle null/undefined
                 if (val === null || val === undefined) return ''
                 // Escape quotes and wrap in quotes if contains comma
-                const stringVal = String(val)
+                const stringVal = cellText(val)
                 if (stringVal.includes(',') || stringVal.includes('"') || stringVal.includes('\n')) {
                     return `"${stringVal.replace(/"/g, '""')}"`
                 }
@@ -330,6 +381,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
     // Export as PDF (download)
     const exportAsPDF = async () => {
         if (!results) return
+        const exportRows = getFilteredRows()
 
         try {
             // Dynamic import of jsPDF
@@ -346,16 +398,16 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
 
             // Add execution info
             doc.setFontSize(10)
-            doc.text(`Rows: ${filteredRows.length}`, 14, 22)
+            doc.text(`Rows: ${exportRows.length}`, 14, 22)
             if (executionTime) {
                 doc.text(`Execution Time: ${executionTime}ms`, 14, 28)
             }
 
             // Prepare table data
-            const tableData = filteredRows.map(row =>
+            const tableData = exportRows.map(row =>
                 columns.map(col => {
                     const val = row[col]
-                    return val !== null && val !== undefined ? String(val) : 'NULL'
+                    return val !== null && val !== undefined ? cellText(val) : 'NULL'
                 })
             )
 
@@ -377,11 +429,23 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
         }
     }
 
+    // Export the complete result from the backend (not just the rows loaded here)
+    const handleExportFull = async (option) => {
+        setShowDownloadMenu(false)
+        try {
+            await onExportFull(option)
+        } catch (error) {
+            console.error('Error exporting result:', error)
+            alert(`Export failed: ${error.message}`)
+        }
+    }
+
     // Copy as JSON
     const copyAsJSON = () => {
         if (!results) return
+        const exportRows = getFilteredRows()
 
-        const jsonData = JSON.stringify(filteredRows, null, 2)
+        const jsonData = JSON.stringify(exportRows, null, 2)
         navigator.clipboard.writeText(jsonData).then(() => {
             alert('Copied as JSON to clipboard!')
             setShowExportMenu(false)
@@ -394,6 +458,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
     // Copy as CSV
     const copyAsCSV = () => {
         if (!results) return
+        const exportRows = getFilteredRows()
 
         const { columns, rows } = results
         const csvRows = []
@@ -402,11 +467,11 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
         csvRows.push(columns.join(','))
 
         // Add data rows
-        filteredRows.forEach(row => {
+        exportRows.forEach(row => {
             const values = columns.map(col => {
                 const val = row[col]
                 if (val === null || val === undefined) return ''
-                const stringVal = String(val)
+                const stringVal = cellText(val)
                 if (stringVal.includes(',') || stringVal.includes('"') || stringVal.includes('\n')) {
                     return `"${stringVal.replace(/"/g, '""')}"`
                 }
@@ -429,6 +494,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
     // Copy as Table (TSV)
     const copyAsTable = () => {
         if (!results) return
+        const exportRows = getFilteredRows()
 
         const { columns, rows } = results
         const tsvRows = []
@@ -437,12 +503,12 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
         tsvRows.push(columns.join('\t'))
 
         // Add data rows
-        filteredRows.forEach(row => {
+        exportRows.forEach(row => {
             const values = columns.map(col => {
                 const val = row[col]
                 if (val === null || val === undefined) return ''
                 // Replace tabs and newlines with spaces to maintain table structure
-                return String(val).replace(/[\t\n\r]/g, ' ')
+                return cellText(val).replace(/[\t\n\r]/g, ' ')
             })
             tsvRows.push(values.join('\t'))
         })
@@ -480,8 +546,8 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
                 <div className="results-header-left">
                     <CheckCircleIcon size={16} className="success-icon" />
                     <Text className="results-title">Query Results</Text>
-                    <div className="results-badge">{filteredRows.length} rows</div>
-                    {filteredRows.length !== rows.length && (
+                    <div className="results-badge">{filteredCount} rows</div>
+                    {filteredCount !== rows.length && (
                         <div className="results-badge filtered">
                             {rows.length} total
                         </div>
@@ -573,7 +639,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
                             className={`icon-button ${showDownloadMenu ? 'active' : ''}`}
                             onClick={() => setShowDownloadMenu(!showDownloadMenu)}
                             title="Download results"
-                            disabled={!results || filteredRows.length === 0}
+                            disabled={!results || filteredCount === 0}
                         >
                             <DownloadIcon size={16} />
                         </button>
@@ -596,6 +662,22 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
                                     <FileIcon size={14} />
                                     <span>Download PDF</span>
                                 </button>
+
+                                {onExportFull && (
+                                    <>
+                                        <div className="export-menu-header">Export Full Result</div>
+                                        {EXPORT_OPTIONS.map(option => (
+                                            <button
+                                                key={option.label}
+                                                onClick={() => handleExportFull(option)}
+                                                className="export-menu-item"
+                                            >
+                                                <DownloadIcon size={14} />
+                                                <span>{option.label}</span>
+                                            </button>
+                                        ))}
+                                    </>
+                                )}
                             </div>
                         )}
                     </div>
@@ -606,7 +688,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
                             className={`icon-button ${showCopyMenu ? 'active' : ''}`}
                             onClick={() => setShowCopyMenu(!showCopyMenu)}
                             title="Copy options"
-                            disabled={!results || filteredRows.length === 0}
+                            disabled={!results || filteredCount === 0}
                         >
                             {copySuccess ? (
                                 <CheckIcon size={16} className="success-icon" />
@@ -734,7 +816,7 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
                                         >
                                             <div className="cell-content">
                                                 {row[column] !== null && row[column] !== undefined
-                                                    ? String(row[column])
+                                                    ? cellText(row[column])
                                                     : settings.showNullAsText
                                                         ? <span className="null-value">NULL</span>
                                                         : ''
@@ -762,8 +844,8 @@ function ResultsTable({ results, error, isLoading, executionTime, compact = true
             {totalPages > 1 && (
                 <div className="pagination">
                     <div className="pagination-info">
-                        {startIndex + 1}-{Math.min(endIndex, filteredRows.length)} of {filteredRows.length}
-                        {filteredRows.length !== rows.length && ` (filtered from ${rows.length})`}
+                        {startIndex + 1}-{Math.min(endIndex, filteredCount)} of {filteredCount}
+                        {filteredCount !== rows.length && ` (filtered from ${rows.length})`}
                     </div>
                     <div className="pagination-controls">
                         <button
@@ -11,6 +11,30 @@ import Notification from './Notification'
 import './Workspace.css'
 import { MdSettingsInputHdmi } from "react-icons/md";
 import ThemeSettings from './ThemeSettings'
+import { decodeQueryResult } from './queryResults'
+import { newQueryId, cancelQuery } from './queryCancellation'
+import { exportQueryResult } from './exportQuery'
+
+// Last schema (and its ETag) per connection, so reopening a workspace can revalidate with a 304
+const schemaCacheKey = (details) => 'schema:' + JSON.stringify([
+    details.host, details.port, details.database, details.user, details.connectionString
+])
+
+const loadCachedSchema = (details) => {
+    try {
+        return JSON.parse(sessionStorage.getItem(schemaCacheKey(details)))
+    } catch {
+        return null
+    }
+}
+
+const storeCachedSchema = (details, etag, schema) => {
+    try {
+        sessionStorage.setItem(schemaCacheKey(details), JSON.stringify({ etag, schema }))
+    } catch {
+        // Large schemas can exceed the storage quota; the server-side cache still applies
+    }
+}
 
 
 function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateConnection, toggleTheme, themeMode, setThemeMode }) {
@@ -40,6 +64,8 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
     const containerRef = useRef(null)
     const resizerRef = useRef(null)
     const abortControllerRef = useRef(null)
+    // The last successful query, for full-result exports: { request, resultId }
+    const lastExportRef = useRef(null)
     const [notification, setNotification] = useState(null)
     const [isConnectionFailureModalOpen, setIsConnectionFailureModalOpen] = useState(false)
 
@@ -55,10 +81,12 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
         const fetchSchema = async () => {
             setIsLoadingSchema(true)
             try {
+                const cached = loadCachedSchema(connectionDetails)
                 const response = await fetch('http://localhost:8000/api/schema', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
+                        ...(cached?.etag ? { 'If-None-Match': cached.etag } : {}),
                     },
                     body: JSON.stringify({
                         host: connectionDetails.host,
@@ -71,10 +99,16 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
                     }),
                 })
 
-                if (!response.ok) {
-                    throw new Error('Failed to fetch schema')
+                let data
+                if (response.status === 304 && cached?.schema) {
+                    data = cached.schema
+                } else {
+                    if (!response.ok) {
+                        throw new Error('Failed to fetch schema')
+                    }
+                    data = await response.json()
+                    storeCachedSchema(connectionDetails, response.headers.get('ETag'), data)
                 }
-                const data = await response.json()
                 setSchema(data)
                 setIsConnected(true)
 
@@ -99,19 +133,23 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
     const handleCancelExecution = () => {
         if (abortControllerRef.current) {
             abortControllerRef.current.abort()
+            cancelQuery(abortControllerRef.current.queryId)
             abortControllerRef.current = null
             setIsExecuting(false)
             setQueryError('Query execution cancelled by user')
         }
     }
 
-    const handleExecuteQuery = async (query) => {
+    const handleExecuteQuery = async (query, rowLimit = null) => {
         // Cancel any existing execution
         if (abortControllerRef.current) {
             abortControllerRef.current.abort()
+            cancelQuery(abortControllerRef.current.queryId)
         }
 
+        // The query ID lets the backend stop the statement if this run is cancelled
         const controller = new AbortController()
+        controller.queryId = newQueryId()
         abortControllerRef.current = controller
         const signal = controller.signal
 
@@ -120,6 +158,18 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
         setQueryResults(null)
         setExecutionTime(null)
 
+        const queryRequest = {
+            query: query,
+            host: connectionDetails.host,
+            port: connectionDetails.port,
+            database: connectionDetails.database,
+            user: connectionDetails.user,
+            username: connectionDetails.username,
+            password: connectionDetails.password,
+            connectionString: connectionDetails.connectionString,
+            db_type: database.id // 'mysql' or 'postgresql'
+        }
+
         try {
             const response = await fetch('http://localhost:8000/api/execute-query', {
                 method: 'POST',
@@ -127,15 +177,11 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    query: query,
-                    host: connectionDetails.host,
-                    port: connectionDetails.port,
-                    database: connectionDetails.database,
-                    user: connectionDetails.user,
-                    username: connectionDetails.username,
-                    password: connectionDetails.password,
-                    connectionString: connectionDetails.connectionString,
-                    db_type: database.id // 'mysql' or 'postgresql'
+                    ...queryRequest,
+                    format: 'columnar',
+                    keepResult: true,
+                    rowLimit: rowLimit,
+                    queryId: controller.queryId
                 }),
                 signal: signal
             })
@@ -143,12 +189,13 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
             const data = await response.json()
 
             if (data.success) {
-                setQueryResults({
-                    columns: data.columns,
-                    rows: data.rows,
-                    rowCount: data.rowCount
-                })
+                setQueryResults(decodeQueryResult(data))
                 setExecutionTime(data.executionTime)
+                // A kept result can be exported as is, unless a run limit or cap cut it short
+                lastExportRef.current = {
+                    request: queryRequest,
+                    resultId: rowLimit === null && !data.truncated ? data.resultId : null
+                }
             } else {
                 setQueryError(data.error || 'Query execution failed')
             }
@@ -167,6 +214,12 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
         }
     }
 
+    const handleExportFull = (option) => {
+        if (!lastExportRef.current) return
+        const { request, resultId } = lastExportRef.current
+        return exportQueryResult({ ...request, resultId }, option)
+    }
+
     // Handle mouse events for resizing
     const handleMouseDown = (e) => {
         setIsResizing(true)
@@ -360,6 +413,7 @@ function Workspace({ database, connectionDetails, onDisconnect, theme, onUpdateC
                                 error={queryError}
                                 isLoading={isExecuting}
                                 executionTime={executionTime}
+                                onExportFull={handleExportFull}
                                 compact
                             />
                         </div>
@@ -0,0 +1,68 @@
+/**
+ * Run a connection test through its server-sent events endpoint (`<endpoint>/stream`)
+ *
+ * onStep is called with each step when it starts and again when it settles
+ * (steps are identified by `id`). Resolves with the final ConnectionResponse,
+ * the same object the non-streaming endpoint returns.
+ */
+export async function streamConnectionTest(endpoint, body, { signal, onStep } = {}) {
+    const response = await fetch(`${endpoint}/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body),
+        signal
+    })
+
+    if (!response.ok || !response.body) {
+        throw new Error(`Connection test failed (HTTP ${response.status})`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+
+    while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        // Events are separated by a blank line
+        let boundary
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary)
+            buffer = buffer.slice(boundary + 2)
+
+            let event = 'message'
+            const data = []
+            for (const line of message.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim()
+                else if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+            }
+            if (data.length === 0) continue
+
+            const payload = JSON.parse(data.join('\n'))
+            if (event === 'step') {
+                onStep?.(payload)
+            } else if (event === 'result') {
+                result = payload
+            }
+        }
+    }
+
+    if (!result) {
+        throw new Error('Connection test ended without a result')
+    }
+    return result
+}
+
+/** Replace the step with the same id, or append it */
+export function mergeStep(steps, step) {
+    const index = steps.findIndex(s => s.id === step.id)
+    if (index === -1) return [...steps, step]
+    const next = [...steps]
+    next[index] = step
+    return next
+}
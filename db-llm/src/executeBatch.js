@@ -0,0 +1,37 @@
+/**
+ * Notebook Run All through /api/execute-batch
+ *
+ * One request carries the connection details and every statement. The backend runs
+ * independent statements in parallel and session-dependent ones (SET, variables, temp
+ * tables) in order on one connection, streaming each result back as NDJSON as soon as
+ * it is ready. onResult gets every statement's event: { index, id, success, ... } with
+ * the same fields as an /api/execute-query response.
+ */
+export async function executeBatch(body, onResult, signal) {
+    const response = await fetch('http://localhost:8000/api/execute-batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+        signal
+    })
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}))
+        throw new Error(data.detail || `Run All failed (${response.status})`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffered = ''
+    while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffered += decoder.decode(value, { stream: true })
+        const lines = buffered.split('\n')
+        buffered = lines.pop()
+        for (const line of lines) {
+            if (!line.trim()) continue
+            const event = JSON.parse(line)
+            if (event.type === 'result') onResult(event)
+        }
+    }
+}
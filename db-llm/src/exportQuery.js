@@ -0,0 +1,58 @@
+/**
+ * Full-result export through /api/export
+ *
+ * The backend streams the complete result from a server-side cursor as CSV, JSON Lines or
+ * Parquet, so large extracts never pass through the results table. Where the browser
+ * supports showSaveFilePicker the download is piped straight to disk; otherwise it is
+ * collected into a Blob first.
+ */
+export const EXPORT_OPTIONS = [
+    { label: 'CSV (gzip)', exportFormat: 'csv', compression: 'gzip', extension: 'csv.gz' },
+    { label: 'JSON Lines (gzip)', exportFormat: 'jsonl', compression: 'gzip', extension: 'jsonl.gz' },
+    { label: 'Parquet', exportFormat: 'parquet', compression: null, extension: 'parquet' }
+]
+
+// request: the /api/execute-query body to export (plus resultId to reuse a kept result)
+export async function exportQueryResult(request, option) {
+    const fileName = `query_results_${Date.now()}`
+
+    // Ask for the target file first - the picker has to open within the click
+    let fileHandle = null
+    if (window.showSaveFilePicker) {
+        try {
+            fileHandle = await window.showSaveFilePicker({ suggestedName: `${fileName}.${option.extension}` })
+        } catch (err) {
+            if (err.name === 'AbortError') return false
+            throw err
+        }
+    }
+
+    const response = await fetch('http://localhost:8000/api/export', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            ...request,
+            exportFormat: option.exportFormat,
+            compression: option.compression,
+            fileName
+        })
+    })
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}))
+        throw new Error(data.detail || `Export failed (${response.status})`)
+    }
+
+    if (fileHandle) {
+        await response.body.pipeTo(await fileHandle.createWritable())
+    } else {
+        const url = URL.createObjectURL(await response.blob())
+        const link = document.createElement('a')
+        link.href = url
+        link.download = `${fileName}.${option.extension}`
+        document.body.appendChild(link)
+        link.click()
+        document.body.removeChild(link)
+        URL.revokeObjectURL(url)
+    }
+    return true
+}
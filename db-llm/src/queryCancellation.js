@@ -0,0 +1,18 @@
+/**
+ * Server-side query cancellation
+ *
+ * Each execution sends a fresh `queryId`; cancelQuery asks the backend to stop that
+ * statement on the database (KILL QUERY / pg cancel / killOp). Aborting the fetch
+ * also cancels it once the backend notices the disconnect - this just makes it immediate.
+ */
+export function newQueryId() {
+    return crypto.randomUUID()
+}
+
+export function cancelQuery(queryId) {
+    if (!queryId) return
+    fetch(`http://localhost:8000/api/queries/${encodeURIComponent(queryId)}/cancel`, { method: 'POST' })
+        .catch(() => {
+            // Already finished, or the backend is unreachable - nothing left to cancel
+        })
+}
@@ -0,0 +1,56 @@
+/**
+ * Query Pilot completions through /api/query-pilot/stream (server-sent events)
+ *
+ * onToken is called with each chunk of text as the model generates it. Resolves with
+ * the whole completion. Aborting the signal closes the stream, and the backend then
+ * stops the generation.
+ */
+export async function streamQueryPilot(body, { signal, onToken } = {}) {
+    const response = await fetch('http://localhost:8000/api/query-pilot/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+        signal
+    })
+
+    if (!response.ok || !response.body) {
+        const err = await response.json().catch(() => ({ detail: 'LLM request failed' }))
+        throw new Error(err.detail || 'LLM request failed')
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+
+    while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        // Events are separated by a blank line
+        let boundary
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary)
+            buffer = buffer.slice(boundary + 2)
+
+            let event = 'message'
+            const data = []
+            for (const line of message.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim()
+                else if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+            }
+            if (data.length === 0) continue
+
+            const payload = JSON.parse(data.join('\n'))
+            if (event === 'token') {
+                onToken?.(payload.text)
+            } else if (event === 'result') {
+                return payload.sql
+            } else if (event === 'error') {
+                throw new Error(payload.error || 'LLM request failed')
+            }
+        }
+    }
+
+    throw new Error('LLM response ended early')
+}
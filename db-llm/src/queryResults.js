@@ -0,0 +1,73 @@
+/**
+ * Decode an /api/execute-query response into { columns, columnTypes, rows, rowCount, resultId }
+ *
+ * The backend can send results in three encodings:
+ * - 'rows' (default): rows is already an array of objects
+ * - 'arrays': column names once, data holds one array per row
+ * - 'columnar': data holds one array per column; columns listed in
+ *   `dictionaries` hold integer codes into that column's dictionary
+ */
+export function decodeQueryResult(data) {
+    const columns = data.columns || []
+    const columnTypes = data.columnTypes || []
+
+    if (!data.format || data.format === 'rows') {
+        return { columns, columnTypes, rows: data.rows || [], rowCount: data.rowCount, resultId: data.resultId }
+    }
+
+    const values = data.data || []
+    let rows
+
+    if (data.format === 'arrays') {
+        rows = values.map(row => {
+            const obj = {}
+            for (let i = 0; i < columns.length; i++) {
+                obj[columns[i]] = row[i]
+            }
+            return obj
+        })
+    } else {
+        const dictionaries = data.dictionaries || {}
+        const decoded = columns.map((column, i) => {
+            const dictionary = dictionaries[column]
+            return dictionary ? values[i].map(code => dictionary[code]) : values[i]
+        })
+        const rowCount = decoded.length ? decoded[0].length : 0
+        rows = new Array(rowCount)
+        for (let r = 0; r < rowCount; r++) {
+            const obj = {}
+            for (let i = 0; i < columns.length; i++) {
+                obj[columns[i]] = decoded[i][r]
+            }
+            rows[r] = obj
+        }
+    }
+
+    return { columns, columnTypes, rows, rowCount: data.rowCount, resultId: data.resultId }
+}
+
+/**
+ * A cell value as text. JSON and array columns arrive as objects, which are shown as JSON.
+ */
+export function cellText(value) {
+    return value !== null && typeof value === 'object' ? JSON.stringify(value) : String(value)
+}
+
+/**
+ * Filter, sort and window a result the backend kept (keepResult), without re-running the query.
+ * view: { globalFilter, columnFilters, sort: [{ column, direction }], offset, limit }
+ * Resolves to { rows, filteredCount, totalRows }, or null when the result is no longer kept.
+ */
+export async function fetchResultView(resultId, view, signal) {
+    const response = await fetch(`http://localhost:8000/api/results/${encodeURIComponent(resultId)}/view`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ...view, format: 'columnar' }),
+        signal
+    })
+    if (response.status === 404) return null
+    if (!response.ok) throw new Error(`Result view failed (${response.status})`)
+    const data = await response.json()
+    const { rows } = decodeQueryResult(data)
+    return { rows, filteredCount: data.filteredCount, totalRows: data.totalRows }
+}